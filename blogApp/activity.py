@@ -0,0 +1,113 @@
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from .feed import decode_cursor, encode_cursor
+from .models import Message
+
+
+ACTIVITY_PAGE_SIZE = getattr(settings, 'ACTIVITY_PAGE_SIZE', 30)
+RECENT_ACTIVITY_SIZE = getattr(settings, 'RECENT_ACTIVITY_SIZE', 20)
+RECENT_ACTIVITY_KEY = 'blogApp:recent-activity'
+RECENT_ACTIVITY_TIMEOUT = getattr(settings, 'RECENT_ACTIVITY_TIMEOUT', 300)
+
+# Serializes the read-modify-write of the window between threads of this process only. Workers
+# sharing a cache can still overwrite each other's update, which loses a message from the window
+# until it expires and is reloaded.
+_lock = threading.Lock()
+
+
+def _activity():
+    return Message.objects.select_related('user', 'post').order_by('-created', '-id')
+
+
+def _before(queryset, cursor):
+    try:
+        created, pk = parse_datetime(cursor[0]), int(cursor[1])
+    except (ValueError, TypeError, IndexError):
+        return queryset
+    if created is None:
+        return queryset
+    return queryset.filter(Q(created__lt=created) | Q(created=created, id__lt=pk))
+
+
+def _activity_messages(cursor, q, user, post):
+    messages = _activity()
+    if q:
+        messages = messages.filter(post__category__name__icontains=q)
+    if user is not None:
+        messages = messages.filter(user=user)
+    if post is not None:
+        messages = messages.filter(post=post)
+    cursor = decode_cursor(cursor)
+    if cursor:
+        messages = _before(messages, cursor)
+    return messages
+
+
+def _activity_page(page, page_size):
+    has_more = len(page) > page_size
+    page = page[:page_size]
+    next_cursor = None
+    if has_more:
+        last = page[-1]
+        next_cursor = encode_cursor([last.created.isoformat(), last.id])
+    return page, next_cursor
+
+
+def get_activity_page(cursor=None, q='', user=None, post=None, page_size=ACTIVITY_PAGE_SIZE):
+    messages = _activity_messages(cursor, q, user, post)
+    return _activity_page(list(messages[:page_size + 1]), page_size)
+
+
+async def aget_activity_page(cursor=None, q='', user=None, post=None, page_size=ACTIVITY_PAGE_SIZE):
+    messages = _activity_messages(cursor, q, user, post)
+    return _activity_page([message async for message in messages[:page_size + 1]], page_size)
+
+
+# The newest messages site-wide. Kept in the cache and patched as messages are saved or deleted,
+# so the home sidebar does not query for them.
+def recent_activity():
+    window = cache.get(RECENT_ACTIVITY_KEY)
+    if window is None:
+        with _lock:
+            window = list(_activity()[:RECENT_ACTIVITY_SIZE])
+            cache.set(RECENT_ACTIVITY_KEY, window, RECENT_ACTIVITY_TIMEOUT)
+    return window
+
+
+def record_activity(message):
+    with _lock:
+        window = cache.get(RECENT_ACTIVITY_KEY)
+        if window is None:
+            return
+        window = [item for item in window if item.id != message.id]
+        oldest = window[-1] if len(window) >= RECENT_ACTIVITY_SIZE else None
+        if oldest is not None and (message.created, message.id) < (oldest.created, oldest.id):
+            return
+        if not (Message.user.is_cached(message) and Message.post.is_cached(message)):
+            # the cached copy has to carry its user and post, load both in one query
+            message = _activity().filter(id=message.id).first()
+            if message is None:
+                return
+        window.append(message)
+        window.sort(key=lambda item: (item.created, item.id), reverse=True)
+        cache.set(RECENT_ACTIVITY_KEY, window[:RECENT_ACTIVITY_SIZE], RECENT_ACTIVITY_TIMEOUT)
+
+
+def forget_activity(message_id):
+    with _lock:
+        window = cache.get(RECENT_ACTIVITY_KEY)
+        if window is not None and any(item.id == message_id for item in window):
+            # the window would come up short, let the next read refill it
+            cache.delete(RECENT_ACTIVITY_KEY)
+
+
+def refresh_activity_for(user_id=None, post_id=None):
+    # a renamed post or an edited profile is shown inside the window, so reload it when one is in there
+    window = cache.get(RECENT_ACTIVITY_KEY)
+    if window is not None and any(item.user_id == user_id or item.post_id == post_id for item in window):
+        cache.delete(RECENT_ACTIVITY_KEY)
@@ -6,4 +6,6 @@ from . import models
 admin.site.register(models.Post)
 admin.site.register(models.User)
 admin.site.register(models.Category)
-admin.site.register(models.Message)
\ No newline at end of file
+admin.site.register(models.Message)
+admin.site.register(models.Vote)
+admin.site.register(models.Task)
\ No newline at end of file
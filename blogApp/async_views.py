@@ -0,0 +1,133 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.contrib.auth.decorators import login_required
+from django.shortcuts import aget_object_or_404, render
+from django.utils.http import urlencode
+from django.views.decorators.http import condition
+
+from chat.conversations import aget_inbox_page
+from chat.presence import presence
+from . import views
+from .activity import RECENT_ACTIVITY_SIZE, aget_activity_page, recent_activity
+from .caching import aload_post_state, cache_anonymous_page, post_etag, post_last_modified
+from .categories import sidebar_categories
+from .detail import aload_post_detail
+from .feed import get_feed_page, get_home_feed, next_page_query
+from .models import User
+from .search import search_categories
+
+
+# Async versions of the read-heavy views in blogApp.views, routed instead of them when
+# settings.ASYNC_VIEWS is on. Single queries go through the async ORM. The feed, sidebar and recent
+# activity helpers mix cache reads, FTS lookups and several queries, so each of them runs in a thread
+# of its own (see in_own_thread) and independent ones run at the same time. Templates read fragment
+# caches and lazy relations synchronously, so they render in one of those threads too.
+
+READ_THREADS = getattr(settings, 'ASYNC_READ_THREADS', 4)
+_read_pool = ThreadPoolExecutor(max_workers=READ_THREADS, thread_name_prefix='async-read')
+
+
+def in_own_thread(func):
+    # database_sync_to_async and the async ORM share one thread, so gather() over them runs one call
+    # after the other. These reads share nothing with the request, so they run on a small pool of
+    # threads instead. Like request threads, each keeps its connection for CONN_MAX_AGE.
+    def call(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(call, thread_sensitive=False, executor=_read_pool)
+
+
+arender = in_own_thread(render)
+
+
+def _post_conditions(view):
+    conditional = condition(etag_func=post_etag, last_modified_func=post_last_modified)(view)
+
+    @wraps(view)
+    async def wrapper(request, pk):
+        # condition() reads the user and the post state synchronously, so load them here first
+        request.user = await request.auser()
+        await aload_post_state(request, pk)
+        return await conditional(request, pk=pk)
+    return wrapper
+
+
+@cache_anonymous_page('posts', 'activity', 'categories')
+async def home_view(request):
+    q = request.GET.get('q', '')
+
+    if q:
+        activity = aget_activity_page(q=q, page_size=RECENT_ACTIVITY_SIZE)
+    else:
+        activity = in_own_thread(recent_activity)()
+    (posts, next_cursor, post_count), post_messages, sidebar = await asyncio.gather(
+        in_own_thread(get_home_feed)(q, request.GET.get('cursor')),
+        activity,
+        in_own_thread(sidebar_categories)(),
+    )
+    if q:
+        post_messages, _ = post_messages
+
+    context = {'posts':posts, 'sidebar':sidebar, 'post_count':post_count, 'post_messages':post_messages,
+               'next_page': next_page_query(next_cursor, q)}
+    return await arender(request, 'blogApp/home.html', context)
+
+
+@_post_conditions
+@cache_anonymous_page('post:{pk}')
+async def post_view(request, pk):
+    if request.method == 'POST':
+        # adding a comment stays with the sync view
+        return await database_sync_to_async(views.post_view)(request, pk=pk)
+
+    context = await aload_post_detail(pk, request.user, request.GET.get('cursor'))
+    return await arender(request, 'blogApp/post.html', context)
+
+
+@cache_anonymous_page('posts', 'activity', 'categories', 'user:{pk}')
+async def profile_view(request, pk):
+    user = await aget_object_or_404(User, id=pk)
+    (posts, next_cursor), (post_messages, _), sidebar = await asyncio.gather(
+        in_own_thread(get_feed_page)(author=user),
+        aget_activity_page(user=user, page_size=RECENT_ACTIVITY_SIZE),
+        in_own_thread(sidebar_categories)(),
+    )
+    context = {'user':user, 'posts':posts, 'post_messages':post_messages, 'sidebar':sidebar,
+               'next_page': next_page_query(next_cursor, author=user)}
+    return await arender(request, 'blogApp/profile.html', context)
+
+
+@cache_anonymous_page('categories')
+async def category_page_view(request):
+    q = request.GET.get('q', '')
+    categories = await in_own_thread(lambda: list(search_categories(q)))()
+    return await arender(request, 'blogApp/categories.html', {'categories':categories})
+
+
+async def activity_page_view(request):
+    post_messages, next_cursor = await aget_activity_page(request.GET.get('cursor'))
+    next_page = urlencode({'cursor': next_cursor}) if next_cursor else ''
+    return await arender(request, 'blogApp/activity_page.html', {'post_messages':post_messages, 'next_page':next_page})
+
+
+@login_required(login_url='login')
+async def inbox(request):
+    page = request.GET.get('page', '1')
+    page = int(page) if page.isdigit() and int(page) > 0 else 1
+    user = await request.auser()
+    conversations, has_next = await aget_inbox_page(user, page)
+    online = await presence.aonline_users([conv['user'].id for conv in conversations])
+    for conv in conversations:
+        conv['online'] = conv['user'].id in online
+
+    context = {'conversations': conversations, 'page': page, 'has_next': has_next}
+    return await arender(request, 'blogApp/inbox.html', context)
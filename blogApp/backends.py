@@ -1,7 +1,20 @@
+from django.conf import settings
 from django.contrib.auth.backends import ModelBackend
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 
 
+# request.user and scope['user'] are loaded through here on every request, 0 turns the cache off
+USER_CACHE_TIMEOUT = getattr(settings, 'USER_CACHE_TIMEOUT', 30)
+
+
+def user_cache_key(user_id):
+    return f'blogApp:user:{user_id}'
+
+
+def forget_users(*user_ids):
+    cache.delete_many([user_cache_key(user_id) for user_id in user_ids])
+
 
 class EmailBackend(ModelBackend):
     def authenticate(self, request, email=None, password=None, **kwargs):
@@ -14,3 +27,29 @@ class EmailBackend(ModelBackend):
         if user.check_password(password):
             return user
         return None
+
+    def get_user(self, user_id):
+        if not USER_CACHE_TIMEOUT:
+            return super().get_user(user_id)
+        key = user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            try:
+                user = get_user_model()._default_manager.get(pk=user_id)
+            except get_user_model().DoesNotExist:
+                return None
+            cache.set(key, user, USER_CACHE_TIMEOUT)
+        return user if self.user_can_authenticate(user) else None
+
+    async def aget_user(self, user_id):
+        if not USER_CACHE_TIMEOUT:
+            return await super().aget_user(user_id)
+        key = user_cache_key(user_id)
+        user = await cache.aget(key)
+        if user is None:
+            try:
+                user = await get_user_model()._default_manager.aget(pk=user_id)
+            except get_user_model().DoesNotExist:
+                return None
+            await cache.aset(key, user, USER_CACHE_TIMEOUT)
+        return user if self.user_can_authenticate(user) else None
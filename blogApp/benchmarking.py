@@ -0,0 +1,370 @@
+import asyncio
+import random
+import statistics
+import threading
+import time
+import uuid
+import zlib
+
+from channels.testing import HttpCommunicator, WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from importlib import import_module
+
+from chat.conversations import record_messages
+from chat.models import PrivateMessage
+from chat.notifications import notifications
+from chat.wire import CODECS
+from .models import Category, Message, Post, User, Vote
+from . import search
+from .categories import recount_post_counts
+from .profiling import request_log
+
+
+DEFAULT_SCALE = {
+    'users': 200,
+    'categories': 20,
+    'posts': 2000,
+    'messages': 10000,
+    'votes': 20000,
+    'private_messages': 10000,
+}
+
+BATCH = 1000
+
+
+def _chunks(items, size=BATCH):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def seed(scale, seed_value=0):
+    rng = random.Random(seed_value)
+    password = make_password('benchmark')
+
+    with transaction.atomic():
+        User.objects.bulk_create(
+            [
+                User(username=f'bench{i}', email=f'bench{i}@example.com', fullname=f'Bench User {i}', password=password)
+                for i in range(scale['users'])
+            ],
+            batch_size=BATCH,
+        )
+        user_ids = list(User.objects.filter(username__startswith='bench').values_list('id', flat=True))
+
+        Category.objects.bulk_create([Category(name=f'topic-{i}') for i in range(scale['categories'])])
+        category_ids = list(Category.objects.values_list('id', flat=True))
+
+        words = ['django', 'python', 'async', 'sqlite', 'channels', 'cache', 'index', 'query', 'feed', 'vote']
+        Post.objects.bulk_create(
+            [
+                Post(
+                    title=' '.join(rng.sample(words, 3)) + f' {i}',
+                    description=' '.join(rng.choices(words, k=30)),
+                    category_id=rng.choice(category_ids),
+                    created_by_id=rng.choice(user_ids),
+                )
+                for i in range(scale['posts'])
+            ],
+            batch_size=BATCH,
+        )
+        post_ids = list(Post.objects.values_list('id', flat=True))
+
+        Message.objects.bulk_create(
+            [
+                Message(user_id=rng.choice(user_ids), post_id=rng.choice(post_ids), body=' '.join(rng.choices(words, k=12)))
+                for _ in range(scale['messages'])
+            ],
+            batch_size=BATCH,
+        )
+        Participant = Post.participants.through
+        participants = set(Message.objects.values_list('post_id', 'user_id'))
+        Participant.objects.bulk_create(
+            [Participant(post_id=post_id, user_id=user_id) for post_id, user_id in participants],
+            batch_size=BATCH,
+        )
+
+        votes = {}
+        for _ in range(scale['votes']):
+            votes[(rng.choice(post_ids), rng.choice(user_ids))] = rng.choice([Vote.UP, Vote.DOWN])
+        Vote.objects.bulk_create(
+            [Vote(post_id=post_id, user_id=user_id, value=value) for (post_id, user_id), value in votes.items()],
+            batch_size=BATCH,
+        )
+        counts = {}
+        for (post_id, _), value in votes.items():
+            up, down = counts.get(post_id, (0, 0))
+            counts[post_id] = (up + 1, down) if value == Vote.UP else (up, down + 1)
+        posts = [Post(id=post_id, upvote_count=up, downvote_count=down) for post_id, (up, down) in counts.items()]
+        Post.objects.bulk_update(posts, ['upvote_count', 'downvote_count'], batch_size=BATCH)
+
+        private_messages = []
+        for _ in range(scale['private_messages']):
+            sender, recipient = rng.sample(user_ids, 2)
+            private_messages.append(PrivateMessage(sender_id=sender, recipient_id=recipient, body=' '.join(rng.choices(words, k=8))))
+        for batch in _chunks(private_messages):
+            PrivateMessage.objects.bulk_create(batch)
+            record_messages(batch)
+
+    recount_post_counts()
+    search.rebuild_index()
+    return {
+        'users': user_ids,
+        'posts': post_ids,
+    }
+
+
+def session_cookie(user):
+    engine = import_module(settings.SESSION_ENGINE)
+    session = engine.SessionStore()
+    session[SESSION_KEY] = str(user.pk)
+    session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.save()
+    return f'{settings.SESSION_COOKIE_NAME}={session.session_key}'
+
+
+def _headers(cookie=None):
+    headers = [(b'host', b'localhost'), (b'x-forwarded-proto', b'https')]
+    if cookie:
+        headers.append((b'cookie', cookie.encode()))
+    return headers
+
+
+def summarize(name, latencies, elapsed, errors, **extra):
+    latencies = sorted(latencies)
+    result = {
+        'scenario': name,
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'throughput': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'p50_ms': round(statistics.median(latencies) * 1000, 2) if latencies else None,
+        'p99_ms': round(latencies[max(int(len(latencies) * 0.99) - 1, 0)] * 1000, 2) if latencies else None,
+    }
+    result.update(extra)
+    return result
+
+
+# name -> (needs a logged in user, builds a path from the seeded ids)
+HTTP_SCENARIOS = {
+    'home': (False, lambda rng, data: '/'),
+    'search': (False, lambda rng, data: '/?q=django'),
+    'post': (False, lambda rng, data: f"/post/{rng.choice(data['posts'])}/"),
+    'profile': (False, lambda rng, data: f"/profile/{rng.choice(data['users'])}/"),
+    'categories': (False, lambda rng, data: '/categories/'),
+    'activity': (False, lambda rng, data: '/activity-page/'),
+    # logged in users skip the anonymous page cache, so these render every time
+    'home_member': (True, lambda rng, data: '/'),
+    'post_member': (True, lambda rng, data: f"/post/{rng.choice(data['posts'])}/"),
+    'inbox': (True, lambda rng, data: '/messages/'),
+    'upvote': (True, lambda rng, data: f"/upvote-post/{rng.choice(data['posts'])}/"),
+    'downvote': (True, lambda rng, data: f"/downvote-post/{rng.choice(data['posts'])}/"),
+}
+
+
+async def run_http(application, name, data, cookies, requests, concurrency, seed_value=0):
+    needs_login, build_path = HTTP_SCENARIOS[name]
+    rng = random.Random(seed_value)
+    paths = [(build_path(rng, data), rng.choice(cookies) if needs_login else None) for _ in range(requests)]
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def one(path, cookie):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            communicator = HttpCommunicator(application, 'GET', path, headers=_headers(cookie))
+            try:
+                response = await communicator.get_response(timeout=60)
+            except Exception:
+                errors += 1
+                return
+            finally:
+                # let the handler see the client go away so it finishes cleanly
+                await communicator.send_input({'type': 'http.disconnect'})
+                await communicator.wait()
+            if response['status'] >= 400:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - started)
+
+    threads_peak = threading.active_count()
+    done = asyncio.Event()
+
+    async def count_threads():
+        nonlocal threads_peak
+        while not done.is_set():
+            threads_peak = max(threads_peak, threading.active_count())
+            await asyncio.sleep(0.005)
+
+    request_log.clear()
+    sampler = asyncio.create_task(count_threads())
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    await asyncio.gather(*(one(path, cookie) for path, cookie in paths))
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+    done.set()
+    await sampler
+    # filled in by RequestProfilingMiddleware when it is on
+    queries = [entry['queries'] for entry in request_log.entries()]
+    return summarize(
+        f'http:{name}', latencies, elapsed, errors, concurrency=concurrency,
+        queries_per_request=round(statistics.mean(queries), 2) if queries else None,
+        threads_peak=threads_peak,
+        cpu_ms_per_request=round(cpu * 1000 / requests, 3),
+    )
+
+
+# benchmark name -> subprotocol, see chat.wire
+WIRE_PROTOCOLS = {
+    'json': None,
+    'json_batched': 'devden.json',
+    'msgpack': 'devden.msgpack',
+    'cbor': 'devden.cbor',
+}
+
+
+def _encode_cost(codec, payloads, seconds=0.2):
+    # CPU time the server spends encoding one frame, measured on the frames the run received
+    if not payloads:
+        return None
+    encoded = 0
+    started = time.process_time()
+    while time.process_time() - started < seconds:
+        for payload in payloads:
+            codec.frame(payload)
+        encoded += len(payloads)
+    return round((time.process_time() - started) * 1e6 / encoded, 2)
+
+
+async def run_private_chat(application, users, cookies, clients, messages_per_client, protocol='json'):
+    # clients are paired up and every message is timed until its echo comes back through the group
+    codec = CODECS[WIRE_PROTOCOLS[protocol]]
+    subprotocols = [codec.subprotocol] if codec.subprotocol else None
+    pairs = []
+    for index in range(0, clients - clients % 2, 2):
+        first, second = users[index], users[index + 1]
+        pairs.append((cookies[index], second.username))
+        pairs.append((cookies[index + 1], first.username))
+
+    communicators = []
+    for cookie, other in pairs:
+        communicator = WebsocketCommunicator(
+            application, f'/ws/pm/{other}/', headers=_headers(cookie), subprotocols=subprotocols,
+        )
+        connected, _ = await communicator.connect(timeout=10)
+        if connected:
+            communicators.append(communicator)
+
+    latencies, errors = [], 0
+    frame_bytes, deflated_bytes, events, payloads = 0, 0, 0, []
+
+    async def chat(communicator):
+        nonlocal errors, frame_bytes, deflated_bytes, events
+        # permessage-deflate with context takeover, the trailing 00 00 ff ff is not sent
+        compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+        for index in range(messages_per_client):
+            client_id = str(uuid.uuid4())
+            started = time.perf_counter()
+            await communicator.send_to(**codec.frame({'message': f'bench {index}', 'client_id': client_id}))
+            try:
+                while True:
+                    output = await communicator.receive_output(timeout=10)
+                    raw = output['bytes'] if output.get('bytes') is not None else output['text'].encode()
+                    frame_bytes += len(raw)
+                    deflated_bytes += len(compressor.compress(raw) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+                    data = codec.load(output.get('text'), output.get('bytes'))
+                    payloads.append(data)
+                    received = data if isinstance(data, list) else [data]
+                    events += len(received)
+                    if any(event.get('client_id') == client_id for event in received):
+                        latencies.append(time.perf_counter() - started)
+                        break
+            except asyncio.TimeoutError:
+                errors += 1
+
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    await asyncio.gather(*(chat(communicator) for communicator in communicators))
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+    for communicator in communicators:
+        await communicator.disconnect()
+
+    frames = len(payloads)
+    name = 'ws:private_chat' if protocol == 'json' else f'ws:private_chat:{protocol}'
+    return summarize(
+        name, latencies, elapsed, errors, clients=len(communicators),
+        frames=frames,
+        events_per_frame=round(events / frames, 2) if frames else None,
+        bytes_per_frame=round(frame_bytes / frames, 1) if frames else None,
+        bytes_per_event=round(frame_bytes / events, 1) if events else None,
+        deflate_bytes_per_event=round(deflated_bytes / events, 1) if events else None,
+        encode_us_per_frame=_encode_cost(codec, payloads),
+        # client and server share the process, so this is the CPU of both ends per delivered event
+        cpu_us_per_event=round(cpu * 1e6 / events, 1) if events else None,
+    )
+
+
+async def run_notifications(application, users, cookies, clients):
+    # Clients are paired up: one sends a private message, the other times it until the summary arrives
+    # on its notification socket. That includes the coalescing window of chat.notifications.
+    latencies, errors = [], 0
+
+    async def deliver(sender_cookie, recipient, recipient_cookie):
+        nonlocal errors
+        listener = WebsocketCommunicator(application, '/ws/notifications/', headers=_headers(recipient_cookie))
+        sender = WebsocketCommunicator(application, f'/ws/pm/{recipient.username}/', headers=_headers(sender_cookie))
+        connected = []
+        try:
+            for communicator in (listener, sender):
+                if not (await communicator.connect(timeout=10))[0]:
+                    errors += 1
+                    return
+                connected.append(communicator)
+            started = time.perf_counter()
+            await sender.send_json_to({'message': 'bench notification', 'client_id': str(uuid.uuid4())})
+            while True:
+                event = await listener.receive_json_from(timeout=10)
+                # unread counts and presence changes arrive on the same socket
+                if event.get('type') == 'notification':
+                    latencies.append(time.perf_counter() - started)
+                    break
+        except asyncio.TimeoutError:
+            errors += 1
+        finally:
+            for communicator in connected:
+                await communicator.disconnect()
+
+    pairs = [
+        (cookies[index], users[index + 1], cookies[index + 1])
+        for index in range(0, clients - clients % 2, 2)
+    ]
+    started = time.perf_counter()
+    await asyncio.gather(*(deliver(*pair) for pair in pairs))
+    elapsed = time.perf_counter() - started
+    return summarize(
+        'ws:notification_delivery', latencies, elapsed, errors, clients=len(pairs) * 2,
+        window_ms=notifications.window * 1000,
+    )
+
+
+def compare(previous, current):
+    before = {row['scenario']: row for row in previous.get('results', [])}
+    rows = []
+    for row in current['results']:
+        old = before.get(row['scenario'])
+        if not old or not old.get('throughput') or not row.get('throughput'):
+            continue
+        rows.append({
+            'scenario': row['scenario'],
+            'throughput_change': round((row['throughput'] - old['throughput']) / old['throughput'] * 100, 1),
+            'p99_change': round((row['p99_ms'] - old['p99_ms']) / old['p99_ms'] * 100, 1) if old.get('p99_ms') else None,
+            'queries': (old.get('queries_per_request'), row.get('queries_per_request')),
+            'threads': (old.get('threads_peak'), row.get('threads_peak')),
+        })
+    return rows
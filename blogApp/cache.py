@@ -0,0 +1,30 @@
+from django.core.cache.backends import locmem
+
+
+class LocMemCache(locmem.LocMemCache):
+    # The stock backend runs every async call on the sync thread although nothing here blocks, so
+    # async views and AuthMiddleware would hop threads just to read a dict
+
+    async def aadd(self, key, value, timeout=locmem.DEFAULT_TIMEOUT, version=None):
+        return self.add(key, value, timeout, version)
+
+    async def aget(self, key, default=None, version=None):
+        return self.get(key, default, version)
+
+    async def aset(self, key, value, timeout=locmem.DEFAULT_TIMEOUT, version=None):
+        self.set(key, value, timeout, version)
+
+    async def atouch(self, key, timeout=locmem.DEFAULT_TIMEOUT, version=None):
+        return self.touch(key, timeout, version)
+
+    async def aincr(self, key, delta=1, version=None):
+        return self.incr(key, delta, version)
+
+    async def adelete(self, key, version=None):
+        return self.delete(key, version)
+
+    async def ahas_key(self, key, version=None):
+        return self.has_key(key, version)
+
+    async def aclear(self):
+        self.clear()
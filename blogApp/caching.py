@@ -0,0 +1,133 @@
+import hashlib
+import time
+from datetime import datetime, timezone
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Post
+
+
+PAGE_CACHE_TIMEOUT = getattr(settings, 'PAGE_CACHE_TIMEOUT', 60)
+
+
+def _version_key(scope):
+    return f'blogApp:version:{scope}'
+
+
+# A scope's version is the time it last changed. Keys built from versions go stale by themselves
+# when something bumps the scope, so nothing has to find and delete cached entries.
+def get_versions(scopes):
+    keys = {_version_key(scope): scope for scope in scopes}
+    found = cache.get_many(list(keys))
+    missing = {key: time.time() for key in keys if key not in found}
+    if missing:
+        cache.set_many(missing, None)
+        found.update(missing)
+    return {keys[key]: value for key, value in found.items()}
+
+
+async def aget_versions(scopes):
+    keys = {_version_key(scope): scope for scope in scopes}
+    found = await cache.aget_many(list(keys))
+    missing = {key: time.time() for key in keys if key not in found}
+    if missing:
+        await cache.aset_many(missing, None)
+        found.update(missing)
+    return {keys[key]: value for key, value in found.items()}
+
+
+def get_version(scope):
+    return get_versions([scope])[scope]
+
+
+def bump_versions(*scopes):
+    # readers must not cache the old rows under the new version, so wait for the commit
+    def bump():
+        now = time.time()
+        cache.set_many({_version_key(scope): now for scope in scopes}, None)
+    transaction.on_commit(bump)
+
+
+def page_key(request, versions):
+    raw = '|'.join([
+        request.path,
+        request.GET.urlencode(),
+        *(f'{scope}={value}' for scope, value in sorted(versions.items())),
+    ])
+    return 'blogApp:page:' + hashlib.md5(raw.encode()).hexdigest()
+
+
+# Caches whole GET responses for anonymous visitors. Scopes are formatted with the view kwargs,
+# e.g. 'post:{pk}', and the page is rebuilt once any of them is bumped.
+def cache_anonymous_page(*scopes, timeout=PAGE_CACHE_TIMEOUT):
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                user = await request.auser()
+                if request.method != 'GET' or user.is_authenticated or 'messages' in request.COOKIES:
+                    return await view(request, *args, **kwargs)
+                versions = await aget_versions([scope.format(**kwargs) for scope in scopes])
+                key = page_key(request, versions)
+                response = await cache.aget(key)
+                if response is None:
+                    response = await view(request, *args, **kwargs)
+                    if response.status_code == 200 and not response.cookies:
+                        await cache.aset(key, response, timeout)
+                return response
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != 'GET' or request.user.is_authenticated or 'messages' in request.COOKIES:
+                return view(request, *args, **kwargs)
+            versions = get_versions([scope.format(**kwargs) for scope in scopes])
+            key = page_key(request, versions)
+            response = cache.get(key)
+            if response is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code == 200 and not response.cookies:
+                    cache.set(key, response, timeout)
+            return response
+        return wrapper
+    return decorator
+
+
+def _post_state(request, pk):
+    if not hasattr(request, '_post_state'):
+        updated = Post.objects.filter(id=pk).values_list('updated', flat=True).first()
+        request._post_state = (updated, get_version(f'post:{pk}') if updated else None)
+    return request._post_state
+
+
+# condition() calls the etag and last modified functions synchronously, async views load the state first
+async def aload_post_state(request, pk):
+    if not hasattr(request, '_post_state'):
+        updated = await Post.objects.filter(id=pk).values_list('updated', flat=True).afirst()
+        version = (await aget_versions([f'post:{pk}']))[f'post:{pk}'] if updated else None
+        request._post_state = (updated, version)
+    return request._post_state
+
+
+# Post.updated only moves when the post itself is edited, the post version also covers its
+# thread, votes and participants
+def post_last_modified(request, pk):
+    updated, version = _post_state(request, pk)
+    if updated is None:
+        return None
+    return max(updated, datetime.fromtimestamp(version, tz=timezone.utc))
+
+
+def post_etag(request, pk):
+    updated, version = _post_state(request, pk)
+    if updated is None:
+        return None
+    raw = '|'.join([
+        updated.isoformat(), str(version), str(request.user.pk), request.GET.urlencode(),
+        request.COOKIES.get('messages', ''),
+    ])
+    return hashlib.md5(raw.encode()).hexdigest()
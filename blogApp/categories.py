@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, F
+
+from .models import Category
+
+
+SIDEBAR_SIZE = getattr(settings, 'CATEGORY_SIDEBAR_SIZE', 6)
+SIDEBAR_TIMEOUT = getattr(settings, 'CATEGORY_SIDEBAR_TIMEOUT', 300)
+SIDEBAR_CACHE_KEY = 'blogApp:category-sidebar'
+
+
+def bump_post_count(category_id, delta):
+    if category_id is None:
+        return
+    Category.objects.filter(id=category_id).update(post_count=F('post_count') + delta)
+    invalidate_sidebar()
+
+
+def recount_post_counts():
+    for category in Category.objects.annotate(total=Count('post')):
+        if category.total != category.post_count:
+            Category.objects.filter(id=category.id).update(post_count=category.total)
+    invalidate_sidebar()
+
+
+# The busiest categories plus the total number of categories, cached until a post or category changes
+def sidebar_categories():
+    sidebar = cache.get(SIDEBAR_CACHE_KEY)
+    if sidebar is None:
+        sidebar = {
+            'categories': list(Category.objects.order_by('-post_count', 'name')[:SIDEBAR_SIZE]),
+            'total': Category.objects.count(),
+        }
+        cache.set(SIDEBAR_CACHE_KEY, sidebar, SIDEBAR_TIMEOUT)
+    return sidebar
+
+
+def invalidate_sidebar():
+    cache.delete(SIDEBAR_CACHE_KEY)
@@ -0,0 +1,44 @@
+import asyncio
+
+from django.conf import settings
+from django.shortcuts import aget_object_or_404, get_object_or_404
+from django.utils.http import urlencode
+
+from .activity import aget_activity_page, get_activity_page
+from .feed import with_feed_counts
+from .models import Post
+from .votes import auser_vote, user_vote
+
+
+THREAD_PAGE_SIZE = getattr(settings, 'THREAD_PAGE_SIZE', 50)
+PARTICIPANT_PREVIEW_SIZE = getattr(settings, 'PARTICIPANT_PREVIEW_SIZE', 20)
+
+
+def _detail_context(post, post_messages, next_cursor, vote):
+    for message in post_messages:
+        message.post = post
+    return {
+        'post': post,
+        'post_messages': post_messages,
+        'next_page': urlencode({'cursor': next_cursor}) if next_cursor else '',
+        # left lazy so a cached participants fragment skips the query
+        'participants': post.participants.all()[:PARTICIPANT_PREVIEW_SIZE],
+        'user_vote': vote,
+    }
+
+
+# Everything post.html needs in a fixed number of queries: the post with its author, category and
+# participant count, one page of the thread with users, a preview of participants and the viewer's vote
+def load_post_detail(post_id, user, cursor=None):
+    post = get_object_or_404(with_feed_counts(Post.objects.all()), id=post_id)
+    post_messages, next_cursor = get_activity_page(cursor, post=post, page_size=THREAD_PAGE_SIZE)
+    return _detail_context(post, post_messages, next_cursor, user_vote(post, user))
+
+
+async def aload_post_detail(post_id, user, cursor=None):
+    post = await aget_object_or_404(with_feed_counts(Post.objects.all()), id=post_id)
+    (post_messages, next_cursor), vote = await asyncio.gather(
+        aget_activity_page(cursor, post=post, page_size=THREAD_PAGE_SIZE),
+        auser_vote(post, user),
+    )
+    return _detail_context(post, post_messages, next_cursor, vote)
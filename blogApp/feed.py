@@ -0,0 +1,148 @@
+import base64
+import json
+
+from django.conf import settings
+from django.db.models import Count, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils.dateparse import parse_datetime
+from django.utils.http import urlencode
+
+from .models import Post
+from .search import search_posts
+
+
+FEED_PAGE_SIZE = getattr(settings, 'FEED_PAGE_SIZE', 20)
+FEED_ORDERING = ['-updated', '-created', '-id']
+
+
+def _count_subquery(through):
+    counts = (
+        through.objects.filter(post_id=OuterRef('pk'))
+        .order_by()
+        .values('post_id')
+        .annotate(total=Count('*'))
+        .values('total')
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def with_feed_counts(queryset):
+    return queryset.select_related('created_by', 'category').annotate(
+        participant_count=_count_subquery(Post.participants.through),
+    )
+
+
+def encode_cursor(value):
+    raw = json.dumps(value, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        value = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    return value if isinstance(value, list) and value else None
+
+
+def _after(queryset, cursor):
+    try:
+        _, updated, created, pk = cursor
+        updated, created, pk = parse_datetime(updated), parse_datetime(created), int(pk)
+    except (ValueError, TypeError):
+        return queryset
+    if updated is None or created is None:
+        return queryset
+    # the leading updated__lte lets SQLite range-scan post_feed_idx from the cursor, the OR alone is
+    # planned as a scan of the whole index
+    return queryset.filter(updated__lte=updated).filter(
+        Q(updated__lt=updated)
+        | Q(updated=updated, created__lt=created)
+        | Q(updated=updated, created=created, id__lt=pk)
+    )
+
+
+def _offset(cursor):
+    # a cursor is user input: anything but a plain non-negative int (bools, floats, -1) starts over
+    if cursor and len(cursor) == 2 and cursor[0] == 'o' and type(cursor[1]) is int and cursor[1] >= 0:
+        return cursor[1]
+    return 0
+
+
+def _search_page(q, posts, cursor, page_size):
+    # search results keep their rank order and are bounded, so page by offset
+    results = search_posts(q, posts)
+    offset = _offset(cursor)
+    page = list(with_feed_counts(results)[offset:offset + page_size + 1])
+    has_more = len(page) > page_size
+    next_cursor = encode_cursor(['o', offset + page_size]) if has_more else None
+    return page[:page_size], next_cursor, results
+
+
+def get_feed_page(q='', cursor=None, author=None, page_size=FEED_PAGE_SIZE):
+    posts = Post.objects.all()
+    if author is not None:
+        posts = posts.filter(created_by=author)
+    cursor = decode_cursor(cursor)
+
+    if q.strip():
+        page, next_cursor, _ = _search_page(q, posts, cursor, page_size)
+        return page, next_cursor
+
+    posts = posts.order_by(*FEED_ORDERING)
+    if cursor and cursor[0] == 'k':
+        posts = _after(posts, cursor)
+    page = list(with_feed_counts(posts)[:page_size + 1])
+    has_more = len(page) > page_size
+    page = page[:page_size]
+    next_cursor = None
+    if has_more:
+        last = page[-1]
+        next_cursor = encode_cursor(['k', last.updated.isoformat(), last.created.isoformat(), last.id])
+    return page, next_cursor
+
+
+def get_home_feed(q='', cursor=None, page_size=FEED_PAGE_SIZE):
+    # the feed page and the number of posts it is drawn from
+    if not q.strip():
+        page, next_cursor = get_feed_page(cursor=cursor, page_size=page_size)
+        return page, next_cursor, Post.objects.count()
+    cursor = decode_cursor(cursor)
+    page, next_cursor, results = _search_page(q, Post.objects.all(), cursor, page_size)
+    if next_cursor is None and _offset(cursor) == 0:
+        return page, next_cursor, len(page)
+    # with FTS results is filtered by the ids already matched, counting it does not search again
+    return page, next_cursor, results.count()
+
+
+def next_page_query(next_cursor, q='', author=None):
+    if not next_cursor:
+        return ''
+    params = {'cursor': next_cursor}
+    if q:
+        params['q'] = q
+    if author is not None:
+        params['author'] = author.id if hasattr(author, 'id') else author
+    return urlencode(params)
+
+
+def serialize_post(post):
+    author = post.created_by
+    return {
+        'id': post.id,
+        'title': post.title,
+        'category': post.category.name if post.category else None,
+        'created_by': {
+            'id': author.id,
+            'username': author.username,
+            'avatar_url': author.avatar_url,
+        } if author else None,
+        'participant_count': post.participant_count,
+        'upvotes': post.upvote_count,
+        'downvotes': post.downvote_count,
+        'created': post.created.isoformat(),
+        'updated': post.updated.isoformat(),
+    }
@@ -0,0 +1,72 @@
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.dispatch import Signal
+from PIL import Image, ImageOps
+
+
+# image field -> (rendition sizes in px, crop to a square)
+RENDITIONS = {
+    'avatar': ((64, 128), True),
+    'image': ((320, 960), False),
+}
+WEBP_QUALITY = getattr(settings, 'IMAGE_WEBP_QUALITY', 80)
+
+# sent with the model, pk and field once the renditions of an upload are stored
+renditions_ready = Signal()
+
+
+def needs_renditions(name):
+    return bool(name) and not name.startswith('static/') and not name.lower().endswith('.svg')
+
+
+def rendition_name(name, size):
+    stem, _ = os.path.splitext(name)
+    return f'{stem}.{size}.webp'
+
+
+def rendition_url(file, rendered, size):
+    # the original is served until the renditions for this exact upload exist
+    if rendered and file.name == rendered:
+        return file.storage.url(rendition_name(file.name, size))
+    return file.url
+
+
+def render(file, sizes, crop):
+    with file.storage.open(file.name) as handle:
+        image = ImageOps.exif_transpose(Image.open(handle))
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if image.mode in ('LA', 'P', 'PA') else 'RGB')
+
+    for size in sizes:
+        if crop:
+            resized = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+        else:
+            resized = image.copy()
+            resized.thumbnail((size, size), Image.Resampling.LANCZOS)
+        buffer = BytesIO()
+        resized.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=4)
+        name = rendition_name(file.name, size)
+        file.storage.delete(name)
+        file.storage.save(name, ContentFile(buffer.getvalue()))
+
+
+def make_renditions(model, pk, field_name):
+    instance = model.objects.filter(pk=pk).first()
+    file = getattr(instance, field_name, None)
+    if not file or not needs_renditions(file.name):
+        return False
+    sizes, crop = RENDITIONS[field_name]
+    # a failure propagates, so the task queue logs it and retries with backoff
+    render(file, sizes, crop)
+    # a newer upload may have replaced this one in the meantime, it gets its own job
+    updated = model.objects.filter(pk=pk, **{field_name: file.name}).update(
+        **{f'{field_name}_renditions': file.name}
+    )
+    if updated:
+        renditions_ready.send(sender=model, pk=pk, field_name=field_name)
+    return bool(updated)
+
@@ -0,0 +1,147 @@
+import asyncio
+import json
+import os
+import platform
+import time
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from blogApp import benchmarking
+from blogApp.models import Post, User
+
+
+class Command(BaseCommand):
+    help = 'Seed a throwaway database and benchmark the HTTP views and WebSocket consumers through the ASGI app'
+
+    def add_arguments(self, parser):
+        for name, default in benchmarking.DEFAULT_SCALE.items():
+            parser.add_argument(f"--{name.replace('_', '-')}", type=int, default=default, dest=name)
+        parser.add_argument('--requests', type=int, default=200, help='Requests per HTTP scenario')
+        parser.add_argument('--concurrency', type=int, default=10)
+        parser.add_argument('--clients', type=int, default=20, help='Simulated WebSocket clients')
+        parser.add_argument('--ws-messages', type=int, default=20, help='Messages sent by each chat client')
+        parser.add_argument(
+            '--protocols', default='json',
+            help=f"Comma separated wire protocols for the private_chat scenario: {', '.join(benchmarking.WIRE_PROTOCOLS)}",
+        )
+        parser.add_argument(
+            '--scenarios',
+            default=','.join([*benchmarking.HTTP_SCENARIOS, 'private_chat', 'notifications']),
+            help='Comma separated scenario names',
+        )
+        parser.add_argument('--db', default=str(settings.BASE_DIR / 'bench.sqlite3'), help='Benchmark database file')
+        parser.add_argument('--keepdb', action='store_true', help='Keep the seeded database and reuse it next run')
+        parser.add_argument('--output', help='Write the JSON results to this file')
+        parser.add_argument('--compare', help='Previous JSON results to compare against')
+        parser.add_argument(
+            '--no-query-counts', action='store_false', dest='query_counts',
+            help='Do not profile the HTTP requests for their query counts. The profiling middleware is sync '
+                 'only, so leave it off when comparing async views.',
+        )
+
+    def handle(self, *args, **options):
+        scenarios = [name.strip() for name in options['scenarios'].split(',') if name.strip()]
+        known = {*benchmarking.HTTP_SCENARIOS, 'private_chat', 'notifications'}
+        unknown = set(scenarios) - known
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+        options['protocols'] = [name.strip() for name in options['protocols'].split(',') if name.strip()]
+        unknown = set(options['protocols']) - set(benchmarking.WIRE_PROTOCOLS)
+        if unknown:
+            raise CommandError(f"Unknown protocols: {', '.join(sorted(unknown))}")
+
+        # never touch the real database, the benchmark runs against its own copy
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = options['db']
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False, keepdb=options['keepdb'],
+        )
+        try:
+            results = self.run(scenarios, options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+            if not options['keepdb']:
+                # destroy_test_db only removes the database file itself
+                for suffix in ('-wal', '-shm'):
+                    if os.path.exists(options['db'] + suffix):
+                        os.remove(options['db'] + suffix)
+
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                handle.write(output)
+        self.stdout.write(output)
+
+        if options['compare']:
+            with open(options['compare']) as handle:
+                previous = json.load(handle)
+            for row in benchmarking.compare(previous, results):
+                line = f"{row['scenario']}: throughput {row['throughput_change']:+}%, p99 {row['p99_change']:+}%"
+                if None not in row['queries']:
+                    line += f", queries per request {row['queries'][0]} -> {row['queries'][1]}"
+                if None not in row['threads']:
+                    line += f", peak threads {row['threads'][0]} -> {row['threads'][1]}"
+                self.stdout.write(line)
+
+    def run(self, scenarios, options):
+        scale = {name: options[name] for name in benchmarking.DEFAULT_SCALE}
+        started = time.perf_counter()
+        if options['keepdb'] and Post.objects.exists():
+            data = {
+                'users': list(User.objects.values_list('id', flat=True)),
+                'posts': list(Post.objects.values_list('id', flat=True)),
+            }
+        else:
+            data = benchmarking.seed(scale)
+        seed_seconds = time.perf_counter() - started
+
+        users = list(User.objects.filter(username__startswith='bench').order_by('id')[:max(options['clients'], 20)])
+        cookies = [benchmarking.session_cookie(user) for user in users]
+
+        # the profiling middleware is set up when the app loads, so switch it on before the import
+        if options['query_counts']:
+            settings.REQUEST_PROFILING = True
+        from blogProject.asgi import application
+
+        async def main():
+            results = []
+            for name in scenarios:
+                if name in benchmarking.HTTP_SCENARIOS:
+                    results.append(await benchmarking.run_http(
+                        application, name, data, cookies, options['requests'], options['concurrency'],
+                    ))
+                elif name == 'private_chat':
+                    for protocol in options['protocols']:
+                        results.append(await benchmarking.run_private_chat(
+                            application, users, cookies, options['clients'], options['ws_messages'], protocol,
+                        ))
+                        self.stderr.write(json.dumps(results[-1]))
+                    continue
+                elif name == 'notifications':
+                    results.append(await benchmarking.run_notifications(
+                        application, users, cookies, options['clients'],
+                    ))
+                self.stderr.write(json.dumps(results[-1]))
+            return results
+
+        return {
+            'meta': {
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'sqlite_tuned': getattr(settings, 'SQLITE_TUNED', False),
+                'auth_cache': getattr(settings, 'AUTH_CACHE', False),
+                'session_engine': settings.SESSION_ENGINE,
+                'async_views': getattr(settings, 'ASYNC_VIEWS', False),
+                'channel_layer': settings.CHANNEL_LAYERS['default']['BACKEND'],
+                'batch_window': getattr(settings, 'CHAT_BATCH_WINDOW', None),
+                'scale': scale,
+                'seed_seconds': round(seed_seconds, 2),
+                'requests': options['requests'],
+                'concurrency': options['concurrency'],
+            },
+            'results': asyncio.run(main()),
+        }
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from blogApp import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index for posts and categories'
+
+    def handle(self, *args, **options):
+        if not search.fts_available():
+            self.stdout.write(self.style.WARNING(
+                'No full-text index table on this database, searches use the database directly'
+            ))
+            return
+        post_count, category_count = search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {post_count} posts and {category_count} categories'
+        ))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from blogApp.images import make_renditions, needs_renditions
+from blogApp.models import Post, User
+
+
+class Command(BaseCommand):
+    help = 'Make the resized WebP renditions of avatars and post images that do not have them yet'
+
+    def handle(self, *args, **options):
+        jobs = [
+            (User, 'avatar', User.objects.exclude(avatar_renditions=F('avatar'))),
+            (Post, 'image', Post.objects.exclude(image='').exclude(image=None).exclude(image_renditions=F('image'))),
+        ]
+        for model, field_name, queryset in jobs:
+            done = 0
+            for pk, name in queryset.values_list('pk', field_name).iterator():
+                if needs_renditions(name) and make_renditions(model, pk, field_name):
+                    done += 1
+            self.stdout.write(f'{model.__name__}.{field_name}: {done} rendered')
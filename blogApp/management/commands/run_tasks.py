@@ -0,0 +1,95 @@
+import multiprocessing
+import signal
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+
+
+LANES = ('high', 'default', 'low')
+
+
+def _work(threads, lanes, poll_interval):
+    # spawned children import this module before Django is set up, so the queue is imported here
+    django.setup()
+    from blogApp.taskqueue import WorkerPool
+
+    # the parent handles Ctrl-C and terminates the children
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    pool = WorkerPool(threads=threads, lanes=lanes, poll_interval=poll_interval)
+    pool.start()
+    pool.join()
+
+
+class Command(BaseCommand):
+    help = 'Run queued background tasks with a pool of worker threads or processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=2, help='Worker threads per process')
+        parser.add_argument('--processes', type=int, default=1)
+        parser.add_argument('--lanes', default=','.join(LANES), help='Comma separated lanes to take tasks from')
+        parser.add_argument('--poll-interval', type=float, default=1.0)
+        parser.add_argument('--burst', action='store_true', help='Run the tasks that are due and exit')
+        parser.add_argument('--status', action='store_true', help='Print the number of tasks per lane and status')
+
+    def handle(self, *args, **options):
+        from blogApp.taskqueue import WorkerPool, requeue_stale
+
+        lanes = [lane.strip() for lane in options['lanes'].split(',') if lane.strip()]
+        unknown = set(lanes) - set(LANES)
+        if unknown:
+            raise CommandError(f"Unknown lanes: {', '.join(sorted(unknown))}")
+
+        if options['status']:
+            return self.status()
+        requeued = requeue_stale()
+        if requeued:
+            self.stdout.write(f'Requeued {requeued} stale tasks')
+        if options['burst']:
+            return self.burst(lanes)
+
+        threads, processes = options['threads'], options['processes']
+        self.stdout.write(f"Running tasks from {', '.join(lanes)} with {processes} x {threads} workers")
+        if processes <= 1:
+            pool = WorkerPool(threads=threads, lanes=lanes, poll_interval=options['poll_interval'])
+            pool.start()
+            try:
+                pool.join()
+            except KeyboardInterrupt:
+                self.stdout.write('Finishing running tasks')
+                pool.stop()
+            return
+
+        context = multiprocessing.get_context('spawn')
+        children = [
+            context.Process(target=_work, args=(threads, lanes, options['poll_interval']))
+            for _ in range(processes)
+        ]
+        for child in children:
+            child.start()
+        try:
+            for child in children:
+                child.join()
+        except KeyboardInterrupt:
+            # tasks cut off here are run again once they time out
+            for child in children:
+                child.terminate()
+                child.join()
+
+    def burst(self, lanes):
+        from blogApp import taskqueue
+
+        lanes = [taskqueue.LANES[lane] for lane in lanes]
+        done = 0
+        while (task := taskqueue.claim(lanes)) is not None:
+            taskqueue.run_task(task)
+            done += 1
+        self.stdout.write(f'Ran {done} tasks')
+
+    def status(self):
+        from blogApp.models import Task
+
+        lane_names = dict(Task.LANE_CHOICES)
+        rows = Task.objects.values('lane', 'status').annotate(count=Count('id')).order_by('lane', 'status')
+        for row in rows:
+            self.stdout.write(f"{lane_names[row['lane']]:<8} {row['status']:<8} {row['count']}")
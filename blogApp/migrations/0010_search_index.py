@@ -0,0 +1,49 @@
+from django.db import OperationalError, migrations
+
+
+# Kept self-contained: blogApp.search is free to change after this migration was written.
+POST_INDEX_TABLE = 'blogapp_post_fts'
+CATEGORY_INDEX_TABLE = 'blogapp_category_fts'
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {POST_INDEX_TABLE} "
+            "USING fts5(title, description, category, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {CATEGORY_INDEX_TABLE} "
+            "USING fts5(name, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+    except OperationalError:
+        # SQLite was built without FTS5, searches fall back to icontains
+        return
+    schema_editor.execute(
+        f"INSERT INTO {CATEGORY_INDEX_TABLE} (rowid, name) SELECT id, name FROM blogApp_category"
+    )
+    schema_editor.execute(
+        f"INSERT INTO {POST_INDEX_TABLE} (rowid, title, description, category) "
+        "SELECT p.id, p.title, COALESCE(p.description, ''), COALESCE(c.name, '') "
+        "FROM blogApp_post p LEFT JOIN blogApp_category c ON c.id = p.category_id"
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(f"DROP TABLE IF EXISTS {POST_INDEX_TABLE}")
+    schema_editor.execute(f"DROP TABLE IF EXISTS {CATEGORY_INDEX_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogApp', '0009_delete_privatemessage'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
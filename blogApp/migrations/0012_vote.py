@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def copy_votes(apps, schema_editor):
+    Post = apps.get_model('blogApp', 'Post')
+    Vote = apps.get_model('blogApp', 'Vote')
+    for post in Post.objects.prefetch_related('upvotes', 'downvotes'):
+        values = {user.id: -1 for user in post.downvotes.all()}
+        values.update({user.id: 1 for user in post.upvotes.all()})
+        Vote.objects.bulk_create([Vote(post=post, user_id=user_id, value=value) for user_id, value in values.items()])
+        upvotes = sum(1 for value in values.values() if value == 1)
+        Post.objects.filter(id=post.id).update(upvote_count=upvotes, downvote_count=len(values) - upvotes)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogApp', '0011_post_feed_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='downvote_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='upvote_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='Vote',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.SmallIntegerField(choices=[(1, 'Upvote'), (-1, 'Downvote')])),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='votes', to='blogApp.post')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='votes', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('post', 'user'), name='unique_vote_per_user')],
+            },
+        ),
+        migrations.RunPython(copy_votes, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='post',
+            name='downvotes',
+        ),
+        migrations.RemoveField(
+            model_name='post',
+            name='upvotes',
+        ),
+    ]
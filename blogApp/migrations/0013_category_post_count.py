@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:26
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_and_count(apps, schema_editor):
+    Category = apps.get_model('blogApp', 'Category')
+    Post = apps.get_model('blogApp', 'Post')
+    # duplicate names have to go before the unique index, their posts move to the oldest category
+    keep = {}
+    duplicates = []
+    for category in Category.objects.order_by('id'):
+        if category.name in keep:
+            Post.objects.filter(category_id=category.id).update(category_id=keep[category.name])
+            duplicates.append(category.id)
+        else:
+            keep[category.name] = category.id
+    if duplicates:
+        Category.objects.filter(id__in=duplicates).delete()
+        if 'blogapp_category_fts' in schema_editor.connection.introspection.table_names():
+            with schema_editor.connection.cursor() as cursor:
+                for category_id in duplicates:
+                    cursor.execute('DELETE FROM blogapp_category_fts WHERE rowid = %s', [category_id])
+
+    for category in Category.objects.annotate(total=Count('post')):
+        Category.objects.filter(id=category.id).update(post_count=category.total)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogApp', '0012_vote'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='post_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(merge_and_count, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='category',
+            name='name',
+            field=models.CharField(max_length=200, unique=True),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:33
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_unread(apps, schema_editor):
+    User = apps.get_model('blogApp', 'User')
+    PrivateMessage = apps.get_model('chat', 'PrivateMessage')
+    unread = (
+        PrivateMessage.objects.filter(read=False)
+        .values('recipient_id')
+        .annotate(total=Count('id'))
+        .order_by()
+    )
+    for row in unread:
+        User.objects.filter(id=row['recipient_id']).update(unread_private_messages=row['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blogApp', '0015_hot_query_indexes'),
+        ('chat', '0007_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='unread_private_messages',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_unread, migrations.RunPython.noop),
+    ]
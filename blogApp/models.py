@@ -1,6 +1,9 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.templatetags.static import static
+from django.utils import timezone
+
+from .images import rendition_url
 
 
 class User(AbstractUser):
@@ -9,19 +12,36 @@ class User(AbstractUser):
     email = models.EmailField(unique=True, null=True)
     bio = models.TextField(null=True, blank=True)
     avatar = models.ImageField(null=True, default="static/media/images/avatar.svg", upload_to='images/')
+    # kept by queryset updates in chat.unread, save users with update_fields to leave it alone
+    unread_private_messages = models.PositiveIntegerField(default=0, editable=False)
+    # name of the avatar upload whose resized copies are stored, see blogApp.images
+    avatar_renditions = models.CharField(max_length=255, blank=True, default='', editable=False)
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username']
 
-    @property
-    def avatar_url(self):
+    def _avatar_url(self, size):
         if self.avatar and str(self.avatar) != "static/media/images/avatar.svg":
-            return self.avatar.url
+            return rendition_url(self.avatar, self.avatar_renditions, size)
         else:
             return static('media/images/avatar.svg')
 
+    @property
+    def avatar_url(self):
+        return self._avatar_url(64)
+
+    @property
+    def avatar_large_url(self):
+        return self._avatar_url(128)
+
 class Category(models.Model):
-    name = models.CharField(max_length=200)
+    name = models.CharField(max_length=200, unique=True)
+    post_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-post_count', 'name'], name='category_sidebar_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -33,18 +53,31 @@ class Post(models.Model):
     description = models.TextField(null=True, blank=True)
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
     image = models.ImageField(upload_to='images/', null=True, blank=True)
+    image_renditions = models.CharField(max_length=255, blank=True, default='', editable=False)
     updated = models.DateTimeField(auto_now=True)
     created = models.DateTimeField(auto_now_add=True)
     participants = models.ManyToManyField(User, related_name='participants', blank=True)
-    upvotes = models.ManyToManyField(User, related_name='post_upvotes', blank=True)
-    downvotes = models.ManyToManyField(User, related_name='post_downvotes', blank=True)
+    upvote_count = models.PositiveIntegerField(default=0)
+    downvote_count = models.PositiveIntegerField(default=0)
+
+    @property
+    def image_url(self):
+        return rendition_url(self.image, self.image_renditions, 960) if self.image else ''
+
+    @property
+    def thumbnail_url(self):
+        return rendition_url(self.image, self.image_renditions, 320) if self.image else ''
 
     @property
     def vote_count(self):
-        return self.upvotes.count() - self.downvotes.count()
+        return self.upvote_count - self.downvote_count
 
     class Meta:
         ordering = ['-updated','-created']
+        indexes = [
+            models.Index(fields=['-updated', '-created', '-id'], name='post_feed_idx'),
+            models.Index(fields=['created_by', '-updated', '-created', '-id'], name='post_author_feed_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -59,6 +92,69 @@ class Message(models.Model):
 
     class Meta:
         ordering = ['-updated', '-created']
+        indexes = [
+            models.Index(fields=['-created', '-id'], name='message_activity_idx'),
+            models.Index(fields=['post', '-created', '-id'], name='message_thread_idx'),
+            models.Index(fields=['user', '-created', '-id'], name='message_user_idx'),
+        ]
 
     def __str__(self):
         return self.body[0:50]
+
+
+class Vote(models.Model):
+    UP = 1
+    DOWN = -1
+    VALUE_CHOICES = [(UP, 'Upvote'), (DOWN, 'Downvote')]
+
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='votes')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='votes')
+    value = models.SmallIntegerField(choices=VALUE_CHOICES)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'user'], name='unique_vote_per_user'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} {'+1' if self.value == self.UP else '-1'} on {self.post}"
+
+
+class Task(models.Model):
+    # A unit of deferred work, see blogApp.taskqueue
+    PENDING = 'pending'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (FAILED, 'Failed')]
+
+    HIGH = 0
+    DEFAULT = 1
+    LOW = 2
+    LANE_CHOICES = [(HIGH, 'High'), (DEFAULT, 'Default'), (LOW, 'Low')]
+
+    name = models.CharField(max_length=200)
+    kwargs = models.JSONField(default=dict)
+    lane = models.PositiveSmallIntegerField(choices=LANE_CHOICES, default=DEFAULT)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    dedup_key = models.CharField(max_length=200, null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    run_at = models.DateTimeField(default=timezone.now)
+    started = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'lane', 'run_at', 'id'], name='task_claim_idx'),
+        ]
+        constraints = [
+            # only waiting work is merged, a task that already started does not block a new run
+            models.UniqueConstraint(
+                fields=['dedup_key'], condition=models.Q(status='pending'), name='unique_pending_task',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.status})"
@@ -0,0 +1,158 @@
+import re
+import statistics
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.template.backends import django as django_backend
+
+
+PROFILING_BUFFER_SIZE = getattr(settings, 'REQUEST_PROFILING_BUFFER_SIZE', 1000)
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST_RE = re.compile(r'\((?:\s*(?:\?|%s)\s*,)+\s*(?:\?|%s)\s*\)')
+
+_template_time = ContextVar('template_time', default=None)
+_request_queries = ContextVar('request_queries', default=None)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def fingerprint(sql):
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    return _IN_LIST_RE.sub('(...)', sql)
+
+
+class RequestLog:
+    # Ring buffer of the most recent request profiles, shared by all threads of the process
+
+    def __init__(self, size):
+        self._entries = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, entry):
+        with self._lock:
+            self._entries.append(entry)
+
+    def entries(self):
+        with self._lock:
+            return list(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def report(self):
+        by_view = defaultdict(list)
+        for entry in self.entries():
+            by_view[entry['view']].append(entry)
+
+        views = []
+        for view, entries in by_view.items():
+            times = sorted(entry['time_ms'] for entry in entries)
+            queries = [entry['queries'] for entry in entries]
+            duplicates = Counter()
+            for entry in entries:
+                duplicates.update(entry['duplicates'])
+            views.append({
+                'view': view,
+                'requests': len(entries),
+                'avg_ms': round(statistics.mean(times), 2),
+                'p95_ms': round(times[max(int(len(times) * 0.95) - 1, 0)], 2),
+                'max_ms': round(times[-1], 2),
+                'avg_queries': round(statistics.mean(queries), 1),
+                'max_queries': max(queries),
+                'avg_template_ms': round(statistics.mean(entry['template_ms'] for entry in entries), 2),
+                'duplicates': [
+                    {'sql': sql, 'count': count} for sql, count in duplicates.most_common(5)
+                ],
+            })
+        views.sort(key=lambda row: row['avg_ms'] * row['requests'], reverse=True)
+        return views
+
+
+request_log = RequestLog(PROFILING_BUFFER_SIZE)
+
+
+def _timed_render(render):
+    def wrapper(self, context=None, request=None):
+        spent = _template_time.get()
+        if spent is None:
+            return render(self, context, request)
+        started = time.perf_counter()
+        try:
+            return render(self, context, request)
+        finally:
+            spent[0] += time.perf_counter() - started
+    wrapper.profiled = True
+    return wrapper
+
+
+def _count_query(execute, sql, params, many, context):
+    queries = _request_queries.get()
+    if queries is not None:
+        queries.append(sql)
+    return execute(sql, params, many, context)
+
+
+def _watch(connection, **kwargs):
+    # Every connection counts into the request whose context it runs in. That covers the writer
+    # thread (blogApp.writes passes the caller's context along) and the threads of in_own_thread,
+    # not writes deferred past the end of the request.
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+class RequestProfilingMiddleware:
+    def __init__(self, get_response):
+        # settings are read here so tests can switch the query budget on with override_settings
+        self.max_queries = getattr(settings, 'REQUEST_PROFILING_MAX_QUERIES', None)
+        if not getattr(settings, 'REQUEST_PROFILING', False) and self.max_queries is None:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if not getattr(django_backend.Template.render, 'profiled', False):
+            django_backend.Template.render = _timed_render(django_backend.Template.render)
+        connection_created.connect(_watch, dispatch_uid='blogApp.profiling')
+
+    def __call__(self, request):
+        queries = []
+        spent = [0.0]
+        # connections opened before the middleware was loaded are watched from their first request on
+        _watch(connection)
+        tokens = _template_time.set(spent), _request_queries.set(queries)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _template_time.reset(tokens[0])
+            _request_queries.reset(tokens[1])
+        elapsed = time.perf_counter() - started
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match and match.view_name else request.path
+        fingerprints = Counter(fingerprint(sql) for sql in queries)
+        request_log.add({
+            'view': view,
+            'path': request.path,
+            'method': request.method,
+            'status': response.status_code,
+            'time_ms': elapsed * 1000,
+            'template_ms': spent[0] * 1000,
+            'queries': len(queries),
+            'duplicates': {sql: count for sql, count in fingerprints.items() if count > 1},
+        })
+
+        if self.max_queries is not None and len(queries) > self.max_queries:
+            raise QueryBudgetExceeded(
+                f'{view} ran {len(queries)} queries, the budget is {self.max_queries}'
+            )
+        return response
@@ -0,0 +1,166 @@
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, IntegerField, Q, When
+
+from .models import Post, Category
+
+
+POST_INDEX_TABLE = 'blogapp_post_fts'
+CATEGORY_INDEX_TABLE = 'blogapp_category_fts'
+
+MAX_RESULTS = getattr(settings, 'SEARCH_MAX_RESULTS', 1000)
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+_fts_available = None
+
+
+def fts_available():
+    global _fts_available
+    if connection.vendor != 'sqlite':
+        return False
+    if _fts_available is None:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s",
+                [POST_INDEX_TABLE],
+            )
+            _fts_available = cursor.fetchone() is not None
+    return _fts_available
+
+
+def forget_fts_available():
+    # the index tables come and go with migrations
+    global _fts_available
+    _fts_available = None
+
+
+def _match_expression(q):
+    # every word becomes a quoted prefix term so user input can't inject FTS syntax
+    tokens = _TOKEN_RE.findall(q)
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def _ranked(queryset, ids):
+    if not ids:
+        return queryset.none()
+    order = Case(*[When(id=pk, then=pos) for pos, pk in enumerate(ids)], output_field=IntegerField())
+    return queryset.filter(id__in=ids).order_by(order)
+
+
+def _postgres_search(queryset, fields, q):
+    from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+
+    vector = SearchVector(*fields)
+    query = SearchQuery(q, search_type='websearch')
+    return queryset.annotate(rank=SearchRank(vector, query)).filter(rank__gt=0).order_by('-rank')
+
+
+def search_post_ids(q, limit=MAX_RESULTS):
+    match = _match_expression(q)
+    if not match:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid FROM {POST_INDEX_TABLE} WHERE {POST_INDEX_TABLE} MATCH %s "
+            f"ORDER BY bm25({POST_INDEX_TABLE}, 10.0, 1.0, 5.0) LIMIT %s",
+            [match, limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search_posts(q, queryset=None):
+    if queryset is None:
+        queryset = Post.objects.all()
+    q = q.strip()
+    if not q:
+        return queryset
+    if connection.vendor == 'postgresql':
+        return _postgres_search(queryset, ['title', 'description', 'category__name'], q)
+    if fts_available():
+        return _ranked(queryset, search_post_ids(q))
+    return queryset.filter(Q(category__name__icontains=q) | Q(title__icontains=q) | Q(description__icontains=q))
+
+
+def search_categories(q, queryset=None):
+    if queryset is None:
+        queryset = Category.objects.all()
+    q = q.strip()
+    if not q:
+        return queryset
+    if connection.vendor == 'postgresql':
+        return _postgres_search(queryset, ['name'], q)
+    if fts_available():
+        match = _match_expression(q)
+        if not match:
+            return queryset.none()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid FROM {CATEGORY_INDEX_TABLE} WHERE {CATEGORY_INDEX_TABLE} MATCH %s "
+                f"ORDER BY bm25({CATEGORY_INDEX_TABLE}) LIMIT %s",
+                [match, MAX_RESULTS],
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+        return _ranked(queryset, ids)
+    return queryset.filter(name__icontains=q)
+
+
+def index_post(post):
+    if not fts_available():
+        return
+    category = post.category.name if post.category_id else ''
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {POST_INDEX_TABLE} WHERE rowid = %s", [post.id])
+        cursor.execute(
+            f"INSERT INTO {POST_INDEX_TABLE} (rowid, title, description, category) VALUES (%s, %s, %s, %s)",
+            [post.id, post.title, post.description or '', category],
+        )
+
+
+def unindex_post(post_id):
+    if not fts_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {POST_INDEX_TABLE} WHERE rowid = %s", [post_id])
+
+
+def index_category(category):
+    if not fts_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {CATEGORY_INDEX_TABLE} WHERE rowid = %s", [category.id])
+        cursor.execute(
+            f"INSERT INTO {CATEGORY_INDEX_TABLE} (rowid, name) VALUES (%s, %s)",
+            [category.id, category.name],
+        )
+    for post in Post.objects.filter(category=category).select_related('category').iterator():
+        index_post(post)
+
+
+def unindex_category(category_id):
+    if not fts_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {CATEGORY_INDEX_TABLE} WHERE rowid = %s", [category_id])
+
+
+def rebuild_index():
+    if not fts_available():
+        return 0, 0
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {POST_INDEX_TABLE}")
+        cursor.execute(f"DELETE FROM {CATEGORY_INDEX_TABLE}")
+        cursor.execute(
+            f"INSERT INTO {CATEGORY_INDEX_TABLE} (rowid, name) "
+            f"SELECT id, name FROM {Category._meta.db_table}"
+        )
+        category_count = cursor.rowcount
+        cursor.execute(
+            f"INSERT INTO {POST_INDEX_TABLE} (rowid, title, description, category) "
+            "SELECT p.id, p.title, COALESCE(p.description, ''), COALESCE(c.name, '') "
+            f"FROM {Post._meta.db_table} p LEFT JOIN {Category._meta.db_table} c ON c.id = p.category_id"
+        )
+        post_count = cursor.rowcount
+        cursor.execute(f"INSERT INTO {POST_INDEX_TABLE} ({POST_INDEX_TABLE}) VALUES ('optimize')")
+    return post_count, category_count
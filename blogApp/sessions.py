@@ -0,0 +1,112 @@
+import logging
+import threading
+
+from django.contrib.sessions.backends.base import CreateError
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBStore
+
+from .writes import write_queue
+
+
+logger = logging.getLogger(__name__)
+
+_DELETE = object()
+
+
+class PendingWrites:
+    # Session writes waiting for the writer thread, a later save of the same session replaces the earlier one
+
+    def __init__(self):
+        self._writes = {}
+        self._lock = threading.Lock()
+
+    def put(self, session_key, state):
+        with self._lock:
+            queued = session_key in self._writes
+            self._writes[session_key] = state
+        if not queued:
+            write_queue.defer(self.flush, session_key)
+
+    def get(self, session_key):
+        with self._lock:
+            return self._writes.get(session_key)
+
+    def flush(self, session_key):
+        with self._lock:
+            state = self._writes.pop(session_key, None)
+        if state is None:
+            return
+        try:
+            if state is _DELETE:
+                SessionStore.get_model_class().objects.filter(session_key=session_key).delete()
+            else:
+                session_data, expire_date = state
+                SessionStore.get_model_class()(
+                    session_key=session_key, session_data=session_data, expire_date=expire_date,
+                ).save()
+        except Exception:
+            logger.exception('Could not write session %s', session_key)
+
+
+pending_writes = PendingWrites()
+
+
+class SessionStore(CachedDBStore):
+    # Sessions are read from the cache and written to the database behind the request. The database
+    # copy is what survives a cache eviction or restart.
+
+    def _load_pending(self):
+        # a session saved moments ago may not have reached the database yet
+        state = pending_writes.get(self._session_key) if self._session_key else None
+        if state is _DELETE:
+            self._session_key = None
+            return {}
+        if state is not None:
+            return self.decode(state[0])
+        return None
+
+    def load(self):
+        try:
+            data = self._cache.get(self.cache_key)
+        except Exception:
+            data = None
+        if data is None:
+            data = self._load_pending()
+        return super().load() if data is None else data
+
+    async def aload(self):
+        try:
+            data = await self._cache.aget(await self.acache_key())
+        except Exception:
+            data = None
+        if data is None:
+            data = self._load_pending()
+        return await super().aload() if data is None else data
+
+    def exists(self, session_key):
+        state = pending_writes.get(session_key)
+        if state is not None:
+            return state is not _DELETE
+        return super().exists(session_key)
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+        data = self._get_session(no_load=must_create)
+        if must_create:
+            # keys are random, the cache add only has to catch the very rare clash
+            if not self._cache.add(self.cache_key, data, self.get_expiry_age()):
+                raise CreateError
+        else:
+            try:
+                self._cache.set(self.cache_key, data, self.get_expiry_age())
+            except Exception:
+                logger.exception('Error saving to cache (%s)', self._cache)
+        pending_writes.put(self.session_key, (self.encode(data), self.get_expiry_date()))
+
+    def delete(self, session_key=None):
+        if session_key is None:
+            if self.session_key is None:
+                return
+            session_key = self.session_key
+        self._cache.delete(self.cache_key_prefix + session_key)
+        pending_writes.put(session_key, _DELETE)
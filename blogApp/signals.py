@@ -0,0 +1,171 @@
+from django.db.models.signals import m2m_changed, post_migrate, post_save, post_delete, pre_delete, pre_save
+from django.db import transaction
+from django.dispatch import receiver
+
+from .models import Post, Category, Message, User, Vote
+from . import search
+from .categories import bump_post_count, invalidate_sidebar
+from .activity import forget_activity, record_activity, refresh_activity_for
+from .votes import recount_votes
+from .caching import bump_versions
+from .images import renditions_ready
+from .backends import forget_users
+from .tasks import schedule_renditions
+
+
+@receiver(pre_save, sender=Post)
+def remember_post_category(sender, instance, **kwargs):
+    if instance._state.adding:
+        instance._previous_category_id = None
+    else:
+        instance._previous_category_id = (
+            Post.objects.filter(id=instance.id).values_list('category_id', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Post)
+def index_post_on_save(sender, instance, **kwargs):
+    search.index_post(instance)
+
+
+@receiver(post_save, sender=Post)
+def count_post_on_save(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_category_id', None)
+    if not created and previous == instance.category_id:
+        return
+    bump_post_count(previous, -1)
+    bump_post_count(instance.category_id, 1)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post_on_delete(sender, instance, **kwargs):
+    search.unindex_post(instance.id)
+
+
+@receiver(post_delete, sender=Post)
+def uncount_post_on_delete(sender, instance, **kwargs):
+    bump_post_count(instance.category_id, -1)
+
+
+@receiver(post_save, sender=Post)
+def refresh_activity_on_post_save(sender, instance, created, **kwargs):
+    if not created:
+        refresh_activity_for(post_id=instance.id)
+
+
+@receiver(post_save, sender=Message)
+def record_activity_on_save(sender, instance, **kwargs):
+    record_activity(instance)
+
+
+@receiver(post_delete, sender=Message)
+def forget_activity_on_delete(sender, instance, **kwargs):
+    forget_activity(instance.id)
+
+
+@receiver(post_save, sender=User)
+def refresh_activity_on_user_save(sender, instance, created, **kwargs):
+    if not created:
+        refresh_activity_for(user_id=instance.id)
+
+
+@receiver(post_save, sender=Category)
+def index_category_on_save(sender, instance, **kwargs):
+    search.index_category(instance)
+    invalidate_sidebar()
+
+
+@receiver(pre_delete, sender=Category)
+def remember_category_posts(sender, instance, **kwargs):
+    # the FK is SET_NULL through a bulk update, so no Post signals fire for these
+    instance._orphaned_post_ids = list(instance.post_set.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Category)
+def unindex_category_on_delete(sender, instance, **kwargs):
+    search.unindex_category(instance.id)
+    invalidate_sidebar()
+    for post in Post.objects.filter(id__in=getattr(instance, '_orphaned_post_ids', [])):
+        search.index_post(post)
+
+
+@receiver(post_delete, sender=Vote)
+def release_vote_on_delete(sender, instance, origin=None, **kwargs):
+    # Covers deleted users and bulk deletes in the admin, toggle_vote decrements its own counter.
+    # All rows of one delete() are gone by now, so each post is recounted once per delete.
+    if getattr(instance, '_counted', False) or isinstance(origin, Post) or getattr(origin, 'model', None) is Post:
+        return
+    recounted = origin.__dict__.setdefault('_recounted_posts', set()) if origin is not None else set()
+    if instance.post_id not in recounted:
+        recounted.add(instance.post_id)
+        recount_votes(instance.post_id)
+
+
+# Cached pages and fragments vary on these versions, see blogApp.caching
+
+@receiver([post_save, post_delete], sender=Post)
+def bump_post_versions(sender, instance, **kwargs):
+    bump_versions('posts', 'categories', f'post:{instance.id}', f'user:{instance.created_by_id}')
+
+
+@receiver([post_save, post_delete], sender=Message)
+def bump_message_versions(sender, instance, **kwargs):
+    bump_versions('activity', f'post:{instance.post_id}', f'user:{instance.user_id}')
+
+
+@receiver([post_save, post_delete], sender=Category)
+def bump_category_versions(sender, instance, **kwargs):
+    bump_versions('categories', 'posts')
+
+
+@receiver(m2m_changed, sender=Post.participants.through)
+def bump_participant_versions(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    post_ids = (pk_set or []) if reverse else [instance.id]
+    bump_versions('posts', *(f'post:{post_id}' for post_id in post_ids))
+
+
+@receiver(post_save, sender=User)
+def bump_user_versions(sender, instance, created, update_fields=None, **kwargs):
+    # logging in only touches last_login, which no page shows
+    if created or update_fields == frozenset(['last_login']):
+        return
+    bump_versions('posts', 'activity', f'user:{instance.id}')
+
+
+# Resized copies of uploads are made off the request path, see blogApp.tasks
+
+@receiver(post_save, sender=User)
+def render_avatar(sender, instance, **kwargs):
+    schedule_renditions(instance, 'avatar')
+
+
+@receiver(post_save, sender=Post)
+def render_post_image(sender, instance, **kwargs):
+    schedule_renditions(instance, 'image')
+
+
+@receiver(renditions_ready, sender=User)
+def avatar_rendered(sender, pk, **kwargs):
+    forget_users(pk)
+    refresh_activity_for(user_id=pk)
+    bump_versions('posts', 'activity', f'user:{pk}')
+
+
+@receiver(renditions_ready, sender=Post)
+def post_image_rendered(sender, pk, **kwargs):
+    bump_versions('posts', f'post:{pk}')
+
+
+# request.user comes from a short lived cache, see blogApp.backends
+
+@receiver([post_save, post_delete], sender=User)
+def forget_cached_user(sender, instance, **kwargs):
+    user_id = instance.id
+    transaction.on_commit(lambda: forget_users(user_id))
+
+
+@receiver(post_migrate)
+def forget_search_tables(sender, **kwargs):
+    search.forget_fts_available()
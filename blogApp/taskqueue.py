@@ -0,0 +1,212 @@
+import logging
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Task
+from .writes import retry_on_busy
+
+
+logger = logging.getLogger(__name__)
+
+LANES = {'high': Task.HIGH, 'default': Task.DEFAULT, 'low': Task.LOW}
+POLL_INTERVAL = getattr(settings, 'TASK_POLL_INTERVAL', 1.0)
+TASK_TIMEOUT = getattr(settings, 'TASK_TIMEOUT', 300)
+CLAIM_BATCH = 10
+
+_registry = {}
+
+
+class TaskFunction:
+    # A function that can run later on a worker. Arguments are stored as JSON, so pass ids, not objects.
+
+    def __init__(self, func, lane='default', max_attempts=3, retry_delay=5):
+        self.func = func
+        self.name = f'{func.__module__}.{func.__qualname__}'
+        self.lane = lane
+        self.max_attempts = max_attempts
+        # seconds before the first retry, doubled for every further attempt
+        self.retry_delay = retry_delay
+        _registry[self.name] = self
+
+    def __call__(self, **kwargs):
+        return self.func(**kwargs)
+
+    def enqueue(self, dedup_key=None, delay=0, lane=None, **kwargs):
+        # The row is written in the caller's transaction, so the work is only queued if the caller
+        # commits. Returns None when the same dedup_key is already waiting.
+        try:
+            with transaction.atomic():
+                task = retry_on_busy(Task.objects.create)(
+                    name=self.name,
+                    kwargs=kwargs,
+                    lane=LANES[lane or self.lane],
+                    dedup_key=dedup_key,
+                    max_attempts=self.max_attempts,
+                    run_at=timezone.now() + timedelta(seconds=delay),
+                )
+        except IntegrityError:
+            if dedup_key is None:
+                raise
+            return None
+        transaction.on_commit(workers.wake)
+        return task
+
+
+def task(lane='default', max_attempts=3, retry_delay=5):
+    def decorator(func):
+        return TaskFunction(func, lane, max_attempts, retry_delay)
+    return decorator
+
+
+def get_task(name):
+    if name not in _registry:
+        # importing the module registers its tasks
+        import_string(name)
+    return _registry[name]
+
+
+@retry_on_busy
+def claim(lanes):
+    # Takes the most urgent due task. The update is guarded by the status, so of two workers racing
+    # for the same row only one gets it.
+    now = timezone.now()
+    due = (
+        Task.objects.filter(status=Task.PENDING, lane__in=lanes, run_at__lte=now)
+        .order_by('lane', 'run_at', 'id')
+        .values_list('id', flat=True)[:CLAIM_BATCH]
+    )
+    for task_id in list(due):
+        claimed = Task.objects.filter(id=task_id, status=Task.PENDING).update(
+            status=Task.RUNNING, started=now, attempts=F('attempts') + 1,
+        )
+        if claimed:
+            return Task.objects.get(id=task_id)
+    return None
+
+
+@retry_on_busy
+def _set_pending(task_id, **fields):
+    try:
+        with transaction.atomic():
+            Task.objects.filter(id=task_id).update(status=Task.PENDING, **fields)
+    except IntegrityError:
+        # a new copy with the same dedup_key is already waiting and will do the work
+        Task.objects.filter(id=task_id).delete()
+
+
+def run_task(task):
+    try:
+        get_task(task.name)(**task.kwargs)
+    except Exception:
+        _failed(task, traceback.format_exc())
+    else:
+        retry_on_busy(Task.objects.filter(id=task.id).delete)()
+
+
+def _failed(task, error):
+    if task.attempts < task.max_attempts:
+        registered = _registry.get(task.name)
+        delay = (registered.retry_delay if registered else 5) * 2 ** (task.attempts - 1)
+        logger.warning('Task %s #%s failed, retrying in %ss', task.name, task.id, delay)
+        _set_pending(task.id, run_at=timezone.now() + timedelta(seconds=delay), last_error=error)
+    else:
+        logger.error('Task %s #%s failed after %s attempts:\n%s', task.name, task.id, task.attempts, error)
+        retry_on_busy(Task.objects.filter(id=task.id).update)(status=Task.FAILED, last_error=error)
+
+
+def requeue_stale(timeout=TASK_TIMEOUT):
+    # Tasks of a worker that died mid-run would stay running forever. There is no heartbeat, so a
+    # task that is still running after TASK_TIMEOUT is run a second time: keep tasks shorter than
+    # that and safe to repeat. A timeout counts as an attempt.
+    cutoff = timezone.now() - timedelta(seconds=timeout)
+    error = f'timed out after {timeout}s'
+    stale = list(
+        Task.objects.filter(status=Task.RUNNING, started__lt=cutoff)
+        .values_list('id', 'name', 'attempts', 'max_attempts')
+    )
+    for task_id, name, attempts, max_attempts in stale:
+        if attempts < max_attempts:
+            _set_pending(task_id, last_error=error)
+        else:
+            logger.error('Task %s #%s %s on attempt %s, giving up', name, task_id, error, attempts)
+            retry_on_busy(Task.objects.filter(id=task_id, status=Task.RUNNING).update)(
+                status=Task.FAILED, last_error=error,
+            )
+    return len(stale)
+
+
+class WorkerPool:
+    # Threads that claim and run tasks until stopped. Idle threads poll the table, tasks enqueued
+    # in this process wake them right away.
+
+    def __init__(self, threads=1, lanes=None, poll_interval=POLL_INTERVAL):
+        self.threads = threads
+        self.lanes = lanes or list(LANES)
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._workers = []
+        self._lock = threading.Lock()
+        self._last_requeue = 0
+
+    def start(self):
+        with self._lock:
+            self._workers = [worker for worker in self._workers if worker.is_alive()]
+            if self._workers:
+                return
+            self._stop.clear()
+            for index in range(self.threads):
+                worker = threading.Thread(target=self._run, name=f'task-worker-{index}', daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def wake(self):
+        if self.threads:
+            self.start()
+            self._wake.set()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        for worker in self._workers:
+            worker.join(timeout)
+
+    def join(self):
+        for worker in self._workers:
+            worker.join()
+
+    def _run(self):
+        lanes = [LANES[lane] for lane in self.lanes]
+        while not self._stop.is_set():
+            close_old_connections()
+            task = None
+            try:
+                self._maybe_requeue()
+                task = claim(lanes)
+                if task is not None:
+                    run_task(task)
+            except Exception:
+                logger.exception('Task worker error')
+            if task is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+        close_old_connections()
+
+    def _maybe_requeue(self):
+        now = time.monotonic()
+        if now - self._last_requeue >= min(TASK_TIMEOUT, 60):
+            self._last_requeue = now
+            requeue_stale()
+
+
+# Runs in the web process, started by blogProject.asgi/wsgi and woken by every enqueue. Set
+# TASK_WORKERS=0 when the run_tasks command does the work instead.
+workers = WorkerPool(threads=getattr(settings, 'TASK_WORKERS', 1))
@@ -0,0 +1,21 @@
+from django.apps import apps
+
+from .images import make_renditions, needs_renditions
+from .taskqueue import task
+
+
+@task(lane='low')
+def render_upload(model, pk, field_name):
+    make_renditions(apps.get_model(model), pk, field_name)
+
+
+def schedule_renditions(instance, field_name):
+    file = getattr(instance, field_name)
+    if not needs_renditions(file.name) or getattr(instance, f'{field_name}_renditions') == file.name:
+        return
+    label = instance._meta.label
+    # uploading twice before the first one is rendered only renders once, make_renditions reads the latest file
+    render_upload.enqueue(
+        model=label, pk=instance.pk, field_name=field_name,
+        dedup_key=f'renditions:{label}:{instance.pk}:{field_name}',
+    )
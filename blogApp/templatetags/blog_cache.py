@@ -0,0 +1,12 @@
+from django import template
+
+from blogApp.caching import get_version
+
+
+register = template.Library()
+
+
+# {% cache_version 'post' post.id as version %} gives a value for {% cache %} to vary on
+@register.simple_tag
+def cache_version(*parts):
+    return get_version(':'.join(str(part) for part in parts))
@@ -1,3 +1,830 @@
-from django.test import TestCase
+import importlib
+import re
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import BytesIO
+from unittest import skipUnless
+from unittest.mock import AsyncMock, patch
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, connection, connections
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image as PILImage
+
+from chat.conversations import get_inbox_page
+from chat.history import get_history
+from chat.models import PrivateMessage
+from . import async_views
+from .activity import RECENT_ACTIVITY_SIZE, get_activity_page, recent_activity, record_activity
+from .caching import bump_versions, cache_anonymous_page
+from .categories import recount_post_counts, sidebar_categories
+from .detail import load_post_detail
+from .feed import encode_cursor, get_feed_page, get_home_feed
+from .images import rendition_name
+from .models import Category, Message, Post, Task, User, Vote
+from .profiling import QueryBudgetExceeded, RequestProfilingMiddleware, request_log
+from .search import fts_available, search_categories, search_posts
+from .sessions import SessionStore, pending_writes
+from .taskqueue import WorkerPool, claim, requeue_stale, run_task, task
+from .votes import TOGGLE_ATTEMPTS, recount_votes, toggle_vote
+from .writes import WriteQueue
+
+
+BARE_SCAN = re.compile(r'\bSCAN \S+$')
+# counting a whole table visits every row whatever the indexes are
+WHOLE_TABLE_COUNT = re.compile(r'^SELECT COUNT\(\*\) AS "__count" FROM "\w+"$')
+
+
+@skipUnless(connection.vendor == 'sqlite', 'plans are read with SQLite EXPLAIN QUERY PLAN')
+class HotQueryPlanTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='alice', email='alice@example.com', password='pw')
+        cls.other = User.objects.create_user(username='bob', email='bob@example.com', password='pw')
+        category = Category.objects.create(name='django')
+        cls.post = Post.objects.create(title='Indexes', category=category, created_by=cls.user)
+        Message.objects.create(user=cls.other, post=cls.post, body='reply')
+        PrivateMessage.objects.create(sender=cls.other, recipient=cls.user, body='hi')
+
+    def setUp(self):
+        cache.clear()
+
+    def assertIndexed(self, func, *args, **kwargs):
+        with CaptureQueriesContext(connection) as queries:
+            func(*args, **kwargs)
+        self.assertTrue(queries.captured_queries)
+        for query in queries.captured_queries:
+            sql = query['sql']
+            if not sql.startswith(('SELECT', 'UPDATE', 'DELETE')) or WHOLE_TABLE_COUNT.match(sql):
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                plan = [row[-1] for row in cursor.fetchall()]
+            problems = [line for line in plan if BARE_SCAN.search(line)]
+            # a page should come out of an index in order, OR-ed lookups are the exception since
+            # SQLite merges them in a temporary tree
+            if 'MULTI-INDEX OR' not in plan:
+                problems += [line for line in plan if line == 'USE TEMP B-TREE FOR ORDER BY']
+            self.assertFalse(problems, f'unindexed access in:\n{sql}\n' + '\n'.join(plan))
+
+    def test_feed(self):
+        self.assertIndexed(get_feed_page)
+        self.assertIndexed(get_feed_page, author=self.user)
+
+    def test_feed_cursor_page_seeks(self):
+        Post.objects.create(title='Plans', created_by=self.user)
+        _, cursor = get_feed_page(page_size=1)
+        for author in (None, self.user):
+            self.assertIndexed(get_feed_page, cursor=cursor, author=author)
+            with CaptureQueriesContext(connection) as queries:
+                get_feed_page(cursor=cursor, author=author)
+            with connection.cursor() as db:
+                db.execute(f'EXPLAIN QUERY PLAN {queries.captured_queries[0]["sql"]}')
+                plan = [row[-1] for row in db.fetchall()]
+            # a later page starts at the cursor instead of walking the index from the top
+            self.assertTrue(
+                any(line.startswith('SEARCH blogApp_post USING INDEX') and 'updated<' in line for line in plan),
+                '\n'.join(plan),
+            )
+
+    def test_activity(self):
+        self.assertIndexed(get_activity_page)
+        self.assertIndexed(get_activity_page, user=self.other)
+        self.assertIndexed(get_activity_page, q='django')
+
+    def test_post_detail(self):
+        def render_detail():
+            context = load_post_detail(self.post.id, self.user)
+            list(context['participants'])
+        self.assertIndexed(render_detail)
+
+    def test_category_sidebar(self):
+        self.assertIndexed(sidebar_categories)
+
+    def test_private_history(self):
+        self.assertIndexed(get_history, self.user.id, self.other.id)
+
+    def test_mark_unread_read(self):
+        self.assertIndexed(
+            lambda: PrivateMessage.objects.filter(recipient=self.user, sender=self.other, read=False).update(read=True)
+        )
+
+    def test_unread_for_recipient(self):
+        self.assertIndexed(lambda: PrivateMessage.objects.filter(recipient=self.user, read=False).count())
+
+    def test_inbox(self):
+        self.assertIndexed(get_inbox_page, self.user)
+
+
+class AsyncViewConcurrencyTests(SimpleTestCase):
+    DELAY = 0.2
+
+    def slow(self, result):
+        def read(*args, **kwargs):
+            self.threads.add(threading.get_ident())
+            time.sleep(self.DELAY)
+            return result
+        return read
+
+    async def test_home_reads_overlap(self):
+        self.threads = set()
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        with patch.multiple(
+            async_views,
+            get_home_feed=self.slow(([], None, 0)),
+            recent_activity=self.slow([]),
+            sidebar_categories=self.slow([]),
+            arender=AsyncMock(return_value=HttpResponse()),
+        ):
+            started = time.perf_counter()
+            # past the anonymous page cache
+            await async_views.home_view.__wrapped__(request)
+            elapsed = time.perf_counter() - started
+
+        self.assertEqual(len(self.threads), 3)
+        self.assertLess(elapsed, 2 * self.DELAY)
+
+
+class ReadThreadTests(TransactionTestCase):
+    def test_read_threads_keep_their_connection(self):
+        def read():
+            User.objects.exists()
+            return threading.get_ident(), connection.connection
+
+        calls = {async_to_sync(async_views.in_own_thread(read))() for _ in range(async_views.READ_THREADS * 2)}
+        threads = {thread for thread, _ in calls}
+        self.assertNotIn(threading.get_ident(), threads)
+        # a thread that is picked again still has the connection it opened before
+        self.assertEqual(len(calls), len(threads))
+
+
+class WriteQueueTests(SimpleTestCase):
+    def test_disabled_queue_writes_inline(self):
+        queue = WriteQueue(enabled=False)
+        threads = []
+        queue.defer(lambda: threads.append(threading.current_thread()))
+        self.assertEqual(threads, [threading.current_thread()])
+        self.assertIsNone(queue._thread)
+
+    def test_enabled_queue_defers_to_the_writer(self):
+        queue = WriteQueue(enabled=True)
+        done = threading.Event()
+        threads = []
+
+        def write():
+            threads.append(threading.current_thread())
+            done.set()
+        queue.defer(write)
+        self.assertTrue(done.wait(5))
+        self.assertEqual(threads, [queue._thread])
+
+
+class SessionStoreTests(TestCase):
+    # in a test transaction the write queue writes inline, so saves reach the database right away
+
+    def setUp(self):
+        cache.clear()
+
+    def saved(self, **data):
+        session = SessionStore()
+        session.update(data)
+        session.save()
+        return session.session_key
+
+    def test_read_through_the_cache(self):
+        key = self.saved(theme='dark')
+        self.assertTrue(Session.objects.filter(session_key=key).exists())
+        with self.assertNumQueries(0):
+            self.assertEqual(SessionStore(key).load(), {'theme': 'dark'})
+        # an evicted session comes back from the database and is cached again
+        cache.clear()
+        with self.assertNumQueries(1):
+            self.assertEqual(SessionStore(key).load(), {'theme': 'dark'})
+        with self.assertNumQueries(0):
+            self.assertEqual(SessionStore(key).load(), {'theme': 'dark'})
+
+    def test_write_replaces_the_cached_copy(self):
+        key = self.saved(theme='dark')
+        session = SessionStore(key)
+        session['theme'] = 'light'
+        session.save()
+        self.assertEqual(SessionStore(key).load(), {'theme': 'light'})
+        cache.clear()
+        self.assertEqual(SessionStore(key).load(), {'theme': 'light'})
+
+    def test_delete(self):
+        key = self.saved(theme='dark')
+        SessionStore(key).delete()
+        self.assertFalse(Session.objects.filter(session_key=key).exists())
+        self.assertFalse(SessionStore().exists(key))
+        self.assertEqual(SessionStore(key).load(), {})
+
+    def test_writes_still_queued_are_visible(self):
+        self.addCleanup(pending_writes._writes.clear)
+        with patch('blogApp.sessions.write_queue.defer') as defer:
+            key = self.saved(theme='dark')
+            cache.clear()
+            self.assertFalse(Session.objects.filter(session_key=key).exists())
+            self.assertTrue(SessionStore().exists(key))
+            self.assertEqual(SessionStore(key).load(), {'theme': 'dark'})
+            # one write per session however often it is saved before the queue gets to it
+            session = SessionStore(key)
+            session['theme'] = 'light'
+            session.save()
+            defer.assert_called_once_with(pending_writes.flush, key)
+
+            pending_writes.flush(key)
+            self.assertEqual(Session.objects.get(session_key=key).get_decoded(), {'theme': 'light'})
+            SessionStore(key).delete()
+            self.assertFalse(SessionStore().exists(key))
+            self.assertEqual(SessionStore(key).load(), {})
+
+
+class FeedCursorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='alice', email='alice@example.com', password='pw')
+        for i in range(3):
+            Post.objects.create(title=f'django tips {i}', created_by=user)
+
+    def test_search_pages_by_offset(self):
+        first, cursor = get_feed_page(q='django', page_size=2)
+        rest, end = get_feed_page(q='django', cursor=cursor, page_size=2)
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(rest), 1)
+        self.assertIsNone(end)
+        self.assertFalse({post.id for post in first} & {post.id for post in rest})
+
+    def test_tampered_cursor_starts_over(self):
+        first, _ = get_feed_page(q='django', page_size=2)
+        for value in (['o', -1], ['o', True], ['o', 1.5], ['o', '1'], ['o'], ['o', 1, 2], 'o', {'o': 1}):
+            with self.subTest(value=value):
+                page, _ = get_feed_page(q='django', cursor=encode_cursor(value), page_size=2)
+                self.assertEqual(page, first)
+        page, _ = get_feed_page(q='django', cursor='not base64!', page_size=2)
+        self.assertEqual(page, first)
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='alice', email='alice@example.com', password='pw')
+        python = Category.objects.create(name='python')
+        cls.asyncio = Post.objects.create(title='Understanding asyncio', category=python, created_by=user)
+        cls.migrations = Post.objects.create(title='Django migrations', description='Understanding schema changes', created_by=user)
+
+    def setUp(self):
+        if not fts_available():
+            self.skipTest('SQLite without FTS5 falls back to icontains')
+
+    def search(self, q):
+        return set(search_posts(q))
+
+    def test_words_match_by_prefix(self):
+        self.assertEqual(self.search('async'), {self.asyncio})
+        self.assertEqual(self.search('MIGR'), {self.migrations})
+        self.assertEqual(self.search('schem'), {self.migrations})
+        # prefixes of words, not any substring
+        self.assertEqual(self.search('syncio'), set())
+
+    def test_every_word_has_to_match(self):
+        self.assertEqual(self.search('django migr'), {self.migrations})
+        self.assertEqual(self.search('django async'), set())
+
+    def test_category_names(self):
+        self.assertEqual(self.search('pyth'), {self.asyncio})
+        self.assertEqual([category.name for category in search_categories('py')], ['python'])
+
+    def test_query_syntax_is_not_interpreted(self):
+        # OR is just another word that has to match
+        self.assertEqual(self.search('asyncio" OR *'), set())
+        self.assertEqual(self.search('"*'), set())
+
+    def test_edits_are_reindexed(self):
+        self.asyncio.title = 'Understanding trio'
+        self.asyncio.save()
+        self.assertEqual(self.search('async'), set())
+        self.assertEqual(self.search('trio'), {self.asyncio})
+
+    def test_home_feed_searches_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            page, cursor, total = get_home_feed('understand', page_size=1)
+        self.assertEqual((len(page), total), (1, 2))
+        self.assertIsNotNone(cursor)
+        self.assertEqual(len([query for query in queries if ' MATCH ' in query['sql']]), 1)
+
+
+class RecentActivityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='alice', email='alice@example.com', password='pw')
+        cls.post = Post.objects.create(title='Caching', created_by=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        # loads the (empty) window into the cache
+        recent_activity()
+
+    def test_new_message_joins_the_window(self):
+        Message.objects.create(user=self.user, post=self.post, body='first')
+        with self.assertNumQueries(0):
+            window = recent_activity()
+            self.assertEqual([(item.body, item.user.username, item.post.title) for item in window],
+                             [('first', 'alice', 'Caching')])
+
+    def test_loaded_relations_cost_no_queries(self):
+        message = Message.objects.create(user=self.user, post=self.post, body='first')
+        with self.assertNumQueries(0):
+            record_activity(message)
+
+    def test_missing_relations_cost_one_query(self):
+        message = Message.objects.create(user_id=self.user.id, post_id=self.post.id, body='first')
+        message = Message.objects.get(id=message.id)
+        with self.assertNumQueries(1):
+            record_activity(message)
+        with self.assertNumQueries(0):
+            self.assertEqual(recent_activity()[0].post.title, 'Caching')
+
+    def test_window_keeps_the_newest(self):
+        for i in range(RECENT_ACTIVITY_SIZE + 3):
+            Message.objects.create(user=self.user, post=self.post, body=f'm{i}')
+        window = recent_activity()
+        self.assertEqual(len(window), RECENT_ACTIVITY_SIZE)
+        self.assertEqual(window[0].body, f'm{RECENT_ACTIVITY_SIZE + 2}')
+        self.assertEqual(window, list(Message.objects.order_by('-created', '-id')[:RECENT_ACTIVITY_SIZE]))
+
+
+class PostDetailQueryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice, cls.bob = [
+            User.objects.create_user(username=name, email=f'{name}@example.com', password='pw')
+            for name in ('alice', 'bob')
+        ]
+        cls.post = Post.objects.create(title='Detail', category=Category.objects.create(name='django'), created_by=cls.alice)
+
+    def load(self, user):
+        # reads everything post.html reads from the context
+        context = load_post_detail(self.post.id, user)
+        post = context['post']
+        return (
+            post.created_by.username, post.category.name, post.participant_count,
+            [(message.user.username, message.post.title) for message in context['post_messages']],
+            list(context['participants']),
+        )
+
+    def test_fixed_number_of_queries(self):
+        for count in (1, 10):
+            for i in range(count):
+                Message.objects.create(user=(self.alice, self.bob)[i % 2], post=self.post, body=f'm{i}')
+            # post, thread page, participants and the viewer's vote
+            with self.assertNumQueries(4):
+                self.load(self.bob)
+            # no vote to look up for an anonymous viewer
+            with self.assertNumQueries(3):
+                self.load(AnonymousUser())
+
+
+class PageCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='alice', email='alice@example.com', password='pw')
+
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+        @cache_anonymous_page('post:{pk}')
+        def view(request, pk):
+            self.calls += 1
+            return HttpResponse(f'render {self.calls}')
+        self.view = view
+
+    def get(self, user=None, pk=1):
+        request = RequestFactory().get(f'/cached/{pk}/')
+        request.user = user or AnonymousUser()
+        return self.view(request, pk=pk).content
+
+    def test_anonymous_page_is_cached_until_its_version_is_bumped(self):
+        self.assertEqual((self.get(), self.get()), (b'render 1', b'render 1'))
+        # another post has its own scope
+        self.assertEqual(self.get(pk=2), b'render 2')
+        with self.captureOnCommitCallbacks(execute=True):
+            bump_versions('post:1')
+        self.assertEqual((self.get(), self.get(pk=2)), (b'render 3', b'render 2'))
+
+    def test_bump_waits_for_the_commit(self):
+        self.get()
+        with self.captureOnCommitCallbacks(execute=False):
+            bump_versions('post:1')
+        self.assertEqual(self.get(), b'render 1')
+
+    def test_logged_in_users_bypass_the_cache(self):
+        self.get()
+        self.assertEqual((self.get(self.user), self.get(self.user)), (b'render 2', b'render 3'))
+        self.assertEqual(self.get(), b'render 1')
+
+
+class PostETagTests(TransactionTestCase):
+    # with ASYNC_VIEWS the template renders on a read thread, which only sees committed rows
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user(username='alice', email='alice@example.com', password='pw')
+        self.post = Post.objects.create(title='Cached', created_by=self.user)
+        self.url = reverse('post', args=[self.post.id])
+
+    def test_matching_etag_is_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Message.objects.create(user=self.user, post=self.post, body='new comment')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'new comment')
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_varies_with_the_viewer(self):
+        anonymous = self.client.get(self.url)['ETag']
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=anonymous).status_code, 200)
+
+
+class CategoryPostCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='alice', email='alice@example.com', password='pw')
+        cls.django = Category.objects.create(name='django')
+        cls.python = Category.objects.create(name='python')
+
+    def setUp(self):
+        cache.clear()
+
+    def counts(self):
+        return dict(Category.objects.values_list('name', 'post_count'))
+
+    def test_create_move_and_delete(self):
+        post = Post.objects.create(title='One', category=self.django, created_by=self.user)
+        Post.objects.create(title='Two', category=self.django, created_by=self.user)
+        Post.objects.create(title='No category', created_by=self.user)
+        self.assertEqual(self.counts(), {'django': 2, 'python': 0})
+
+        post.category = self.python
+        post.save()
+        self.assertEqual(self.counts(), {'django': 1, 'python': 1})
+        # saving without a move leaves the counts alone
+        post.title = 'One, edited'
+        post.save()
+        self.assertEqual(self.counts(), {'django': 1, 'python': 1})
+
+        post.delete()
+        self.assertEqual(self.counts(), {'django': 1, 'python': 0})
+        Post.objects.all().delete()
+        self.assertEqual(self.counts(), {'django': 0, 'python': 0})
+
+    def test_sidebar_follows_the_counts(self):
+        self.assertEqual([c.name for c in sidebar_categories()['categories']], ['django', 'python'])
+        Post.objects.create(title='One', category=self.python, created_by=self.user)
+        self.assertEqual([c.name for c in sidebar_categories()['categories']], ['python', 'django'])
+
+    def test_recount_repairs_updates_that_skip_signals(self):
+        Post.objects.create(title='One', category=self.django, created_by=self.user)
+        Post.objects.update(category=self.python)
+        self.assertEqual(self.counts(), {'django': 1, 'python': 0})
+        recount_post_counts()
+        self.assertEqual(self.counts(), {'django': 0, 'python': 1})
+
+
+class VoteTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice, cls.bob, cls.carol = [
+            User.objects.create_user(username=name, email=f'{name}@example.com', password='pw')
+            for name in ('alice', 'bob', 'carol')
+        ]
+        cls.post = Post.objects.create(title='Votes', created_by=cls.alice)
+        cls.other = Post.objects.create(title='More votes', created_by=cls.alice)
+
+    def counts(self, post=None):
+        post = Post.objects.get(id=(post or self.post).id)
+        return post.upvote_count, post.downvote_count
+
+    def assertCountersMatchVotes(self):
+        for post in Post.objects.all():
+            up = Vote.objects.filter(post=post, value=Vote.UP).count()
+            down = Vote.objects.filter(post=post, value=Vote.DOWN).count()
+            self.assertEqual((post.upvote_count, post.downvote_count), (up, down), post)
+
+    def test_vote_switch_and_undo(self):
+        self.assertEqual(toggle_vote(self.post.id, self.bob, Vote.UP), Vote.UP)
+        self.assertEqual(self.counts(), (1, 0))
+        self.assertEqual(toggle_vote(self.post.id, self.bob, Vote.DOWN), Vote.DOWN)
+        self.assertEqual(self.counts(), (0, 1))
+        self.assertEqual(toggle_vote(self.post.id, self.bob, Vote.DOWN), 0)
+        self.assertEqual(self.counts(), (0, 0))
+        self.assertFalse(Vote.objects.exists())
+
+    def test_counters_follow_many_voters(self):
+        toggle_vote(self.post.id, self.alice, Vote.UP)
+        toggle_vote(self.post.id, self.bob, Vote.UP)
+        toggle_vote(self.post.id, self.carol, Vote.DOWN)
+        toggle_vote(self.other.id, self.bob, Vote.DOWN)
+        toggle_vote(self.post.id, self.alice, Vote.UP)
+        self.assertEqual(self.counts(), (1, 1))
+        self.assertCountersMatchVotes()
+
+    def test_deleting_a_user_releases_their_votes(self):
+        toggle_vote(self.post.id, self.bob, Vote.UP)
+        toggle_vote(self.other.id, self.bob, Vote.DOWN)
+        toggle_vote(self.post.id, self.carol, Vote.UP)
+        self.bob.delete()
+        self.assertEqual(self.counts(), (1, 0))
+        self.assertEqual(self.counts(self.other), (0, 0))
+
+    def test_bulk_deletes_release_votes(self):
+        for user in (self.alice, self.bob, self.carol):
+            toggle_vote(self.post.id, user, Vote.UP)
+            toggle_vote(self.other.id, user, Vote.DOWN)
+        # what the admin's delete action does
+        User.objects.filter(id__in=[self.bob.id, self.carol.id]).delete()
+        self.assertEqual((self.counts(), self.counts(self.other)), ((1, 0), (0, 1)))
+        Vote.objects.filter(post=self.other).delete()
+        self.assertEqual(self.counts(self.other), (0, 0))
+        self.assertCountersMatchVotes()
+
+    def test_undo_does_not_recount(self):
+        toggle_vote(self.post.id, self.bob, Vote.UP)
+        toggle_vote(self.post.id, self.carol, Vote.UP)
+        with patch('blogApp.signals.recount_votes') as recount:
+            toggle_vote(self.post.id, self.bob, Vote.UP)
+        recount.assert_not_called()
+        self.assertEqual(self.counts(), (1, 0))
+
+    def test_bulk_delete_recounts_each_post_once(self):
+        for user in (self.alice, self.bob, self.carol):
+            toggle_vote(self.post.id, user, Vote.UP)
+        toggle_vote(self.other.id, self.bob, Vote.DOWN)
+        with patch('blogApp.signals.recount_votes', wraps=recount_votes) as recount:
+            Vote.objects.all().delete()
+        self.assertEqual(sorted(call.args[0] for call in recount.call_args_list), [self.post.id, self.other.id])
+        self.assertCountersMatchVotes()
+
+    def test_editing_a_post_keeps_votes_cast_meanwhile(self):
+        self.client.force_login(self.alice)
+        # the request caches alice, a later test's user with the same id must not be served from it
+        self.addCleanup(cache.clear)
+        get_or_create = Category.objects.get_or_create
+
+        def vote_then_get_or_create(**kwargs):
+            # bob votes after the view loaded the post
+            toggle_vote(self.post.id, self.bob, Vote.UP)
+            return get_or_create(**kwargs)
+
+        with patch.object(Category.objects, 'get_or_create', side_effect=vote_then_get_or_create):
+            self.client.post(f'/update-post/{self.post.id}/', {'title': 'Edited', 'description': '', 'category': 'django'})
+        post = Post.objects.get(id=self.post.id)
+        self.assertEqual((post.title, post.category.name), ('Edited', 'django'))
+        self.assertEqual(self.counts(), (1, 0))
+
+    def test_retries_are_bounded(self):
+        with patch('blogApp.votes._toggle', side_effect=IntegrityError) as toggle:
+            with self.assertRaises(IntegrityError):
+                toggle_vote(self.post.id, self.bob, Vote.UP)
+        self.assertEqual(toggle.call_count, TOGGLE_ATTEMPTS)
+
+
+calls = []
+
+
+@task(max_attempts=2, retry_delay=10)
+def flaky(fail):
+    calls.append(fail)
+    if fail:
+        raise ValueError('boom')
+
+
+@patch('blogApp.taskqueue.workers.wake')
+class TaskQueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_dedup_while_pending(self, wake):
+        first = flaky.enqueue(fail=False, dedup_key='once')
+        self.assertIsNone(flaky.enqueue(fail=False, dedup_key='once'))
+        self.assertEqual(Task.objects.count(), 1)
+        # once it runs, the same key can be queued again
+        self.assertEqual(claim([Task.DEFAULT]).id, first.id)
+        self.assertIsNotNone(flaky.enqueue(fail=False, dedup_key='once'))
+
+    def test_success_removes_the_task(self, wake):
+        flaky.enqueue(fail=False)
+        run_task(claim([Task.DEFAULT]))
+        self.assertEqual(calls, [False])
+        self.assertFalse(Task.objects.exists())
+
+    def test_backoff_then_failed(self, wake):
+        flaky.enqueue(fail=True)
+        before = timezone.now()
+        with self.assertLogs('blogApp.taskqueue', 'WARNING'):
+            run_task(claim([Task.DEFAULT]))
+        retry = Task.objects.get()
+        self.assertEqual((retry.status, retry.attempts), (Task.PENDING, 1))
+        self.assertIn('boom', retry.last_error)
+        self.assertGreaterEqual(retry.run_at, before + timedelta(seconds=10))
+        # not due before the delay is over
+        self.assertIsNone(claim([Task.DEFAULT]))
+
+        Task.objects.update(run_at=timezone.now())
+        with self.assertLogs('blogApp.taskqueue', 'ERROR'):
+            run_task(claim([Task.DEFAULT]))
+        failed = Task.objects.get()
+        self.assertEqual((failed.status, failed.attempts), (Task.FAILED, 2))
+        self.assertIsNone(claim([Task.DEFAULT]))
+
+    def test_stale_task_is_requeued_then_failed(self, wake):
+        flaky.enqueue(fail=False)
+        claim([Task.DEFAULT])
+        Task.objects.update(started=timezone.now() - timedelta(seconds=600))
+        self.assertEqual(requeue_stale(timeout=300), 1)
+        requeued = Task.objects.get()
+        self.assertEqual((requeued.status, requeued.last_error), (Task.PENDING, 'timed out after 300s'))
+
+        claim([Task.DEFAULT])
+        Task.objects.update(started=timezone.now() - timedelta(seconds=600))
+        with self.assertLogs('blogApp.taskqueue', 'ERROR'):
+            requeue_stale(timeout=300)
+        failed = Task.objects.get()
+        self.assertEqual((failed.status, failed.attempts), (Task.FAILED, 2))
+        self.assertEqual(failed.last_error, 'timed out after 300s')
+
+
+@patch('blogApp.taskqueue.workers.wake')
+class TaskClaimRaceTests(TransactionTestCase):
+    # every worker thread needs its own connection to see the committed rows
+
+    def test_one_worker_gets_each_task(self, wake):
+        flaky.enqueue(fail=False)
+        barrier = threading.Barrier(4)
+        claimed = []
+
+        def worker():
+            barrier.wait()
+            try:
+                claimed.append(claim([Task.DEFAULT]))
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(claimed), 4)
+        self.assertEqual(len([t for t in claimed if t is not None]), 1)
+        self.assertEqual(Task.objects.get().attempts, 1)
+
+
+class WorkerStartupTests(TransactionTestCase):
+    def test_pending_task_from_before_a_restart_is_drained(self):
+        with patch('blogApp.taskqueue.workers.wake'):
+            flaky.enqueue(fail=False)
+        calls.clear()
+        pool = WorkerPool(threads=1, poll_interval=0.05)
+        pool.wake()
+        try:
+            deadline = time.monotonic() + 5
+            while Task.objects.exists() and time.monotonic() < deadline:
+                time.sleep(0.05)
+        finally:
+            pool.stop(timeout=5)
+        self.assertFalse(Task.objects.exists())
+        self.assertEqual(calls, [False])
+
+    def test_server_start_wakes_the_workers(self):
+        for module in ('blogProject.asgi', 'blogProject.wsgi'):
+            sys.modules.pop(module, None)
+            with patch('blogApp.taskqueue.workers.wake') as wake:
+                importlib.import_module(module)
+            wake.assert_called_once_with()
+
+
+def image_upload(name, size=(400, 200), fmt='PNG'):
+    buffer = BytesIO()
+    PILImage.new('RGB', size, 'red').save(buffer, fmt)
+    return SimpleUploadedFile(name, buffer.getvalue())
+
+
+@patch('blogApp.taskqueue.workers.wake')
+class RenditionTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.user = User.objects.create_user(username='alice', email='alice@example.com', password='pw')
+
+    def run_due_tasks(self):
+        while (queued := claim([Task.LOW])) is not None:
+            run_task(queued)
+
+    def test_upload_is_rendered_in_the_background(self, wake):
+        post = Post.objects.create(title='Pic', created_by=self.user, image=image_upload('pic.png'))
+        # the original is served until the renditions exist
+        self.assertEqual(post.image_url, post.image.url)
+        with patch('blogApp.signals.bump_versions') as bump:
+            self.run_due_tasks()
+        bump.assert_called_once_with('posts', f'post:{post.id}')
+
+        post = Post.objects.get(id=post.id)
+        self.assertEqual(post.image_renditions, post.image.name)
+        self.assertTrue(post.image_url.endswith('.960.webp'))
+        self.assertTrue(post.thumbnail_url.endswith('.320.webp'))
+        with post.image.storage.open(rendition_name(post.image.name, 320)) as handle:
+            self.assertEqual(PILImage.open(handle).size, (320, 160))
+
+    def test_avatar_is_cropped_square(self, wake):
+        self.user.avatar = image_upload('me.png')
+        self.user.save()
+        self.run_due_tasks()
+        user = User.objects.get(id=self.user.id)
+        for size in (64, 128):
+            with user.avatar.storage.open(rendition_name(user.avatar.name, size)) as handle:
+                self.assertEqual(PILImage.open(handle).size, (size, size))
+
+    def test_failed_render_is_retried(self, wake):
+        post = Post.objects.create(
+            title='Broken', created_by=self.user, image=SimpleUploadedFile('broken.png', b'not an image'),
+        )
+        with self.assertLogs('blogApp.taskqueue', 'WARNING'):
+            self.run_due_tasks()
+        retry = Task.objects.get()
+        self.assertEqual((retry.status, retry.attempts), (Task.PENDING, 1))
+        self.assertIn('UnidentifiedImageError', retry.last_error)
+        self.assertEqual(Post.objects.get(id=post.id).image_renditions, '')
+
+
+class RequestProfilingTests(TransactionTestCase):
+    # the writer thread and in_own_thread need committed rows and connections of their own
+
+    def setUp(self):
+        request_log.clear()
+        self.addCleanup(request_log.clear)
+        User.objects.create_user(username='alice', email='alice@example.com', password='pw')
+
+    def profile(self, view, **settings):
+        with self.settings(**settings):
+            middleware = RequestProfilingMiddleware(view)
+        return middleware(RequestFactory().get('/profiled/'))
+
+    def test_requests_are_logged(self):
+        def view(request):
+            User.objects.count()
+            User.objects.count()
+            return HttpResponse('ok')
+
+        self.profile(view, REQUEST_PROFILING=True)
+        [entry] = request_log.entries()
+        self.assertEqual((entry['view'], entry['status'], entry['queries']), ('/profiled/', 200, 2))
+        self.assertEqual(list(entry['duplicates'].values()), [2])
+        self.assertEqual(request_log.report()[0]['requests'], 1)
+
+    def test_queries_of_other_threads_count(self):
+        writes = WriteQueue(enabled=True)
+
+        def view(request):
+            User.objects.count()
+            writes.submit(User.objects.filter(username='alice').update, fullname='Alice').result()
+            async_to_sync(async_views.in_own_thread(User.objects.count))()
+            return HttpResponse('ok')
+
+        # a fresh read thread, its connection is opened once the middleware is loaded
+        with ThreadPoolExecutor(max_workers=1) as pool, patch.object(async_views, '_read_pool', pool):
+            self.profile(view, REQUEST_PROFILING=True)
+        self.assertEqual(request_log.entries()[0]['queries'], 3)
+
+    def test_query_budget(self):
+        def view(request):
+            User.objects.count()
+            User.objects.count()
+            return HttpResponse('ok')
+
+        self.assertEqual(self.profile(view, REQUEST_PROFILING_MAX_QUERIES=2).status_code, 200)
+        with self.assertRaisesMessage(QueryBudgetExceeded, 'ran 2 queries, the budget is 1'):
+            self.profile(view, REQUEST_PROFILING_MAX_QUERIES=1)
+
+    def test_off_by_default(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            RequestProfilingMiddleware(lambda request: HttpResponse('ok'))
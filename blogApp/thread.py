@@ -0,0 +1,75 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+from .models import Message, Post, User
+from .taskqueue import task
+from .votes import toggle_vote
+
+
+# Changes to the thread of a post. The HTTP views and chat.consumers.PostThreadConsumer both go
+# through here, so everyone viewing the post gets each change as a small frame instead of reloading.
+
+def thread_group(post_id):
+    return f'post_{post_id}'
+
+
+def broadcast(post_id, event):
+    def send():
+        layer = get_channel_layer()
+        if layer is not None:
+            async_to_sync(layer.group_send)(thread_group(post_id), {'type': 'thread_event', 'event': event})
+    transaction.on_commit(send)
+
+
+def serialize_user(user):
+    return {'id': user.id, 'username': user.username, 'fullname': user.fullname, 'avatar': user.avatar_url}
+
+
+def serialize_comment(message, user):
+    return {
+        'id': message.id,
+        'body': message.body,
+        'created': message.created.isoformat(),
+        'user': serialize_user(user),
+    }
+
+
+def add_comment(post_id, user, body):
+    message = Message.objects.create(user=user, post_id=post_id, body=body)
+    # the participants list can catch up after the comment is shown
+    add_participant.enqueue(post_id=post_id, user_id=user.id, dedup_key=f'participant:{post_id}:{user.id}')
+    broadcast(post_id, {'type': 'comment', 'comment': serialize_comment(message, user)})
+    return message
+
+
+def edit_comment(message, body):
+    message.body = body
+    message.save()
+    broadcast(message.post_id, {'type': 'comment_edited', 'id': message.id, 'body': body})
+
+
+def delete_comment(message):
+    post_id, message_id = message.post_id, message.id
+    message.delete()
+    broadcast(post_id, {'type': 'comment_deleted', 'id': message_id})
+
+
+# Applies an up/down click like toggle_vote and sends the new counters to the viewers
+def cast_vote(post_id, user, value):
+    current = toggle_vote(post_id, user, value)
+    counts = Post.objects.filter(id=post_id).values_list('upvote_count', 'downvote_count').first()
+    if counts is not None:
+        broadcast(post_id, {'type': 'votes', 'up': counts[0], 'down': counts[1]})
+    return current
+
+
+@task(lane='high')
+def add_participant(post_id, user_id):
+    # the post or the user may have been deleted since
+    post = Post.objects.filter(id=post_id).first()
+    user = User.objects.filter(id=user_id).first()
+    if post is None or user is None or post.participants.filter(id=user_id).exists():
+        return
+    post.participants.add(user)
+    broadcast(post_id, {'type': 'participant', 'user': serialize_user(user)})
@@ -1,13 +1,26 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.http import HttpResponse, JsonResponse
-from django.db.models import Q
+from django.utils.http import urlencode
 from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from .models import Post, Category, Message, User
+from .models import Post, Category, Message, User, Vote
 from chat.models import PrivateMessage
+from chat.conversations import get_inbox_page, mark_read
+from chat.presence import presence
+from chat.history import get_history, serialize_message
 from .forms import PostForm, CustomUserCreationForm, CustomUserUpdateForm
-from django.views.decorators.http import require_POST
+from .search import search_categories
+from .feed import get_feed_page, get_home_feed, next_page_query, serialize_post
+from .writes import write_queue
+from .thread import add_comment, cast_vote, delete_comment, edit_comment
+from .detail import load_post_detail
+from .caching import cache_anonymous_page, post_etag, post_last_modified
+from .categories import sidebar_categories
+from .activity import RECENT_ACTIVITY_SIZE, get_activity_page, recent_activity
+from django.views.decorators.http import condition, require_POST
+from django.contrib.admin.views.decorators import staff_member_required
+from .profiling import request_log
 # Create your views here.
 
 
@@ -53,42 +66,56 @@ def logout_view(request):
 
 
 
+@cache_anonymous_page('posts', 'activity', 'categories')
 def home_view(request):
     q = request.GET.get('q', '')
 
-    posts = Post.objects.filter(Q(category__name__icontains=q) | Q(title__icontains=q) | Q(description__icontains=q))
+    posts, next_cursor, post_count = get_home_feed(q, request.GET.get('cursor'))
 
-    post_messages = Message.objects.filter(Q(post__category__name__icontains=q))
-    categories = Category.objects.all()[0:6]
-    post_count = posts.count()
+    if q:
+        post_messages, _ = get_activity_page(q=q, page_size=RECENT_ACTIVITY_SIZE)
+    else:
+        post_messages = recent_activity()
 
-    context = {'posts':posts, 'categories':categories, 'post_count':post_count, 'post_messages':post_messages}
+    context = {'posts':posts, 'sidebar':sidebar_categories(), 'post_count':post_count, 'post_messages':post_messages,
+               'next_page': next_page_query(next_cursor, q)}
     return render(request, 'blogApp/home.html', context)
 
 
+def feed_page_view(request):
+    q = request.GET.get('q', '')
+    author = request.GET.get('author')
+    author = int(author) if author and author.isdigit() else None
+    posts, next_cursor = get_feed_page(q, request.GET.get('cursor'), author=author)
+
+    if request.GET.get('format') == 'json' or 'application/json' in request.headers.get('accept', ''):
+        return JsonResponse({
+            'posts': [serialize_post(post) for post in posts],
+            'next_cursor': next_cursor,
+        })
+    context = {'posts':posts, 'next_page': next_page_query(next_cursor, q, author)}
+    return render(request, 'blogApp/feed.html', context)
+
+
+@condition(etag_func=post_etag, last_modified_func=post_last_modified)
+@cache_anonymous_page('post:{pk}')
 def post_view(request, pk):
-    post = get_object_or_404(Post, id=pk)
-    post_messages = post.message_set.all()
-    participants = post.participants.all()
     if request.method == 'POST':
-        message = Message.objects.create(
-            user = request.user,
-            post = post,
-            body = request.POST.get('body'),
-        )
-        post.participants.add(request.user)
+        post = get_object_or_404(Post, id=pk)
+        add_comment(post.id, request.user, request.POST.get('body'))
         return redirect('post', pk=post.id)
 
-    context = {'post':post, 'post_messages':post_messages, 'participants':participants}
+    context = load_post_detail(pk, request.user, request.GET.get('cursor'))
     return render(request, 'blogApp/post.html', context)
 
 
+@cache_anonymous_page('posts', 'activity', 'categories', 'user:{pk}')
 def profile_view(request, pk):
     user = get_object_or_404(User, id=pk)
-    posts = user.post_set.all()
-    post_messages = user.message_set.all()
-    categories =  Category.objects.all()
-    context = {'user':user, 'posts':posts, 'post_messages':post_messages, 'categories':categories}
+    posts, next_cursor = get_feed_page(author=user)
+    post_messages, _ = get_activity_page(user=user, page_size=RECENT_ACTIVITY_SIZE)
+    context = {'user':user, 'posts':posts, 'post_messages':post_messages, 'sidebar':sidebar_categories(),
+               'next_page': next_page_query(next_cursor, author=user)}
     return render(request, 'blogApp/profile.html', context)
 
 
@@ -126,7 +153,8 @@ def update_post_view(request, pk):
         if form.is_valid():
             post = form.save(commit=False)
             post.category = category
-            post.save()
+            # the vote counters loaded above may be stale by now, they are not written back
+            post.save(update_fields=[*form.fields, 'category', 'updated'])
             return redirect('home')
     context = {'form':form, 'categories':categories}
     return render(request, 'blogApp/post_form.html', context)
@@ -150,22 +178,12 @@ def update_message_view(request, pk):
     if request.user != message.user:
         return HttpResponse('You are not allowed')
 
-    post = message.post  
-    post_messages = post.message_set.all()  
-    participants = post.participants.all()  
-
     if request.method == 'POST':
-        message.body = request.POST.get('body')
-        message.save()
-        return redirect('post', pk=post.id)
+        edit_comment(message, request.POST.get('body'))
+        return redirect('post', pk=message.post_id)
 
-    
-    context = {
-        'post': post,
-        'post_messages': post_messages,
-        'participants': participants,
-        'edit_message_body': message.body  
-    }
+    context = load_post_detail(message.post_id, request.user, request.GET.get('cursor'))
+    context['edit_message_body'] = message.body
     return render(request, 'blogApp/post.html', context)
 
 
@@ -175,7 +193,7 @@ def delete_message_view(request, pk):
     if request.user != message.user:
         return HttpResponse('You are not allowed')
     if request.method == 'POST':
-        message.delete()
+        delete_comment(message)
         return redirect('home')
     return render(request, 'blogApp/delete.html', {'obj':message})
 
@@ -188,55 +206,38 @@ def update_user_view(request):
     if request.method == 'POST':
         form = CustomUserUpdateForm(request.POST, request.FILES, instance=user)
         if form.is_valid():
-            form.save()
+            # request.user may come from the cache, so only its profile fields are written back
+            form.save(commit=False).save(update_fields=list(form.fields))
             return redirect('profile', pk=user.id)
 
     context = {'form':form}
     return render(request, 'blogApp/update_user.html', context)
 
 
+@cache_anonymous_page('categories')
 def category_page_view(request):
     q = request.GET.get('q', '')
-    categories = Category.objects.filter(name__icontains=q)
+    categories = search_categories(q)
     return render(request, 'blogApp/categories.html', {'categories':categories})
 
 
 def activity_page_view(request):
-    post_messages = Message.objects.all()
-    return render(request, 'blogApp/activity_page.html', {'post_messages':post_messages})
+    post_messages, next_cursor = get_activity_page(request.GET.get('cursor'))
+    next_page = urlencode({'cursor': next_cursor}) if next_cursor else ''
+    return render(request, 'blogApp/activity_page.html', {'post_messages':post_messages, 'next_page':next_page})
 
 
 @login_required(login_url='login')
 def upvote_post_view(request, pk):
-    post = get_object_or_404(Post, id=pk)
-    
-    # If user already downvoted, remove downvote
-    if request.user in post.downvotes.all():
-        post.downvotes.remove(request.user)
-    
-    # Toggle upvote
-    if request.user in post.upvotes.all():
-        post.upvotes.remove(request.user)
-    else:
-        post.upvotes.add(request.user)
-    
+    post = get_object_or_404(Post.objects.only('id'), id=pk)
+    write_queue.call(cast_vote, post.id, request.user, Vote.UP)
     return redirect('post', pk=post.id)
 
 
 @login_required(login_url='login')
 def downvote_post_view(request, pk):
-    post = get_object_or_404(Post, id=pk)
-    
-    # If user already upvoted, remove upvote
-    if request.user in post.upvotes.all():
-        post.upvotes.remove(request.user)
-    
-    # Toggle downvote
-    if request.user in post.downvotes.all():
-        post.downvotes.remove(request.user)
-    else:
-        post.downvotes.add(request.user)
-    
+    post = get_object_or_404(Post.objects.only('id'), id=pk)
+    write_queue.call(cast_vote, post.id, request.user, Vote.DOWN)
     return redirect('post', pk=post.id)
 
 
@@ -248,16 +249,24 @@ def private_messages_view(request, username):
         chat_messages = []
         return render(request, 'blogApp/private_chat.html', {'other': other, 'chat_messages': chat_messages})
 
-    # load messages between request.user and other
-    chat_messages = PrivateMessage.objects.filter(
-        (Q(sender=request.user) & Q(recipient=other)) |
-        (Q(sender=other) & Q(recipient=request.user))
-    ).order_by('created')
+    # load the latest messages between request.user and other, older ones are fetched on demand
+    chat_messages, has_more = get_history(request.user.id, other.id)
 
     # Mark messages as read
     PrivateMessage.objects.filter(recipient=request.user, sender=other, read=False).update(read=True)
+    mark_read(request.user, other)
 
-    return render(request, 'blogApp/private_chat.html', {'other': other, 'chat_messages': chat_messages})
+    context = {'other': other, 'chat_messages': chat_messages, 'has_more': has_more}
+    return render(request, 'blogApp/private_chat.html', context)
+
+
+@login_required(login_url='login')
+def private_history_view(request, username):
+    other = get_object_or_404(User, username=username)
+    before = request.GET.get('before', '')
+    before = int(before) if before.isdigit() else None
+    chat_messages, has_more = get_history(request.user.id, other.id, before)
+    return JsonResponse({'messages': [serialize_message(m) for m in chat_messages], 'has_more': has_more})
 
 
 @login_required(login_url='login')
@@ -266,37 +275,39 @@ def send_private_message_view(request, username):
     other = get_object_or_404(User, username=username)
     body = request.POST.get('body', '').strip()
     if body:
-        pm = PrivateMessage.objects.create(sender=request.user, recipient=other, body=body)
+        pm = write_queue.call(PrivateMessage.objects.create, sender=request.user, recipient=other, body=body)
         # If AJAX, return JSON
         if request.headers.get('x-requested-with') == 'XMLHttpRequest':
             return JsonResponse({'ok': True, 'id': pm.id, 'body': pm.body, 'sender': pm.sender.username, 'created': pm.created.isoformat()})
     return redirect('private-messages', username=other.username)
 
 
-# views.py
+@login_required(login_url='login')
+def unread_count_view(request):
+    return JsonResponse({'total': request.user.unread_private_messages})
+
 
 @login_required(login_url='login')
 def inbox(request):
-    user = request.user
-    
-    contacts = User.objects.filter(
-        Q(private_sent_messages__recipient=user) | Q(private_received_messages__sender=user)
-    ).distinct()
-    
-    conversations = []
-    for contact in contacts:
-        last_msg = PrivateMessage.objects.filter(
-            Q(sender=user, recipient=contact) |
-            Q(sender=contact, recipient=user)
-        ).order_by('-created').first()
-        
-        if last_msg:
-            conversations.append({
-                'user': contact,
-                'last_message': last_msg.body,
-                'last_time': last_msg.created,
-            })
-    
-    conversations.sort(key=lambda x: x['last_time'], reverse=True)
-    
-    return render(request, 'blogApp/inbox.html', {'conversations': conversations})
\ No newline at end of file
+    page = request.GET.get('page', '1')
+    page = int(page) if page.isdigit() and int(page) > 0 else 1
+    conversations, has_next = get_inbox_page(request.user, page)
+    online = presence.online_users([conv['user'].id for conv in conversations])
+    for conv in conversations:
+        conv['online'] = conv['user'].id in online
+
+    context = {'conversations': conversations, 'page': page, 'has_next': has_next}
+    return render(request, 'blogApp/inbox.html', context)
+
+
+@staff_member_required(login_url='login')
+def profiling_report_view(request):
+    if request.method == 'POST':
+        request_log.clear()
+        return redirect('profiling-report')
+    return render(request, 'blogApp/profiling.html', {'views': request_log.report()})
+
+
+@staff_member_required(login_url='login')
+def profiling_report_json_view(request):
+    return JsonResponse({'views': request_log.report(), 'recent': request_log.entries()[-50:]})
@@ -0,0 +1,86 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Post, Vote
+from .caching import bump_versions
+
+
+_COUNTER = {Vote.UP: 'upvote_count', Vote.DOWN: 'downvote_count'}
+TOGGLE_ATTEMPTS = 3
+
+
+def bump_counter(post_id, value, delta):
+    field = _COUNTER[value]
+    Post.objects.filter(id=post_id).update(**{field: F(field) + delta})
+    bump_versions(f'post:{post_id}')
+
+
+def _vote_count(value):
+    counts = (
+        Vote.objects.filter(post_id=OuterRef('pk'), value=value)
+        .order_by()
+        .values('post_id')
+        .annotate(total=Count('*'))
+        .values('total')
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def recount_votes(post_id):
+    # sets both counters from the Vote rows, for deletes that toggle_vote did not make
+    Post.objects.filter(id=post_id).update(
+        upvote_count=_vote_count(Vote.UP), downvote_count=_vote_count(Vote.DOWN),
+    )
+    bump_versions(f'post:{post_id}')
+
+
+def _toggle(post_id, user, value):
+    current = (
+        Vote.objects.select_for_update()
+        .filter(post_id=post_id, user=user)
+        .values_list('id', 'value')
+        .first()
+    )
+    if current is None:
+        Vote.objects.create(post_id=post_id, user=user, value=value)
+        bump_counter(post_id, value, 1)
+        return value
+
+    vote_id, current_value = current
+    if current_value == value:
+        vote = Vote(id=vote_id, post_id=post_id, user=user, value=current_value)
+        # the counter is decremented here, release_vote_on_delete leaves this delete alone
+        vote._counted = True
+        vote.delete()
+        bump_counter(post_id, value, -1)
+        return 0
+
+    Vote.objects.filter(id=vote_id).update(value=value)
+    bump_counter(post_id, current_value, -1)
+    bump_counter(post_id, value, 1)
+    return value
+
+
+# Applies an up/down click and returns the user's resulting vote: 1, -1 or 0
+def toggle_vote(post_id, user, value):
+    for attempt in range(TOGGLE_ATTEMPTS):
+        try:
+            with transaction.atomic():
+                return _toggle(post_id, user, value)
+        except IntegrityError:
+            # a concurrent click created the row first, apply ours on top of it
+            if attempt == TOGGLE_ATTEMPTS - 1:
+                raise
+
+
+def user_vote(post, user):
+    if not user.is_authenticated:
+        return 0
+    return Vote.objects.filter(post=post, user=user).values_list('value', flat=True).first() or 0
+
+
+async def auser_vote(post, user):
+    if not user.is_authenticated:
+        return 0
+    return await Vote.objects.filter(post=post, user=user).values_list('value', flat=True).afirst() or 0
@@ -0,0 +1,99 @@
+import asyncio
+import contextvars
+import functools
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import OperationalError, close_old_connections, connection
+
+
+BUSY_RETRIES = getattr(settings, 'SQLITE_BUSY_RETRIES', 5)
+BUSY_BACKOFF = 0.02
+
+
+def is_busy(error):
+    message = str(error).lower()
+    return 'database is locked' in message or 'database is busy' in message
+
+
+def retry_on_busy(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(BUSY_RETRIES + 1):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as error:
+                # inside an outer transaction only the whole transaction can be retried
+                if not is_busy(error) or attempt == BUSY_RETRIES or connection.in_atomic_block:
+                    raise
+                time.sleep(BUSY_BACKOFF * 2 ** attempt)
+    return wrapper
+
+
+class WriteQueue:
+    # Runs writes one at a time on a dedicated thread with its own connection, so writers in this
+    # process never compete with each other for the SQLite write lock
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            future, context, func, args, kwargs = self._queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            close_old_connections()
+            try:
+                future.set_result(context.run(retry_on_busy(func), *args, **kwargs))
+            except BaseException as error:
+                future.set_exception(error)
+
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+        # the write runs in the caller's context, e.g. for the query count of blogApp.profiling
+        self._queue.put((future, contextvars.copy_context(), func, args, kwargs))
+        self._ensure_thread()
+        return future
+
+    def _inline(self):
+        # a caller that is already in a transaction has to write on its own connection to see its rows
+        return (
+            not self.enabled
+            or connection.in_atomic_block
+            or threading.current_thread() is self._thread
+        )
+
+    def call(self, func, *args, **kwargs):
+        if self._inline():
+            return retry_on_busy(func)(*args, **kwargs)
+        return self.submit(func, *args, **kwargs).result()
+
+    def defer(self, func, *args, **kwargs):
+        # fire and forget, except that a caller in a transaction writes right away on its own connection
+        if self._inline():
+            retry_on_busy(func)(*args, **kwargs)
+        else:
+            self.submit(func, *args, **kwargs)
+
+    async def acall(self, func, *args, **kwargs):
+        if not self.enabled:
+            return await database_sync_to_async(retry_on_busy(func))(*args, **kwargs)
+        return await asyncio.wrap_future(self.submit(func, *args, **kwargs))
+
+
+write_queue = WriteQueue(
+    enabled=getattr(settings, 'SQLITE_WRITE_QUEUE', False) and settings.DATABASES['default']['ENGINE'].endswith('sqlite3'),
+)
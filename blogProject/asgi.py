@@ -20,6 +20,11 @@ django_asgi_app = get_asgi_application()
 
 django.setup()
 
+from blogApp.taskqueue import workers
+
+# tasks still pending from before a restart are run without waiting for the next enqueue
+workers.wake()
+
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
     "websocket": AuthMiddlewareStack(
@@ -55,7 +55,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'blogApp.middleware.StaticFilesMiddleware',
+    'blogApp.profiling.RequestProfilingMiddleware',
 
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -65,6 +66,43 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Serve the read-heavy pages with the async views in blogApp/async_views.py. Off by default, in
+# `manage.py benchmark` they are on par with the sync views since rendering dominates.
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS', 'False') == 'True'
+# Threads the async views run their reads and template rendering on, each keeps its connection
+ASYNC_READ_THREADS = 4
+
+# Per-view timing and query counts, reported at /profiling/ for staff users
+REQUEST_PROFILING = os.environ.get('REQUEST_PROFILING', 'False') == 'True'
+REQUEST_PROFILING_BUFFER_SIZE = 1000
+# Set to a number to fail any request that runs more queries than that (useful in tests)
+REQUEST_PROFILING_MAX_QUERIES = None
+
+# Pages, fragments and their versions live here. With more than one worker process point this at
+# a shared backend (e.g. CACHE_BACKEND=django.core.cache.backends.db.DatabaseCache) so that
+# invalidation reaches every process.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'blogApp.cache.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
+}
+# Anonymous responses of the home, profile, category and post pages
+PAGE_CACHE_TIMEOUT = 60
+
+# Sessions are read from the cache and written to the database behind the request (blogApp/sessions.py),
+# request.user is cached for a short time (blogApp/backends.py). AUTH_CACHE=False gives the plain
+# database sessions and user lookups.
+# The cached sessions need a cache that every process shares: with the process-local LocMemCache a
+# logout in one worker would not reach the others. They are only used with a shared CACHE_BACKEND, or
+# with SINGLE_PROCESS=True for a site served by one process (runserver, a single daphne).
+AUTH_CACHE = os.environ.get('AUTH_CACHE', 'True') == 'True'
+SHARED_CACHE = not CACHES['default']['BACKEND'].endswith('LocMemCache')
+SINGLE_PROCESS = os.environ.get('SINGLE_PROCESS', 'False') == 'True'
+if AUTH_CACHE and (SHARED_CACHE or SINGLE_PROCESS):
+    SESSION_ENGINE = 'blogApp.sessions'
+USER_CACHE_TIMEOUT = 30 if AUTH_CACHE else 0
+
 AUTH_USER_MODEL = 'blogApp.User'
 
 ROOT_URLCONF = 'blogProject.urls'
@@ -79,6 +117,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'chat.context_processors.unread_messages',
             ],
         },
     },
@@ -92,10 +131,45 @@ ASGI_APPLICATION = 'blogProject.asgi.application'
 
 CHANNEL_LAYERS = {
     'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        'BACKEND': 'chat.layers.LocalChannelLayer',
     }
 }
 
+# Which users have sockets open, see chat/presence.py
+CHAT_PRESENCE_STORE = {
+    'BACKEND': 'chat.presence.LocalPresenceStore',
+}
+CHAT_PRESENCE_HEARTBEAT = 30
+CHAT_PRESENCE_TIMEOUT = 90
+
+# Run more than one worker process by sharing the channel layer (and presence) through SQLite
+if os.environ.get('CHANNEL_LAYER') == 'sqlite':
+    CHANNEL_LAYERS['default'] = {
+        'BACKEND': 'chat.layers.SQLiteChannelLayer',
+        'CONFIG': {
+            'path': os.environ.get('CHANNEL_LAYER_PATH', BASE_DIR / 'channels.sqlite3'),
+            'capacity': 100,
+            'expiry': 60,
+            'group_expiry': 86400,
+        },
+    }
+    CHAT_PRESENCE_STORE = {
+        'BACKEND': 'chat.presence.SQLitePresenceStore',
+        'OPTIONS': {'path': CHANNEL_LAYERS['default']['CONFIG']['path']},
+    }
+
+# Broadcast chat messages before they are stored and write them in batches
+CHAT_WRITE_BEHIND = os.environ.get('CHAT_WRITE_BEHIND', 'False') == 'True'
+CHAT_WRITE_BEHIND_BATCH_SIZE = 100
+CHAT_WRITE_BEHIND_INTERVAL = 0.005
+
+# Clients that negotiate a wire subprotocol (chat/wire.py) get the events of this many seconds in one frame
+CHAT_BATCH_WINDOW = 0.005
+
+# Message notifications are merged per recipient over a short window and sent at most this often
+CHAT_NOTIFICATION_WINDOW = 0.5
+CHAT_NOTIFICATION_MIN_INTERVAL = 2.0
+
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
@@ -106,6 +180,29 @@ DATABASES = {
     }
 }
 
+# Production tuning for SQLite under Daphne: WAL so readers never block the writer, writers wait on
+# the lock instead of failing, connections are kept between requests and chat/vote writes go
+# through a single writer thread (blogApp/writes.py). SQLITE_TUNED=False gives the plain defaults.
+SQLITE_TUNED = os.environ.get('SQLITE_TUNED', 'True') == 'True'
+if SQLITE_TUNED:
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                'PRAGMA cache_size=-20000;'
+                'PRAGMA mmap_size=134217728;'
+                'PRAGMA temp_store=MEMORY;'
+            ),
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+    })
+SQLITE_WRITE_QUEUE = SQLITE_TUNED
+SQLITE_BUSY_RETRIES = 5
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -163,6 +260,14 @@ MEDIA_URL = 'media/'
 
 MEDIA_ROOT = BASE_DIR/ 'media/'
 
+# Deferred work (image renditions, comment participants) is stored in the Task table and run by
+# TASK_WORKERS threads of the web process. Set TASK_WORKERS=0 and run `manage.py run_tasks` to
+# do it in separate worker processes instead.
+TASK_WORKERS = int(os.environ.get('TASK_WORKERS', 1))
+TASK_POLL_INTERVAL = 1.0
+# seconds after which a task that is still running is assumed lost and run again
+TASK_TIMEOUT = 300
+
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
 # Default primary key field type
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'blogProject.settings')
 
 application = get_wsgi_application()
+
+from blogApp.taskqueue import workers
+
+# tasks still pending from before a restart are run without waiting for the next enqueue
+workers.wake()
@@ -1,61 +1,103 @@
-import json
+import uuid
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.layers import get_channel_layer
-from django.contrib.auth import get_user_model
 from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import IntegrityError
+from .models import PrivateMessage
+from .history import get_history, serialize_message
+from .users import user_id_cache, resolve_user_id
+from .writebehind import message_buffer
+from .notifications import notifications
+from .presence import conversation_context, presence, presence_group
+from .wire import WireMixin
+from blogApp.models import Message, Post, Vote
+from blogApp.thread import add_comment, cast_vote, delete_comment, edit_comment, thread_group
+from blogApp.writes import write_queue
+
+
+PRESENCE_WATCH_LIMIT = 200
+
+
+def parse_client_id(value):
+    # clients may tag a message with their own uuid so resends are not stored twice
+    try:
+        return uuid.UUID(str(value))
+    except ValueError:
+        return uuid.uuid4()
+
+
+def store_private_message(sender_id, recipient_id, body, client_id):
+    try:
+        return PrivateMessage.objects.create(
+            sender_id=sender_id, recipient_id=recipient_id, body=body, client_id=client_id,
+        )
+    except IntegrityError:
+        # the client resent a message that is already stored
+        return None
 
 
+def change_own_comment(post_id, user, message_id, body=None):
+    # edits the comment, or deletes it when there is no body, if it belongs to the user
+    message = Message.objects.filter(id=message_id, post_id=post_id, user=user).first()
+    if message is None:
+        return False
+    if body is None:
+        delete_comment(message)
+    else:
+        edit_comment(message, body)
+    return True
 
 
-# class ChatConsumer(AsyncWebsocketConsumer):
-#     async def connect(self):
-#         self.room_name = self.scope['url_route']['kwargs']['room_name']
-#         self.room_group_name = f'chat_{self.room_name}'
+class PostThreadConsumer(WireMixin, AsyncWebsocketConsumer):
+    # Everyone viewing a post joins its group and gets comments, edits, deletes, votes and new
+    # participants as they happen. Logged in viewers can make those changes through the socket too.
 
-#         # Join room group
-#         await self.channel_layer.group_add(
-#             self.room_group_name,
-#             self.channel_name
-#         )
+    async def connect(self):
+        self.post_id = int(self.scope['url_route']['kwargs']['post_id'])
+        if not await Post.objects.filter(id=self.post_id).aexists():
+            await self.close()
+            return
+        self.group_name = thread_group(self.post_id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept_wire()
 
-#         await self.accept()
+    async def disconnect(self, close_code):
+        if hasattr(self, 'group_name'):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
 
-#     async def disconnect(self, close_code):
-#         # Leave room group
-#         await self.channel_layer.group_discard(
-#             self.room_group_name,
-#             self.channel_name
-#         )
+    async def receive_event(self, data):
+        user = self.scope['user']
+        if not user.is_authenticated:
+            await self.send_error('Log in to take part in the thread')
+            return
 
-#     # Receive message from WebSocket
-#     async def receive(self, text_data):
-#         data = json.loads(text_data)
-#         message = data.get('message', '')
-#         username = data.get('username', 'Anonymous')
+        action = data.get('action')
+        body = data.get('body')
+        body = body.strip() if isinstance(body, str) else ''
+        message_id = data.get('id')
 
-#         # Send message to room group
-#         await self.channel_layer.group_send(
-#             self.room_group_name,
-#             {
-#                 'type': 'chat_message',
-#                 'message': message,
-#                 'username': username,
-#             }
-#         )
+        if action == 'comment' and body:
+            await write_queue.acall(add_comment, self.post_id, user, body)
+        elif action in ('edit', 'delete') and isinstance(message_id, int) and (body or action == 'delete'):
+            changed = await write_queue.acall(
+                change_own_comment, self.post_id, user, message_id, body if action == 'edit' else None,
+            )
+            if not changed:
+                await self.send_error('You are not allowed')
+        elif action == 'vote' and data.get('value') in (Vote.UP, Vote.DOWN):
+            current = await write_queue.acall(cast_vote, self.post_id, user, data['value'])
+            # only the voter's own buttons change, everyone gets the counters
+            await self.send_event({'type': 'vote', 'value': current})
 
-#     # Receive message from room group
-#     async def chat_message(self, event):
-#         message = event['message']
-#         username = event['username']
+    async def thread_event(self, event):
+        await self.send_event(event['event'])
 
-#         # Send message to WebSocket
-#         await self.send(text_data=json.dumps({
-#             'message': message,
-#             'username': username,
-#         }))
+    async def send_error(self, error):
+        await self.send_event({'type': 'error', 'error': error})
 
 
-class PrivateChatConsumer(AsyncWebsocketConsumer):
+class PrivateChatConsumer(WireMixin, AsyncWebsocketConsumer):
     async def connect(self):
         self.other_username = self.scope['url_route']['kwargs']['username']
         self.user = self.scope['user']
@@ -63,88 +105,117 @@ class PrivateChatConsumer(AsyncWebsocketConsumer):
             await self.close()
             return
 
+        # Resolve the other side once, every message afterwards reuses the id
+        self.other_id = await self.get_user_id(self.other_username)
+        if self.other_id is None:
+            await self.close()
+            return
+
         # Create a stable room name for the pair (alphabetical)
         users = sorted([self.user.username, self.other_username])
         self.room_group_name = f'pm_{users[0]}_{users[1]}'
 
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
-        await self.accept()
+        await self.channel_layer.group_add(presence_group(self.other_id), self.channel_name)
+        await self.accept_wire()
+        await presence.connect(self.user.id, self.channel_name, conversation_context(self.other_id))
+        await self.presence_changed({
+            'user_id': self.other_id,
+            'online': await presence.ais_online(self.other_id),
+        })
 
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+        if hasattr(self, 'room_group_name'):
+            await presence.disconnect(self.user.id, self.channel_name)
+            await self.channel_layer.group_discard(presence_group(self.other_id), self.channel_name)
+            await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+
+    async def receive_event(self, data):
+        if data.get('action') == 'load_history':
+            await self.send_history(data.get('before'))
+            return
 
-    async def receive(self, text_data):
-        data = json.loads(text_data)
         body = data.get('message', '').strip()
         if not body:
             return
 
         sender = self.user.username
+        client_id = parse_client_id(data.get('client_id'))
+
+        if settings.CHAT_WRITE_BEHIND:
+            # broadcast first, the buffer persists the message a few milliseconds later
+            await self.channel_layer.group_send(
+                self.room_group_name,
+                {
+                    'type': 'private_message',
+                    'message': body,
+                    'sender': sender,
+                    'client_id': str(client_id),
+                }
+            )
+            await message_buffer.add(PrivateMessage(
+                sender_id=self.user.id, recipient_id=self.other_id, body=body, client_id=client_id,
+            ))
+        else:
+            await self.save_private_message(body, client_id)
+
+            await self.channel_layer.group_send(
+                self.room_group_name,
+                {
+                    'type': 'private_message',
+                    'message': body,
+                    'sender': sender,
+                    'client_id': str(client_id),
+                }
+            )
 
-        await self.save_private_message(
-            self.user.username,
-            self.other_username,
-            body
-        )
-
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'private_message',
-                'message': body,
-                'sender': sender,
-            }
-        )
-
-        await self.send_notification_to_user(
-            self.other_username,
-            sender,
-            body
-        )
+        await self.send_notification_to_user(sender, body)
 
 
     async def private_message(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_event({
             'message': event['message'],
             'sender': event['sender'],
-        }))
+            'client_id': event.get('client_id'),
+        })
+
+    async def presence_changed(self, event):
+        await self.send_event({
+            'type': 'presence',
+            'online': {event['user_id']: event['online']},
+        })
+
+    async def send_history(self, before):
+        # like the before parameter of private_history_view, anything but a message id starts at the latest page
+        before = before if type(before) is int and before > 0 else None
+        messages, has_more = await self.load_history(before)
+        await self.send_event({
+            'type': 'history',
+            'messages': messages,
+            'has_more': has_more,
+        })
 
     @database_sync_to_async
-    def save_private_message(self, sender_username, recipient_username, body):
-        User = get_user_model()
-        try:
-            sender = User.objects.get(username=sender_username)
-            recipient = User.objects.get(username=recipient_username)
-        except User.DoesNotExist:
-            return None
-        from blogApp.models import PrivateMessage
-        return PrivateMessage.objects.create(sender=sender, recipient=recipient, body=body)
-    
-    @database_sync_to_async
-    def get_user_id(self, username):
-        User = get_user_model()
-        try:
-            return User.objects.get(username=username).id
-        except User.DoesNotExist:
-            return None
-
-    async def send_notification_to_user(self, recipient_username, sender, message):
-        user_id = await self.get_user_id(recipient_username)
-        if not user_id:
-            return
+    def load_history(self, before):
+        messages, has_more = get_history(self.user.id, self.other_id, before)
+        return [serialize_message(m) for m in messages], has_more
 
-        await self.channel_layer.group_send(
-            f"user_{user_id}",
-            {
-                "type": "send_notification",
-                "message": message,
-                "sender": sender,
-            }
-        )
+    async def save_private_message(self, body, client_id):
+        return await write_queue.acall(store_private_message, self.user.id, self.other_id, body, client_id)
 
+    async def get_user_id(self, username):
+        user_id = user_id_cache.get(username)
+        if user_id is None:
+            user_id = await database_sync_to_async(resolve_user_id)(username)
+        return user_id
 
+    async def send_notification_to_user(self, sender, message):
+        # coalesced per recipient and rate limited, see chat.notifications
+        notifications.add(self.other_id, self.user.id, sender, message)
 
-class NotificationConsumer(AsyncWebsocketConsumer):
+
+
+class NotificationConsumer(WireMixin, AsyncWebsocketConsumer):
     async def connect(self):
         user = self.scope["user"]
 
@@ -154,23 +225,62 @@ class NotificationConsumer(AsyncWebsocketConsumer):
 
         # UNIQUE group per user
         self.group_name = f"user_{user.id}"
+        self.watching = set()
 
         await self.channel_layer.group_add(
             self.group_name,
             self.channel_name
         )
-        await self.accept()
+        await self.accept_wire()
+        await presence.connect(user.id, self.channel_name)
 
     async def disconnect(self, close_code):
         user = self.scope["user"]
         if user.is_authenticated:
+            await presence.disconnect(user.id, self.channel_name)
+            await self.watch(set())
             await self.channel_layer.group_discard(
                 self.group_name,
                 self.channel_name
             )
 
+    async def receive_event(self, data):
+        if data.get('action') == 'watch_presence':
+            # pages with a contact list ask for their online state and get every change pushed
+            users = data.get('users')
+            users = {user_id for user_id in users if isinstance(user_id, int)} if isinstance(users, list) else set()
+            await self.watch(set(sorted(users)[:PRESENCE_WATCH_LIMIT]))
+
+    async def watch(self, users):
+        for user_id in self.watching - users:
+            await self.channel_layer.group_discard(presence_group(user_id), self.channel_name)
+        for user_id in users - self.watching:
+            await self.channel_layer.group_add(presence_group(user_id), self.channel_name)
+        self.watching = users
+        if users:
+            online = await presence.aonline_users(users)
+            await self.send_event({
+                "type": "presence",
+                "online": {user_id: user_id in online for user_id in users},
+            })
+
     async def send_notification(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_event({
+            "type": "notification",
             "message": event["message"],
             "sender": event.get("sender"),
-        }))
+            "count": event.get("count", 1),
+            "senders": event.get("senders", []),
+        })
+
+    async def presence_changed(self, event):
+        await self.send_event({
+            "type": "presence",
+            "online": {event["user_id"]: event["online"]},
+        })
+
+    async def unread_count(self, event):
+        await self.send_event({
+            "type": "unread",
+            "total": event["total"],
+        })
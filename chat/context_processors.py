@@ -0,0 +1,8 @@
+def unread_messages(request):
+    # evaluated only when a template uses it, the value rides on request.user so no query is made
+    def total():
+        user = getattr(request, 'user', None)
+        if user is None or not user.is_authenticated:
+            return 0
+        return user.unread_private_messages
+    return {'unread_private_messages': total}
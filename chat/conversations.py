@@ -0,0 +1,127 @@
+from django.db import transaction
+from django.db.models import F, Q, Value
+from django.db.models.functions import Greatest
+
+from .models import Conversation, PrivateMessage
+from .unread import add_unread, remove_unread
+
+
+INBOX_PAGE_SIZE = 30
+
+
+def _pair(first_id, second_id):
+    return (first_id, second_id) if first_id < second_id else (second_id, first_id)
+
+
+def _apply(user_a_id, user_b_id, last, unread):
+    summary = {
+        'last_message': last,
+        'last_message_body': last.body,
+        'last_message_at': last.created,
+    }
+    increments = {field: F(field) + count for field, count in unread.items() if count}
+    # the pair usually exists already, so try the single UPDATE first
+    updated = Conversation.objects.filter(user_a_id=user_a_id, user_b_id=user_b_id).update(
+        **summary, **increments
+    )
+    if not updated:
+        conversation, created = Conversation.objects.get_or_create(
+            user_a_id=user_a_id, user_b_id=user_b_id,
+            defaults={**summary, **unread},
+        )
+        if not created:
+            Conversation.objects.filter(id=conversation.id).update(**summary, **increments)
+
+
+def record_messages(messages):
+    # one UPDATE per conversation however many of its messages are in the batch
+    pairs = {}
+    recipients = {}
+    for message in messages:
+        recipients[message.recipient_id] = recipients.get(message.recipient_id, 0) + 1
+        user_a_id, user_b_id = _pair(message.sender_id, message.recipient_id)
+        _, unread = pairs.get((user_a_id, user_b_id), (None, {'unread_a': 0, 'unread_b': 0}))
+        unread['unread_a' if message.recipient_id == user_a_id else 'unread_b'] += 1
+        pairs[(user_a_id, user_b_id)] = (message, unread)
+    with transaction.atomic():
+        for (user_a_id, user_b_id), (last, unread) in pairs.items():
+            _apply(user_a_id, user_b_id, last, unread)
+        add_unread(recipients)
+
+
+def record_message(message):
+    record_messages([message])
+
+
+def mark_read(user, other):
+    user_a_id, user_b_id = _pair(user.id, other.id)
+    unread_field = 'unread_a' if user.id == user_a_id else 'unread_b'
+    conversation = Conversation.objects.filter(user_a_id=user_a_id, user_b_id=user_b_id)
+    with transaction.atomic():
+        cleared = conversation.values_list(unread_field, flat=True).first()
+        if not cleared:
+            return
+        conversation.update(**{unread_field: 0})
+        remove_unread({user.id: cleared})
+    user.unread_private_messages = max(user.unread_private_messages - cleared, 0)
+
+
+def unrecord_message(message):
+    # a deleted message that was never read stops counting as unread
+    user_a_id, user_b_id = _pair(message.sender_id, message.recipient_id)
+    unread_field = 'unread_a' if message.recipient_id == user_a_id else 'unread_b'
+    conversation = Conversation.objects.filter(user_a_id=user_a_id, user_b_id=user_b_id)
+    with transaction.atomic():
+        if not message.read:
+            conversation.update(**{unread_field: Greatest(F(unread_field) - 1, Value(0))})
+            remove_unread({message.recipient_id: 1})
+        # deleting the last message set the foreign key to null, the one before it takes its place
+        if conversation.filter(last_message=None).exists():
+            _restore_last_message(user_a_id, user_b_id)
+
+
+def _restore_last_message(user_a_id, user_b_id):
+    conversation = Conversation.objects.filter(user_a_id=user_a_id, user_b_id=user_b_id)
+    last = (
+        PrivateMessage.objects.filter(
+            Q(sender_id=user_a_id, recipient_id=user_b_id) | Q(sender_id=user_b_id, recipient_id=user_a_id)
+        )
+        .order_by('-created', '-id')
+        .first()
+    )
+    if last is None:
+        conversation.delete()
+    else:
+        conversation.update(last_message=last, last_message_body=last.body, last_message_at=last.created)
+
+
+def _inbox_conversations(user, page, page_size):
+    offset = (page - 1) * page_size
+    return (
+        Conversation.objects.filter(Q(user_a=user) | Q(user_b=user))
+        .select_related('user_a', 'user_b')
+        .order_by('-last_message_at')[offset:offset + page_size + 1]
+    )
+
+
+def _inbox_rows(user, conversations, page_size):
+    has_next = len(conversations) > page_size
+    rows = [
+        {
+            'user': conversation.other_user(user),
+            'last_message': conversation.last_message_body,
+            'last_time': conversation.last_message_at,
+            'unread': conversation.unread_for(user),
+        }
+        for conversation in conversations[:page_size]
+    ]
+    return rows, has_next
+
+
+def get_inbox_page(user, page=1, page_size=INBOX_PAGE_SIZE):
+    return _inbox_rows(user, list(_inbox_conversations(user, page, page_size)), page_size)
+
+
+async def aget_inbox_page(user, page=1, page_size=INBOX_PAGE_SIZE):
+    conversations = [conversation async for conversation in _inbox_conversations(user, page, page_size)]
+    return _inbox_rows(user, conversations, page_size)
@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.db.models import Q, Subquery
+
+from .models import PrivateMessage
+
+
+HISTORY_PAGE_SIZE = getattr(settings, 'CHAT_HISTORY_PAGE_SIZE', 50)
+
+
+def get_history(user_id, other_id, before=None, limit=HISTORY_PAGE_SIZE):
+    messages = PrivateMessage.objects.filter(
+        Q(sender_id=user_id, recipient_id=other_id) | Q(sender_id=other_id, recipient_id=user_id)
+    ).select_related('sender')
+    if before is not None:
+        before_created = Subquery(PrivateMessage.objects.filter(id=before).values('created')[:1])
+        messages = messages.filter(Q(created__lt=before_created) | Q(created=before_created, id__lt=before))
+    page = list(messages.order_by('-created', '-id')[:limit + 1])
+    has_more = len(page) > limit
+    page = page[:limit]
+    page.reverse()
+    return page, has_more
+
+
+def serialize_message(message):
+    return {
+        'id': message.id,
+        'message': message.body,
+        'sender': message.sender.username,
+        'created': message.created.isoformat(),
+    }
@@ -0,0 +1,301 @@
+import asyncio
+import random
+import sqlite3
+import string
+import threading
+import time
+import uuid
+
+import msgpack
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer, InMemoryChannelLayer
+
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS channel_messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        channel TEXT NOT NULL,
+        inbox TEXT NOT NULL,
+        payload BLOB NOT NULL,
+        expires REAL NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS channel_messages_channel ON channel_messages (channel, id)",
+    "CREATE INDEX IF NOT EXISTS channel_messages_inbox ON channel_messages (inbox, id)",
+    """CREATE TABLE IF NOT EXISTS channel_groups (
+        grp TEXT NOT NULL,
+        channel TEXT NOT NULL,
+        expires REAL NOT NULL,
+        PRIMARY KEY (grp, channel)
+    )""",
+]
+
+
+class LocalChannelLayer(InMemoryChannelLayer):
+    # The in-memory layer of one process. Its queues belong to the server's event loop, so a send
+    # from another thread (the writer thread, task workers) is handed to that loop, otherwise the
+    # waiting consumer would not wake up.
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._loop = None
+
+    async def receive(self, channel):
+        self._loop = asyncio.get_running_loop()
+        return await super().receive(channel)
+
+    async def send(self, channel, message):
+        await self._on_loop(super().send, channel, message)
+
+    async def group_send(self, group, message):
+        await self._on_loop(super().group_send, group, message)
+
+    async def _on_loop(self, send, *args):
+        loop = self._loop
+        if loop is None or loop.is_closed() or loop is asyncio.get_running_loop():
+            return await send(*args)
+        await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(send(*args), loop))
+
+
+class SQLiteFile:
+    # Thread-local connections to a SQLite file in WAL mode, the tables in SCHEMA are created on first use
+
+    SCHEMA = []
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        if not self._schema_ready:
+            with self._schema_lock:
+                if not self._schema_ready:
+                    for statement in self.SCHEMA:
+                        conn.execute(statement)
+                    self._schema_ready = True
+        return conn
+
+    def _transaction(self, work):
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            result = work(conn)
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return result
+
+
+class SQLiteChannelLayer(SQLiteFile, BaseChannelLayer):
+    # Lets several workers on one host share channels and groups through a SQLite file in WAL mode.
+    # Process-specific channels are drained by a single poller task per process.
+
+    extensions = ['groups', 'flush']
+    SCHEMA = SCHEMA
+
+    def __init__(
+        self,
+        path='channels.sqlite3',
+        expiry=60,
+        group_expiry=86400,
+        capacity=100,
+        channel_capacity=None,
+        poll_interval=0.005,
+        max_poll_interval=0.1,
+        batch_size=100,
+        **kwargs,
+    ):
+        BaseChannelLayer.__init__(self, expiry=expiry, capacity=capacity, channel_capacity=channel_capacity, **kwargs)
+        SQLiteFile.__init__(self, path)
+        self.channel_capacity = self.compile_capacities(self.channel_capacity)
+        self.group_expiry = group_expiry
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.batch_size = batch_size
+        self.client_prefix = uuid.uuid4().hex[:12]
+        self._queues = {}
+        self._inboxes = set()
+        self._poller = None
+        self._last_cleanup = 0.0
+
+    # Storage
+
+    def _queued(self, conn, channel, now):
+        return conn.execute(
+            'SELECT COUNT(*) FROM channel_messages WHERE channel = ? AND expires > ?', (channel, now)
+        ).fetchone()[0]
+
+    def _insert(self, channel, payload):
+        def work(conn):
+            now = time.time()
+            if self._queued(conn, channel, now) >= self.get_capacity(channel):
+                raise ChannelFull(channel)
+            conn.execute(
+                'INSERT INTO channel_messages (channel, inbox, payload, expires) VALUES (?, ?, ?, ?)',
+                (channel, self.non_local_name(channel), payload, now + self.expiry),
+            )
+        self._transaction(work)
+
+    def _insert_group(self, group, payload):
+        def work(conn):
+            now = time.time()
+            channels = [
+                row[0] for row in conn.execute(
+                    'SELECT channel FROM channel_groups WHERE grp = ? AND expires > ?', (group, now)
+                )
+            ]
+            # full channels are skipped rather than failing the whole group send
+            rows = [
+                (channel, self.non_local_name(channel), payload, now + self.expiry)
+                for channel in channels
+                if self._queued(conn, channel, now) < self.get_capacity(channel)
+            ]
+            conn.executemany(
+                'INSERT INTO channel_messages (channel, inbox, payload, expires) VALUES (?, ?, ?, ?)', rows
+            )
+        self._transaction(work)
+
+    def _pop(self, column, values, limit):
+        def work(conn):
+            now = time.time()
+            marks = ','.join('?' * len(values))
+            rows = conn.execute(
+                f'SELECT id, channel, payload FROM channel_messages '
+                f'WHERE {column} IN ({marks}) AND expires > ? ORDER BY id LIMIT ?',
+                (*values, now, limit),
+            ).fetchall()
+            if rows:
+                conn.executemany('DELETE FROM channel_messages WHERE id = ?', [(row[0],) for row in rows])
+            return [(channel, payload) for _, channel, payload in rows]
+        return self._transaction(work)
+
+    def _cleanup(self):
+        def work(conn):
+            now = time.time()
+            conn.execute('DELETE FROM channel_messages WHERE expires <= ?', (now,))
+            conn.execute('DELETE FROM channel_groups WHERE expires <= ?', (now,))
+        self._transaction(work)
+
+    def _execute(self, sql, params=()):
+        self._transaction(lambda conn: conn.execute(sql, params))
+
+    # Channel layer API
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_channel_name(channel)
+        assert '__asgi_channel__' not in message
+        await asyncio.to_thread(self._insert, channel, msgpack.packb(message, use_bin_type=True))
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+        if '!' in channel:
+            queue = self._queues.get(channel)
+            if queue is None:
+                raise ValueError(f'{channel} is not a channel of this layer or was closed')
+            self._ensure_poller()
+            try:
+                return await queue.get()
+            except asyncio.CancelledError:
+                # a consumer that goes away cancels its receive, the channel is not read again
+                self._forget(channel)
+                raise
+
+        delay = self.poll_interval
+        while True:
+            rows = await asyncio.to_thread(self._pop, 'channel', [channel], 1)
+            if rows:
+                return msgpack.unpackb(rows[0][1], raw=False)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_poll_interval)
+
+    async def new_channel(self, prefix='specific'):
+        channel = '%s.%s!%s' % (
+            prefix,
+            self.client_prefix,
+            ''.join(random.choice(string.ascii_letters) for _ in range(12)),
+        )
+        # messages for the channel are collected from now on, also before the first receive
+        self._inboxes.add(self.non_local_name(channel))
+        self._queues[channel] = asyncio.Queue()
+        return channel
+
+    def _forget(self, channel):
+        self._queues.pop(channel, None)
+        # drop what is still stored for the channel and its memberships, other processes would
+        # keep sending group messages to it until the group expiry
+        asyncio.get_running_loop().run_in_executor(None, self._delete_channel, channel)
+
+    def _delete_channel(self, channel):
+        def work(conn):
+            conn.execute('DELETE FROM channel_messages WHERE channel = ?', (channel,))
+            conn.execute('DELETE FROM channel_groups WHERE channel = ?', (channel,))
+        self._transaction(work)
+
+    def _ensure_poller(self):
+        loop = asyncio.get_running_loop()
+        if self._poller is None or self._poller.done() or self._poller.get_loop() is not loop:
+            self._poller = loop.create_task(self._poll())
+
+    async def _poll(self):
+        delay = self.poll_interval
+        while self._queues:
+            rows = await asyncio.to_thread(self._pop, 'inbox', sorted(self._inboxes), self.batch_size)
+            for channel, payload in rows:
+                queue = self._queues.get(channel)
+                # nobody reads a closed channel any more
+                if queue is not None:
+                    queue.put_nowait(msgpack.unpackb(payload, raw=False))
+            if time.time() - self._last_cleanup > self.expiry:
+                self._last_cleanup = time.time()
+                await asyncio.to_thread(self._cleanup)
+            if rows:
+                delay = self.poll_interval
+                await asyncio.sleep(0)
+            else:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_poll_interval)
+
+    async def flush(self):
+        await asyncio.to_thread(self._execute, 'DELETE FROM channel_messages')
+        await asyncio.to_thread(self._execute, 'DELETE FROM channel_groups')
+        # receivers keep waiting on their queues, only what is buffered goes
+        for queue in self._queues.values():
+            while not queue.empty():
+                queue.get_nowait()
+
+    async def close(self):
+        if self._poller is not None:
+            self._poller.cancel()
+            self._poller = None
+
+    # Groups extension
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        await asyncio.to_thread(
+            self._execute,
+            'INSERT OR REPLACE INTO channel_groups (grp, channel, expires) VALUES (?, ?, ?)',
+            (group, channel, time.time() + self.group_expiry),
+        )
+
+    async def group_discard(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        await asyncio.to_thread(
+            self._execute, 'DELETE FROM channel_groups WHERE grp = ? AND channel = ?', (group, channel)
+        )
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_group_name(group)
+        await asyncio.to_thread(self._insert_group, group, msgpack.packb(message, use_bin_type=True))
@@ -0,0 +1,98 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.layers import SQLiteChannelLayer
+
+
+GROUP = 'fanout'
+
+
+def _receiver(path, messages, ready, results, timeout):
+    async def run():
+        layer = SQLiteChannelLayer(path=path)
+        channel = await layer.new_channel()
+        await layer.group_add(GROUP, channel)
+        ready.put(os.getpid())
+        latencies = []
+        try:
+            while len(latencies) < messages:
+                message = await asyncio.wait_for(layer.receive(channel), timeout)
+                latencies.append(time.time() - message['sent'])
+        except asyncio.TimeoutError:
+            pass
+        await layer.close()
+        results.put(latencies)
+
+    asyncio.run(run())
+
+
+class Command(BaseCommand):
+    help = 'Fan group messages out to several processes through the SQLite channel layer and report delivery'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=4)
+        parser.add_argument('--messages', type=int, default=200)
+        parser.add_argument('--timeout', type=float, default=10.0)
+        parser.add_argument('--path', help='Layer database file, a temporary one is used by default')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+
+    def handle(self, *args, **options):
+        processes, messages, timeout = options['processes'], options['messages'], options['timeout']
+        with tempfile.TemporaryDirectory() as tmp:
+            path = options['path'] or os.path.join(tmp, 'channels.sqlite3')
+            report = self.run(path, processes, messages, timeout)
+
+        if options['json']:
+            self.stdout.write(json.dumps(report))
+        else:
+            for key, value in report.items():
+                self.stdout.write(f'{key}: {value}')
+        if report['delivered'] != report['expected']:
+            raise CommandError(f"Lost {report['expected'] - report['delivered']} messages")
+
+    def run(self, path, processes, messages, timeout):
+        context = multiprocessing.get_context('spawn')
+        ready, results = context.Queue(), context.Queue()
+        workers = [
+            context.Process(target=_receiver, args=(path, messages, ready, results, timeout))
+            for _ in range(processes)
+        ]
+        for worker in workers:
+            worker.start()
+        for _ in workers:
+            ready.get(timeout=30)
+
+        layer = SQLiteChannelLayer(path=path, capacity=messages)
+        started = time.time()
+
+        async def send_all():
+            for index in range(messages):
+                await layer.group_send(GROUP, {'type': 'fanout.message', 'index': index, 'sent': time.time()})
+
+        asyncio.run(send_all())
+        send_time = time.time() - started
+
+        latencies = []
+        for _ in workers:
+            latencies.extend(results.get(timeout=timeout + 30))
+        elapsed = time.time() - started
+        for worker in workers:
+            worker.join()
+
+        latencies.sort()
+        return {
+            'processes': processes,
+            'expected': processes * messages,
+            'delivered': len(latencies),
+            'send_per_second': round(messages / send_time, 1),
+            'delivered_per_second': round(len(latencies) / elapsed, 1),
+            'p50_ms': round(statistics.median(latencies) * 1000, 2) if latencies else None,
+            'p99_ms': round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2) if latencies else None,
+        }
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:11
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_conversations(apps, schema_editor):
+    PrivateMessage = apps.get_model('chat', 'PrivateMessage')
+    Conversation = apps.get_model('chat', 'Conversation')
+    conversations = {}
+    for message in PrivateMessage.objects.order_by('created', 'id').iterator():
+        pair = tuple(sorted((message.sender_id, message.recipient_id)))
+        conversation = conversations.setdefault(pair, Conversation(user_a_id=pair[0], user_b_id=pair[1]))
+        conversation.last_message_id = message.id
+        conversation.last_message_body = message.body
+        conversation.last_message_at = message.created
+        if not message.read:
+            if message.recipient_id == pair[0]:
+                conversation.unread_a += 1
+            else:
+                conversation.unread_b += 1
+    Conversation.objects.bulk_create(conversations.values())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_message_body', models.TextField(blank=True, default='')),
+                ('last_message_at', models.DateTimeField()),
+                ('unread_a', models.PositiveIntegerField(default=0)),
+                ('unread_b', models.PositiveIntegerField(default=0)),
+                ('last_message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chat.privatemessage')),
+                ('user_a', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user_b', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-last_message_at'],
+                'indexes': [models.Index(fields=['user_a', '-last_message_at'], name='conversation_a_recent_idx'), models.Index(fields=['user_b', '-last_message_at'], name='conversation_b_recent_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user_a', 'user_b'), name='unique_conversation_pair')],
+            },
+        ),
+        migrations.RunPython(backfill_conversations, migrations.RunPython.noop),
+    ]
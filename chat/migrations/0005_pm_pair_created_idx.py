@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:12
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_conversation'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='privatemessage',
+            index=models.Index(fields=['sender', 'recipient', 'created'], name='pm_pair_created_idx'),
+        ),
+    ]
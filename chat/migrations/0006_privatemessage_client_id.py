@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_pm_pair_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='privatemessage',
+            name='client_id',
+            field=models.UUIDField(blank=True, editable=False, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:32
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_privatemessage_client_id'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='privatemessage',
+            index=models.Index(condition=models.Q(('read', False)), fields=['recipient', 'sender'], name='pm_unread_idx'),
+        ),
+    ]
@@ -8,9 +8,46 @@ class PrivateMessage(models.Model):
     body = models.TextField()
     read = models.BooleanField(default=False)
     created = models.DateTimeField(auto_now_add=True)
+    client_id = models.UUIDField(null=True, blank=True, unique=True, editable=False)
 
     class Meta:
         ordering = ['created']
+        indexes = [
+            models.Index(fields=['sender', 'recipient', 'created'], name='pm_pair_created_idx'),
+            models.Index(
+                fields=['recipient', 'sender'], condition=models.Q(read=False), name='pm_unread_idx',
+            ),
+        ]
 
     def __str__(self):
         return f"{self.sender} -> {self.recipient}: {self.body[:40]}"
+
+
+class Conversation(models.Model):
+    # user_a always holds the lower user id so every pair has exactly one row
+    user_a = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, related_name='+')
+    user_b = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, related_name='+')
+    last_message = models.ForeignKey(PrivateMessage, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    last_message_body = models.TextField(blank=True, default='')
+    last_message_at = models.DateTimeField()
+    unread_a = models.PositiveIntegerField(default=0)
+    unread_b = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-last_message_at']
+        constraints = [
+            models.UniqueConstraint(fields=['user_a', 'user_b'], name='unique_conversation_pair'),
+        ]
+        indexes = [
+            models.Index(fields=['user_a', '-last_message_at'], name='conversation_a_recent_idx'),
+            models.Index(fields=['user_b', '-last_message_at'], name='conversation_b_recent_idx'),
+        ]
+
+    def other_user(self, user):
+        return self.user_b if user.id == self.user_a_id else self.user_a
+
+    def unread_for(self, user):
+        return self.unread_a if user.id == self.user_a_id else self.unread_b
+
+    def __str__(self):
+        return f"{self.user_a} <-> {self.user_b}"
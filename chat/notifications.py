@@ -0,0 +1,72 @@
+import asyncio
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from .presence import conversation_context, presence
+
+
+PREVIEW_LENGTH = 80
+
+
+class NotificationAggregator:
+    # Collects message notifications per recipient and delivers one summary per window. A recipient
+    # gets at most one summary every min_interval seconds, anything arriving meanwhile is merged in.
+
+    def __init__(self, window=0.5, min_interval=2.0):
+        self.window = window
+        self.min_interval = min_interval
+        self._pending = {}
+        self._timers = {}
+        self._last_sent = {}
+
+    def add(self, recipient_id, sender_id, sender, body):
+        senders = self._pending.setdefault(recipient_id, {})
+        # re-inserting keeps the most recent sender last
+        entry = senders.pop(sender_id, {'sender': sender, 'count': 0})
+        entry['count'] += 1
+        entry['preview'] = body[:PREVIEW_LENGTH]
+        senders[sender_id] = entry
+
+        if recipient_id not in self._timers:
+            loop = asyncio.get_running_loop()
+            ready_at = self._last_sent.get(recipient_id, 0) + self.min_interval
+            delay = max(self.window, ready_at - loop.time())
+            self._timers[recipient_id] = loop.call_later(
+                delay, lambda: loop.create_task(self.flush(recipient_id))
+            )
+
+    async def flush(self, recipient_id):
+        self._timers.pop(recipient_id, None)
+        senders = self._pending.pop(recipient_id, {})
+        if not senders or not await presence.ais_online(recipient_id):
+            return
+        # whoever is looking at the conversation already saw the messages
+        summary = [
+            entry for sender_id, entry in senders.items()
+            if not await presence.ais_online(recipient_id, conversation_context(sender_id))
+        ]
+        if not summary:
+            return
+
+        now = asyncio.get_running_loop().time()
+        self._last_sent[recipient_id] = now
+        if len(self._last_sent) > 10000:
+            self._last_sent = {
+                user_id: sent for user_id, sent in self._last_sent.items() if now - sent < self.min_interval
+            }
+
+        latest = summary[-1]
+        await get_channel_layer().group_send(f'user_{recipient_id}', {
+            'type': 'send_notification',
+            'message': latest['preview'],
+            'sender': latest['sender'],
+            'count': sum(entry['count'] for entry in summary),
+            'senders': summary,
+        })
+
+
+notifications = NotificationAggregator(
+    window=getattr(settings, 'CHAT_NOTIFICATION_WINDOW', 0.5),
+    min_interval=getattr(settings, 'CHAT_NOTIFICATION_MIN_INTERVAL', 2.0),
+)
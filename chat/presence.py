@@ -0,0 +1,242 @@
+import asyncio
+import logging
+import threading
+import time
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .layers import SQLiteFile
+
+
+logger = logging.getLogger(__name__)
+
+LOOKUP_CHUNK = 500
+
+
+def presence_group(user_id):
+    return f'presence_{user_id}'
+
+
+def conversation_context(other_id):
+    # context of a private chat socket, lets the notifications skip conversations that are open
+    return f'pm:{other_id}'
+
+
+class LocalPresenceStore:
+    # Connections of this process only, every lookup is a dict access
+
+    blocking = False
+
+    def __init__(self):
+        # user id -> {channel name: (context, expires)}
+        self._connections = {}
+        self._lock = threading.Lock()
+
+    def add(self, user_id, channel, context, expires):
+        with self._lock:
+            connections = self._connections.setdefault(user_id, {})
+            first = not self._live(connections, time.time())
+            connections[channel] = (context, expires)
+        return first
+
+    def remove(self, user_id, channel):
+        with self._lock:
+            connections = self._connections.get(user_id, {})
+            connections.pop(channel, None)
+            if not connections:
+                self._connections.pop(user_id, None)
+            return not self._live(connections, time.time())
+
+    def refresh(self, channels, expires):
+        with self._lock:
+            for channel, user_id in channels.items():
+                connections = self._connections.get(user_id, {})
+                if channel in connections:
+                    connections[channel] = (connections[channel][0], expires)
+
+    def expire(self, now):
+        offline = []
+        with self._lock:
+            for user_id, connections in list(self._connections.items()):
+                for channel, (_, expires) in list(connections.items()):
+                    if expires <= now:
+                        del connections[channel]
+                if not connections:
+                    del self._connections[user_id]
+                    offline.append(user_id)
+        return offline
+
+    def online(self, user_ids, context=None):
+        now = time.time()
+        with self._lock:
+            return {
+                user_id for user_id in user_ids
+                if self._live(self._connections.get(user_id, {}), now, context)
+            }
+
+    @staticmethod
+    def _live(connections, now, context=None):
+        return any(
+            expires > now and (context is None or context == connection_context)
+            for connection_context, expires in connections.values()
+        )
+
+
+class SQLitePresenceStore(SQLiteFile):
+    # Shared by every worker process on the host, usually kept in the channel layer's file
+
+    blocking = True
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS presence (
+            user_id INTEGER NOT NULL,
+            channel TEXT NOT NULL,
+            context TEXT NOT NULL,
+            expires REAL NOT NULL,
+            PRIMARY KEY (user_id, channel)
+        )""",
+        "CREATE INDEX IF NOT EXISTS presence_expires ON presence (expires)",
+    ]
+
+    def __init__(self, path='channels.sqlite3'):
+        super().__init__(path)
+
+    def _is_live(self, conn, user_id, now):
+        return conn.execute(
+            'SELECT 1 FROM presence WHERE user_id = ? AND expires > ? LIMIT 1', (user_id, now)
+        ).fetchone() is not None
+
+    def add(self, user_id, channel, context, expires):
+        def work(conn):
+            first = not self._is_live(conn, user_id, time.time())
+            conn.execute(
+                'INSERT OR REPLACE INTO presence (user_id, channel, context, expires) VALUES (?, ?, ?, ?)',
+                (user_id, channel, context, expires),
+            )
+            return first
+        return self._transaction(work)
+
+    def remove(self, user_id, channel):
+        def work(conn):
+            conn.execute('DELETE FROM presence WHERE user_id = ? AND channel = ?', (user_id, channel))
+            return not self._is_live(conn, user_id, time.time())
+        return self._transaction(work)
+
+    def refresh(self, channels, expires):
+        self._transaction(lambda conn: conn.executemany(
+            'UPDATE presence SET expires = ? WHERE user_id = ? AND channel = ?',
+            [(expires, user_id, channel) for channel, user_id in channels.items()],
+        ))
+
+    def expire(self, now):
+        # every process sweeps, the write lock makes sure only one of them reports a user
+        def work(conn):
+            users = [row[0] for row in conn.execute(
+                'SELECT DISTINCT user_id FROM presence WHERE expires <= ?', (now,)
+            )]
+            conn.execute('DELETE FROM presence WHERE expires <= ?', (now,))
+            return [user_id for user_id in users if not self._is_live(conn, user_id, now)]
+        return self._transaction(work)
+
+    def online(self, user_ids, context=None):
+        conn = self._connection()
+        now = time.time()
+        user_ids = list(user_ids)
+        found = set()
+        for start in range(0, len(user_ids), LOOKUP_CHUNK):
+            chunk = user_ids[start:start + LOOKUP_CHUNK]
+            sql = (
+                f"SELECT DISTINCT user_id FROM presence "
+                f"WHERE user_id IN ({','.join('?' * len(chunk))}) AND expires > ?"
+            )
+            params = [*chunk, now]
+            if context is not None:
+                sql += ' AND context = ?'
+                params.append(context)
+            found.update(row[0] for row in conn.execute(sql, params))
+        return found
+
+
+class Presence:
+    # Counts the open sockets of each user. Sockets register in connect/disconnect and a heartbeat task
+    # per process keeps its entries alive, so the sockets of a crashed process time out on their own.
+    # A change between online and offline is sent to the presence_<user id> group. The heartbeat also
+    # sweeps expired entries, and keeps doing so once this process has no sockets left: the entries
+    # of other, crashed processes still have to go offline.
+
+    def __init__(self, store, heartbeat=30, timeout=90):
+        self.store = store
+        self.heartbeat = heartbeat
+        self.timeout = timeout
+        # channel name -> user id of the sockets open in this process
+        self._local = {}
+        self._task = None
+
+    async def _run(self, func, *args):
+        if self.store.blocking:
+            return await asyncio.to_thread(func, *args)
+        return func(*args)
+
+    async def connect(self, user_id, channel_name, context=''):
+        self._local[channel_name] = user_id
+        self._ensure_heartbeat()
+        if await self._run(self.store.add, user_id, channel_name, context, time.time() + self.timeout):
+            await self.announce(user_id, True)
+
+    async def disconnect(self, user_id, channel_name):
+        self._local.pop(channel_name, None)
+        if await self._run(self.store.remove, user_id, channel_name):
+            await self.announce(user_id, False)
+
+    def is_online(self, user_id, context=None):
+        return bool(self.store.online([user_id], context))
+
+    def online_users(self, user_ids, context=None):
+        return self.store.online(user_ids, context)
+
+    async def ais_online(self, user_id, context=None):
+        self._ensure_heartbeat()
+        return bool(await self._run(self.store.online, [user_id], context))
+
+    async def aonline_users(self, user_ids, context=None):
+        self._ensure_heartbeat()
+        return await self._run(self.store.online, list(user_ids), context)
+
+    async def announce(self, user_id, online):
+        await get_channel_layer().group_send(presence_group(user_id), {
+            'type': 'presence_changed',
+            'user_id': user_id,
+            'online': online,
+        })
+
+    def _ensure_heartbeat(self):
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._task = loop.create_task(self._beat())
+
+    async def _beat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            now = time.time()
+            try:
+                if self._local:
+                    await self._run(self.store.refresh, dict(self._local), now + self.timeout)
+                for user_id in await self._run(self.store.expire, now):
+                    await self.announce(user_id, False)
+            except Exception:
+                # a busy store or layer must not end the heartbeat, the next beat tries again
+                logger.exception('Presence heartbeat failed')
+
+
+def _make_store():
+    config = getattr(settings, 'CHAT_PRESENCE_STORE', {})
+    backend = import_string(config.get('BACKEND', 'chat.presence.LocalPresenceStore'))
+    return backend(**config.get('OPTIONS', {}))
+
+
+presence = Presence(
+    _make_store(),
+    heartbeat=getattr(settings, 'CHAT_PRESENCE_HEARTBEAT', 30),
+    timeout=getattr(settings, 'CHAT_PRESENCE_TIMEOUT', 90),
+)
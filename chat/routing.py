@@ -3,7 +3,7 @@ from django.urls import re_path
 from . import consumers
 
 websocket_urlpatterns = [
-    # re_path(r'ws/chat/(?P<room_name>\w+)/$', consumers.ChatConsumer.as_asgi()),
+    re_path(r'ws/post/(?P<post_id>\d+)/$', consumers.PostThreadConsumer.as_asgi()),
     re_path(r'ws/pm/(?P<username>\w+)/$', consumers.PrivateChatConsumer.as_asgi()),
     re_path(r'ws/notifications/$', consumers.NotificationConsumer.as_asgi()),
 ]
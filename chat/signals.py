@@ -0,0 +1,27 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import PrivateMessage
+from .conversations import record_message, unrecord_message
+from .users import user_id_cache
+
+
+@receiver(post_save, sender=PrivateMessage)
+def update_conversation(sender, instance, created, **kwargs):
+    if created:
+        record_message(instance)
+
+
+@receiver(post_delete, sender=PrivateMessage)
+def release_unread(sender, instance, origin=None, **kwargs):
+    # the counter of a recipient that is being deleted goes with the recipient
+    if isinstance(origin, get_user_model()) and origin.pk == instance.recipient_id:
+        return
+    unrecord_message(instance)
+
+
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+def invalidate_user_id(sender, instance, **kwargs):
+    user_id_cache.invalidate(instance.id, instance.username)
@@ -1,3 +1,702 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from functools import partial
+from unittest.mock import patch
 
-# Create your tests here.
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db import OperationalError, connections, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.urls import reverse
+
+from blogApp.models import Message, Post, User
+from blogApp.thread import add_comment
+from blogApp.writes import WriteQueue
+from .conversations import get_inbox_page, mark_read
+from .history import get_history
+from .layers import SQLiteChannelLayer
+from .management.commands.channel_layer_fanout import Command as FanoutCommand
+from .models import Conversation, PrivateMessage
+from .notifications import NotificationAggregator
+from .presence import (
+    LocalPresenceStore, Presence, SQLitePresenceStore, conversation_context, presence, presence_group,
+)
+from .routing import websocket_urlpatterns
+from .users import UserIdCache, resolve_user_id, user_id_cache
+from .unread import add_unread
+from .wire import CODECS, WireMixin
+from .writebehind import MAX_RETRIES, MessageBuffer, write_batch
+
+
+def make_users(*names):
+    return [User.objects.create_user(username=name, email=f'{name}@example.com', password='pw') for name in names]
+
+
+class WriteBatchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice, cls.bob = make_users('alice', 'bob')
+
+    def message(self, body, client_id=None):
+        return PrivateMessage(sender=self.alice, recipient=self.bob, body=body, client_id=client_id or uuid.uuid4())
+
+    def test_resent_messages_are_stored_once(self):
+        first = self.message('hi')
+        resent = self.message('hi', first.client_id)
+        self.assertEqual(write_batch([first, resent]), [first])
+        # the whole batch again, e.g. after a flush that timed out
+        self.assertEqual(write_batch([self.message('hi', first.client_id)]), [])
+        self.assertEqual(PrivateMessage.objects.filter(client_id=first.client_id).count(), 1)
+
+
+class PoisonBatchTests(TransactionTestCase):
+    # foreign keys are only checked on commit, so this needs real transactions
+
+    def test_bad_row_does_not_drop_the_batch(self):
+        alice, bob = make_users('alice', 'bob')
+        good = [PrivateMessage(sender=alice, recipient=bob, body=f'm{i}', client_id=uuid.uuid4()) for i in range(3)]
+        # the recipient was deleted while the message sat in the buffer
+        orphan = PrivateMessage(sender_id=alice.id, recipient_id=bob.id + 1000, body='lost', client_id=uuid.uuid4())
+        with self.assertLogs('chat.writebehind', 'ERROR'):
+            stored = write_batch([good[0], orphan, *good[1:]])
+        self.assertEqual(stored, good)
+        self.assertEqual(sorted(PrivateMessage.objects.values_list('body', flat=True)), ['m0', 'm1', 'm2'])
+        # each stored message counts as unread once
+        bob.refresh_from_db()
+        self.assertEqual(bob.unread_private_messages, 3)
+        self.assertEqual(Conversation.objects.get().unread_for(bob), 3)
+
+
+class MessageBufferTests(TestCase):
+    def setUp(self):
+        self.buffer = MessageBuffer(batch_size=100, interval=60)
+        self.messages = [PrivateMessage(body=f'm{i}', client_id=uuid.uuid4()) for i in range(3)]
+        self.buffer._pending = list(self.messages)
+
+    def tearDown(self):
+        # drops the retry timer
+        self.buffer._take()
+
+    async def test_busy_database_requeues_until_the_retry_limit(self):
+        busy = OperationalError('database is locked')
+        with patch('chat.writebehind.write_queue.acall', side_effect=busy):
+            for _ in range(MAX_RETRIES):
+                with self.assertLogs('chat.writebehind', 'WARNING'):
+                    await self.buffer.flush()
+                self.assertEqual(self.buffer._pending, self.messages)
+            with self.assertLogs('chat.writebehind', 'ERROR'):
+                await self.buffer.flush()
+        self.assertEqual(len(self.buffer), 0)
+
+    async def test_permanent_error_is_not_retried(self):
+        with patch('chat.writebehind.write_queue.acall', side_effect=ValueError('bad batch')):
+            with self.assertLogs('chat.writebehind', 'ERROR'):
+                await self.buffer.flush()
+        self.assertEqual(len(self.buffer), 0)
+
+    def test_flush_sync_writes_the_batch_in_flight(self):
+        with patch('chat.writebehind.write_batch') as write:
+            self.buffer._inflight = self.messages[:1]
+            self.buffer._pending = self.messages[1:]
+            self.buffer.flush_sync()
+        write.assert_called_once_with(self.messages)
+
+
+class SQLiteChannelLayerTests(SimpleTestCase):
+    # Two layers on one file stand in for two worker processes, each with its own channels
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, 'channels.sqlite3')
+
+    @contextlib.asynccontextmanager
+    async def layers(self, **kwargs):
+        layers = [SQLiteChannelLayer(path=self.path, **kwargs) for _ in range(2)]
+        try:
+            yield layers
+        finally:
+            for layer in layers:
+                await layer.close()
+
+    def stored(self, table, channel):
+        with sqlite3.connect(self.path) as conn:
+            return conn.execute(f'SELECT COUNT(*) FROM {table} WHERE channel = ?', (channel,)).fetchone()[0]
+
+    async def test_send_to_another_process(self):
+        async with self.layers() as (sender, receiver):
+            channel = await receiver.new_channel()
+            await sender.send(channel, {'type': 'chat.message', 'body': 'hi'})
+            message = await asyncio.wait_for(receiver.receive(channel), 2)
+        self.assertEqual(message, {'type': 'chat.message', 'body': 'hi'})
+
+    async def test_group_send_to_another_process(self):
+        async with self.layers() as (sender, receiver):
+            channel = await receiver.new_channel()
+            await receiver.group_add('room', channel)
+            await sender.group_send('room', {'type': 'chat.message', 'n': 1})
+            self.assertEqual(await asyncio.wait_for(receiver.receive(channel), 2), {'type': 'chat.message', 'n': 1})
+
+            await receiver.group_discard('room', channel)
+            await sender.group_send('room', {'type': 'chat.message', 'n': 2})
+            await sender.send(channel, {'type': 'chat.message', 'n': 3})
+            self.assertEqual(await asyncio.wait_for(receiver.receive(channel), 2), {'type': 'chat.message', 'n': 3})
+
+    async def test_expired_messages_are_not_delivered(self):
+        async with self.layers(expiry=0.05) as (sender, receiver):
+            channel = await receiver.new_channel()
+            await sender.send(channel, {'type': 'chat.message', 'body': 'late'})
+            await asyncio.sleep(0.1)
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(receiver.receive(channel), 0.3)
+
+    async def test_closed_channel_is_dropped(self):
+        async with self.layers() as (sender, receiver):
+            channel = await receiver.new_channel()
+            await receiver.group_add('room', channel)
+            waiting = asyncio.create_task(receiver.receive(channel))
+            await asyncio.sleep(0.05)
+            # what the consumer does when its socket closes
+            waiting.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiting
+            self.assertNotIn(channel, receiver._queues)
+
+            await asyncio.sleep(0.1)
+            self.assertEqual(self.stored('channel_groups', channel), 0)
+            await sender.group_send('room', {'type': 'chat.message'})
+            await sender.send(channel, {'type': 'chat.message'})
+            live = await receiver.new_channel()
+            await sender.send(live, {'type': 'chat.message'})
+            await asyncio.wait_for(receiver.receive(live), 2)
+            self.assertNotIn(channel, receiver._queues)
+            with self.assertRaises(ValueError):
+                await receiver.receive(channel)
+
+    def test_group_send_reaches_other_processes(self):
+        report = FanoutCommand().run(self.path, processes=2, messages=20, timeout=5)
+        self.assertEqual(report['delivered'], report['expected'])
+
+
+def communicator_for(path, user, subprotocols=None):
+    communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), path, subprotocols=subprotocols)
+    communicator.scope['user'] = user
+    return communicator
+
+
+class NotificationAggregatorTests(SimpleTestCase):
+    RECIPIENT = 9001
+
+    async def open_socket(self):
+        self.notifications = NotificationAggregator(window=0.05, min_interval=0.3)
+        self.socket = communicator_for('/ws/notifications/', User(id=self.RECIPIENT, username='carol'))
+        connected, _ = await self.socket.connect()
+        self.assertTrue(connected)
+
+    async def test_burst_is_one_summary(self):
+        await self.open_socket()
+        self.notifications.add(self.RECIPIENT, 1, 'alice', 'hi')
+        self.notifications.add(self.RECIPIENT, 2, 'bob', 'yo')
+        self.notifications.add(self.RECIPIENT, 1, 'alice', 'again')
+
+        summary = await self.socket.receive_json_from(1)
+        self.assertEqual(summary['type'], 'notification')
+        self.assertEqual((summary['sender'], summary['message'], summary['count']), ('alice', 'again', 3))
+        self.assertEqual([(entry['sender'], entry['count']) for entry in summary['senders']], [('bob', 1), ('alice', 2)])
+        self.assertTrue(await self.socket.receive_nothing(0.1))
+        await self.socket.disconnect()
+
+    async def test_summaries_keep_the_minimum_interval(self):
+        await self.open_socket()
+        loop = asyncio.get_running_loop()
+        self.notifications.add(self.RECIPIENT, 1, 'alice', 'one')
+        await self.socket.receive_json_from(1)
+        first_sent = loop.time()
+
+        self.notifications.add(self.RECIPIENT, 1, 'alice', 'two')
+        self.notifications.add(self.RECIPIENT, 2, 'bob', 'three')
+        # past the window, still inside the minimum interval
+        self.assertTrue(await self.socket.receive_nothing(0.15))
+        summary = await self.socket.receive_json_from(1)
+        self.assertGreaterEqual(loop.time() - first_sent, 0.25)
+        self.assertEqual((summary['sender'], summary['count']), ('bob', 2))
+        await self.socket.disconnect()
+
+    async def test_open_conversation_is_left_out(self):
+        await self.open_socket()
+        # carol has the chat with alice open
+        await presence.connect(self.RECIPIENT, 'pm-socket', conversation_context(1))
+        try:
+            self.notifications.add(self.RECIPIENT, 1, 'alice', 'seen')
+            self.assertTrue(await self.socket.receive_nothing(0.15))
+            self.notifications.add(self.RECIPIENT, 1, 'alice', 'seen too')
+            self.notifications.add(self.RECIPIENT, 2, 'bob', 'unseen')
+            summary = await self.socket.receive_json_from(1)
+            self.assertEqual([entry['sender'] for entry in summary['senders']], ['bob'])
+        finally:
+            await presence.disconnect(self.RECIPIENT, 'pm-socket')
+            await self.socket.disconnect()
+
+
+class PresenceTests(SimpleTestCase):
+    USER = 9002
+
+    async def listen(self):
+        self.layer = get_channel_layer()
+        self.channel = await self.layer.new_channel()
+        await self.layer.group_add(presence_group(self.USER), self.channel)
+
+    async def next_change(self, timeout=1):
+        event = await asyncio.wait_for(self.layer.receive(self.channel), timeout)
+        return event['user_id'], event['online']
+
+    async def test_online_until_the_last_socket_closes(self):
+        await self.listen()
+        tracker = Presence(LocalPresenceStore(), heartbeat=60, timeout=60)
+        await tracker.connect(self.USER, 'notifications', '')
+        self.assertEqual(await self.next_change(), (self.USER, True))
+        await tracker.connect(self.USER, 'chat', conversation_context(2))
+        self.assertTrue(await tracker.ais_online(self.USER, conversation_context(2)))
+        self.assertFalse(await tracker.ais_online(self.USER, conversation_context(3)))
+
+        await tracker.disconnect(self.USER, 'notifications')
+        with self.assertRaises(asyncio.TimeoutError):
+            await self.next_change(0.1)
+        self.assertTrue(await tracker.ais_online(self.USER))
+        await tracker.disconnect(self.USER, 'chat')
+        self.assertEqual(await self.next_change(), (self.USER, False))
+
+    async def test_heartbeat_keeps_open_sockets_alive(self):
+        tracker = Presence(LocalPresenceStore(), heartbeat=0.05, timeout=0.15)
+        await tracker.connect(self.USER, 'notifications', '')
+        await asyncio.sleep(0.4)
+        self.assertTrue(await tracker.ais_online(self.USER))
+        await tracker.disconnect(self.USER, 'notifications')
+
+    async def test_entries_of_a_dead_process_expire(self):
+        await self.listen()
+        store = LocalPresenceStore()
+        tracker = Presence(store, heartbeat=0.05, timeout=0.1)
+        # a socket of another process that died without disconnecting, none are open here
+        store.add(self.USER, 'gone', '', time.time() + 0.1)
+        self.assertTrue(await tracker.ais_online(self.USER))
+        self.assertEqual(await self.next_change(), (self.USER, False))
+        self.assertFalse(await tracker.ais_online(self.USER))
+
+    def test_sqlite_store_is_shared(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'channels.sqlite3')
+            first, second = SQLitePresenceStore(path), SQLitePresenceStore(path)
+            later = time.time() + 60
+            self.assertTrue(first.add(self.USER, 'a', '', later))
+            self.assertFalse(second.add(self.USER, 'b', conversation_context(2), later))
+            self.assertEqual(second.online([self.USER, 1]), {self.USER})
+            self.assertEqual(first.online([self.USER], conversation_context(2)), {self.USER})
+            self.assertFalse(first.remove(self.USER, 'a'))
+            self.assertTrue(second.remove(self.USER, 'b'))
+
+            now = time.time()
+            first.add(self.USER, 'c', '', now - 1)
+            # every process sweeps, only one of them reports the user
+            self.assertEqual(first.expire(now), [self.USER])
+            self.assertEqual(second.expire(now), [])
+
+
+@patch('blogApp.taskqueue.workers.wake')
+class PostThreadConsumerTests(TransactionTestCase):
+    # the thread is broadcast on commit, so the writes here have to really commit
+
+    def setUp(self):
+        self.alice, self.bob = make_users('alice', 'bob')
+        self.post = Post.objects.create(title='Threads', created_by=self.alice)
+        self.comment = Message.objects.create(user=self.alice, post=self.post, body='first')
+
+    async def open(self, user):
+        socket = communicator_for(f'/ws/post/{self.post.id}/', user)
+        connected, _ = await socket.connect()
+        self.assertTrue(connected)
+        return socket
+
+    async def test_anonymous_viewer_cannot_write(self, wake):
+        viewer = await self.open(AnonymousUser())
+        await viewer.send_json_to({'action': 'comment', 'body': 'hello'})
+        self.assertEqual(await viewer.receive_json_from(2), {'type': 'error', 'error': 'Log in to take part in the thread'})
+        await viewer.disconnect()
+        self.assertEqual(await Message.objects.filter(post=self.post).acount(), 1)
+
+    async def test_comments_of_others_cannot_be_changed(self, wake):
+        bob = await self.open(self.bob)
+        await bob.send_json_to({'action': 'edit', 'id': self.comment.id, 'body': 'mine now'})
+        self.assertEqual(await bob.receive_json_from(2), {'type': 'error', 'error': 'You are not allowed'})
+        await bob.send_json_to({'action': 'delete', 'id': self.comment.id})
+        self.assertEqual(await bob.receive_json_from(2), {'type': 'error', 'error': 'You are not allowed'})
+        await bob.disconnect()
+        self.assertEqual((await Message.objects.aget(id=self.comment.id)).body, 'first')
+
+    async def test_changes_reach_other_viewers(self, wake):
+        alice = await self.open(self.alice)
+        viewer = await self.open(AnonymousUser())
+
+        await alice.send_json_to({'action': 'comment', 'body': 'second'})
+        event = await viewer.receive_json_from(2)
+        self.assertEqual((event['type'], event['comment']['body']), ('comment', 'second'))
+        self.assertEqual(event['comment']['user']['username'], 'alice')
+
+        await alice.send_json_to({'action': 'edit', 'id': self.comment.id, 'body': 'edited'})
+        self.assertEqual(await viewer.receive_json_from(2), {'type': 'comment_edited', 'id': self.comment.id, 'body': 'edited'})
+        await alice.send_json_to({'action': 'delete', 'id': self.comment.id})
+        self.assertEqual(await viewer.receive_json_from(2), {'type': 'comment_deleted', 'id': self.comment.id})
+
+        await alice.send_json_to({'action': 'vote', 'value': 1})
+        self.assertEqual(await viewer.receive_json_from(2), {'type': 'votes', 'up': 1, 'down': 0})
+        await alice.disconnect()
+        await viewer.disconnect()
+
+    async def test_writer_thread_broadcast_reaches_viewers(self, wake):
+        viewer = await self.open(AnonymousUser())
+        writer = WriteQueue(enabled=True)
+        # committed and broadcast on the writer thread while this loop sits idle, the layer has to
+        # wake it up
+        written = writer.submit(add_comment, self.post.id, self.bob, 'from the writer')
+        event = await viewer.receive_json_from(2)
+        written.result(1)
+        self.assertEqual((event['type'], event['comment']['body']), ('comment', 'from the writer'))
+        self.assertTrue(await viewer.receive_nothing(0.1))
+        await viewer.disconnect()
+
+
+class WireProtocolTests(SimpleTestCase):
+    USER = 9003
+
+    async def notify_twice(self):
+        layer = get_channel_layer()
+        for count in (1, 2):
+            await layer.group_send(f'user_{self.USER}', {'type': 'send_notification', 'message': 'hi', 'count': count})
+
+    async def test_each_codec_batches_events(self):
+        for subprotocol in ('devden.json', 'devden.msgpack', 'devden.cbor'):
+            with self.subTest(subprotocol=subprotocol):
+                codec = CODECS[subprotocol]
+                socket = communicator_for('/ws/notifications/', User(id=self.USER), [subprotocol, 'unknown'])
+                connected, chosen = await socket.connect()
+                self.assertTrue(connected)
+                self.assertEqual(chosen, subprotocol)
+
+                await self.notify_twice()
+                output = await socket.receive_output(1)
+                frame = codec.load(output.get('text'), output.get('bytes'))
+                self.assertIsInstance(frame, list)
+                self.assertEqual([(event['type'], event['count']) for event in frame], [('notification', 1), ('notification', 2)])
+
+                # clients of a subprotocol may send a batch too
+                await socket.send_to(**codec.frame([{'action': 'watch_presence', 'users': [1]}]))
+                output = await socket.receive_output(1)
+                frame = codec.load(output.get('text'), output.get('bytes'))
+                self.assertEqual([event['type'] for event in frame], ['presence'])
+                await socket.disconnect()
+
+    async def test_plain_json_without_subprotocol(self):
+        socket = communicator_for('/ws/notifications/', User(id=self.USER))
+        connected, chosen = await socket.connect()
+        self.assertTrue(connected)
+        self.assertIsNone(chosen)
+        await self.notify_twice()
+        self.assertEqual((await socket.receive_json_from(1))['count'], 1)
+        self.assertEqual((await socket.receive_json_from(1))['count'], 2)
+        await socket.disconnect()
+
+
+class RecordingConsumer:
+    # stands in for AsyncWebsocketConsumer
+
+    async def send(self, text_data=None, bytes_data=None):
+        if self.fail:
+            raise RuntimeError('socket closed')
+        self.frames.append(text_data)
+
+    async def close(self, code=None, reason=None):
+        self.frames.append('close')
+
+
+class RecordingSocket(WireMixin, RecordingConsumer):
+    def __init__(self, fail=False):
+        self.codec = CODECS['devden.json']
+        self._outbox = []
+        self._flush_task = None
+        self.fail = fail
+        self.frames = []
+
+
+class WireMixinTests(SimpleTestCase):
+    async def test_close_sends_the_pending_batch_first(self):
+        socket = RecordingSocket()
+        socket.batch_window = 60
+        await socket.send_event({'n': 1})
+        await socket.send_event({'n': 2})
+        await socket.close()
+        self.assertEqual(socket.frames, ['[{"n": 1}, {"n": 2}]', 'close'])
+
+    async def test_failed_flush_is_logged(self):
+        socket = RecordingSocket(fail=True)
+        await socket.send_event({'n': 1})
+        with self.assertLogs('chat.wire', 'ERROR'):
+            await socket._flush_task
+        self.assertEqual(socket._outbox, [])
+
+
+class InboxTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice, cls.bob, cls.carol = make_users('alice', 'bob', 'carol')
+
+    def send(self, sender, recipient, body):
+        return PrivateMessage.objects.create(sender=sender, recipient=recipient, body=body)
+
+    def inbox(self, user, **kwargs):
+        rows, has_next = get_inbox_page(user, **kwargs)
+        return [(row['user'].username, row['last_message'], row['unread']) for row in rows], has_next
+
+    def test_latest_conversation_first(self):
+        self.send(self.bob, self.alice, 'hi alice')
+        self.send(self.carol, self.alice, 'hey')
+        self.send(self.alice, self.bob, 'hi bob')
+        self.assertEqual(Conversation.objects.count(), 2)
+        self.assertEqual(self.inbox(self.alice), ([('bob', 'hi bob', 1), ('carol', 'hey', 1)], False))
+        self.assertEqual(self.inbox(self.bob), ([('alice', 'hi bob', 1)], False))
+
+    def test_pages(self):
+        self.send(self.bob, self.alice, 'one')
+        self.send(self.carol, self.alice, 'two')
+        self.assertEqual(self.inbox(self.alice, page_size=1), ([('carol', 'two', 1)], True))
+        self.assertEqual(self.inbox(self.alice, page=2, page_size=1), ([('bob', 'one', 1)], False))
+
+    def test_mark_read(self):
+        self.send(self.bob, self.alice, 'one')
+        self.send(self.bob, self.alice, 'two')
+        self.send(self.carol, self.alice, 'three')
+        mark_read(self.alice, self.bob)
+        self.assertEqual(self.inbox(self.alice)[0], [('carol', 'three', 1), ('bob', 'two', 0)])
+        # the sender's side is untouched
+        self.assertEqual(self.inbox(self.bob)[0], [('alice', 'two', 0)])
+
+    def test_deleting_messages(self):
+        first = self.send(self.bob, self.alice, 'one')
+        last = self.send(self.bob, self.alice, 'two')
+        last.delete()
+        self.assertEqual(self.inbox(self.alice)[0], [('bob', 'one', 1)])
+        self.assertEqual(Conversation.objects.get().last_message, first)
+        first.delete()
+        self.assertEqual(self.inbox(self.alice), ([], False))
+        self.assertFalse(Conversation.objects.exists())
+
+    def test_deleting_a_user_drops_their_conversations(self):
+        self.send(self.bob, self.alice, 'one')
+        self.send(self.carol, self.alice, 'two')
+        self.bob.delete()
+        self.assertEqual(self.inbox(self.alice)[0], [('carol', 'two', 1)])
+
+
+class HistoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice, cls.bob, cls.carol = make_users('alice', 'bob', 'carol')
+        cls.messages = [
+            PrivateMessage.objects.create(
+                sender=(cls.alice, cls.bob)[i % 2], recipient=(cls.bob, cls.alice)[i % 2], body=f'm{i}',
+            )
+            for i in range(5)
+        ]
+        PrivateMessage.objects.create(sender=cls.carol, recipient=cls.alice, body='elsewhere')
+
+    def bodies(self, page):
+        return [message.body for message in page]
+
+    def test_pages_back_from_the_latest(self):
+        page, has_more = get_history(self.alice.id, self.bob.id, limit=2)
+        self.assertEqual((self.bodies(page), has_more), (['m3', 'm4'], True))
+        page, has_more = get_history(self.bob.id, self.alice.id, before=page[0].id, limit=2)
+        self.assertEqual((self.bodies(page), has_more), (['m1', 'm2'], True))
+        page, has_more = get_history(self.alice.id, self.bob.id, before=page[0].id, limit=2)
+        self.assertEqual((self.bodies(page), has_more), (['m0'], False))
+
+    def test_same_timestamp_pages_by_id(self):
+        PrivateMessage.objects.filter(id__in=[m.id for m in self.messages]).update(created=self.messages[0].created)
+        page, _ = get_history(self.alice.id, self.bob.id, before=self.messages[3].id, limit=2)
+        self.assertEqual(self.bodies(page), ['m1', 'm2'])
+
+    def test_history_view(self):
+        self.client.force_login(self.alice)
+        url = reverse('private-history', args=['bob'])
+        data = self.client.get(url, {'before': self.messages[2].id}).json()
+        self.assertEqual(([m['message'] for m in data['messages']], data['has_more']), (['m0', 'm1'], False))
+        # anything but an id is the latest page
+        for before in ('', 'abc', '-1', '1.5'):
+            data = self.client.get(url, {'before': before}).json()
+            self.assertEqual(len(data['messages']), 5, before)
+
+
+class PrivateChatHistoryTests(TransactionTestCase):
+    # the consumer reads on its own database thread
+
+    def setUp(self):
+        self.alice, self.bob = make_users('alice', 'bob')
+        self.messages = [
+            PrivateMessage.objects.create(sender=self.bob, recipient=self.alice, body=f'm{i}') for i in range(3)
+        ]
+
+    async def history(self, socket, before):
+        await socket.send_json_to({'action': 'load_history', 'before': before})
+        event = await socket.receive_json_from(2)
+        self.assertEqual(event['type'], 'history')
+        return [message['message'] for message in event['messages']], event['has_more']
+
+    async def test_load_history(self):
+        socket = communicator_for('/ws/pm/bob/', self.alice)
+        connected, _ = await socket.connect()
+        self.assertTrue(connected)
+        self.assertEqual((await socket.receive_json_from(2))['type'], 'presence')
+        with patch('chat.consumers.get_history', partial(get_history, limit=2)):
+            self.assertEqual(await self.history(socket, None), (['m1', 'm2'], True))
+            self.assertEqual(await self.history(socket, self.messages[1].id), (['m0'], False))
+            for before in ('2', True, -1, 1.5):
+                self.assertEqual(await self.history(socket, before), (['m1', 'm2'], True))
+        await socket.disconnect()
+
+
+class UserIdCacheTests(TestCase):
+    def setUp(self):
+        user_id_cache.clear()
+        self.addCleanup(user_id_cache.clear)
+        [self.bob] = make_users('bob')
+
+    def test_rename_invalidates_the_old_name(self):
+        self.assertEqual(resolve_user_id('bob'), self.bob.id)
+        self.bob.username = 'robert'
+        self.bob.save()
+        self.assertIsNone(user_id_cache.get('bob'))
+        self.assertIsNone(resolve_user_id('bob'))
+        self.assertEqual(resolve_user_id('robert'), self.bob.id)
+        # someone else taking the old name resolves to them
+        new_bob = User.objects.create_user(username='bob', email='new-bob@example.com', password='pw')
+        self.assertEqual(resolve_user_id('bob'), new_bob.id)
+
+    def test_delete_invalidates_the_entry(self):
+        self.assertEqual(resolve_user_id('bob'), self.bob.id)
+        self.bob.delete()
+        self.assertIsNone(user_id_cache.get('bob'))
+        self.assertIsNone(resolve_user_id('bob'))
+
+    def test_bounded_and_expiring(self):
+        cache = UserIdCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        # b was the least recently used
+        self.assertEqual([cache.get(name) for name in 'abc'], [1, None, 3])
+        with patch('chat.users.time.monotonic', return_value=time.monotonic() + 61):
+            self.assertIsNone(cache.get('a'))
+
+
+class UnreadCounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice, cls.bob, cls.carol = make_users('alice', 'bob', 'carol')
+
+    def setUp(self):
+        for sender in (self.bob, self.bob, self.carol):
+            PrivateMessage.objects.create(sender=sender, recipient=self.alice, body='hi')
+
+    def unread(self, user):
+        return User.objects.get(id=user.id).unread_private_messages
+
+    def conversation_unread(self, user, other):
+        return Conversation.objects.get(
+            user_a_id=min(user.id, other.id), user_b_id=max(user.id, other.id),
+        ).unread_for(user)
+
+    def test_new_messages_are_unread(self):
+        self.assertEqual((self.unread(self.alice), self.unread(self.bob)), (3, 0))
+        self.assertEqual(self.conversation_unread(self.alice, self.bob), 2)
+        self.assertEqual(self.conversation_unread(self.bob, self.alice), 0)
+
+    def test_reading_a_conversation(self):
+        alice = User.objects.get(id=self.alice.id)
+        mark_read(alice, self.bob)
+        self.assertEqual(alice.unread_private_messages, 1)
+        self.assertEqual(self.unread(self.alice), 1)
+        self.assertEqual(self.conversation_unread(self.alice, self.bob), 0)
+        # nothing left to read
+        mark_read(alice, self.bob)
+        self.assertEqual(self.unread(self.alice), 1)
+
+    def test_deleting_messages(self):
+        PrivateMessage.objects.filter(sender=self.bob).first().delete()
+        self.assertEqual(self.unread(self.alice), 2)
+        self.assertEqual(self.conversation_unread(self.alice, self.bob), 1)
+
+        PrivateMessage.objects.filter(sender=self.carol).update(read=True)
+        mark_read(self.alice, self.carol)
+        PrivateMessage.objects.filter(sender=self.carol).delete()
+        self.assertEqual(self.unread(self.alice), 1)
+
+    def test_deleting_the_sender(self):
+        self.bob.delete()
+        self.assertEqual(self.unread(self.alice), 1)
+
+    def test_profile_update_keeps_the_counter(self):
+        # an earlier test's user with the same id may still be in the user cache
+        cache.clear()
+        self.client.force_login(self.alice)
+        # caches request.user with three unread messages
+        self.client.get('/update-user/', HTTP_HOST='localhost')
+        PrivateMessage.objects.create(sender=self.bob, recipient=self.alice, body='one more')
+        response = self.client.post('/update-user/', {
+            'fullname': 'Alice', 'username': 'alice', 'email': 'alice@example.com', 'bio': 'hello',
+        }, HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 302)
+        alice = User.objects.get(id=self.alice.id)
+        self.assertEqual((alice.fullname, alice.unread_private_messages), ('Alice', 4))
+
+
+class ConcurrentUnreadTests(TransactionTestCase):
+    def test_concurrent_increments_add_up(self):
+        alice, = make_users('alice')
+        barrier = threading.Barrier(8)
+
+        def increment():
+            while True:
+                try:
+                    with transaction.atomic():
+                        add_unread({alice.id: 1})
+                    return
+                except OperationalError as error:
+                    # the in-memory test database locks whole tables, a failed write is retried, it is
+                    # never lost silently
+                    if 'locked' not in str(error):
+                        raise
+                    time.sleep(0.001)
+
+        def worker():
+            barrier.wait()
+            try:
+                for _ in range(5):
+                    increment()
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(User.objects.get(id=alice.id).unread_private_messages, 40)
@@ -0,0 +1,43 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+
+from blogApp.backends import forget_users
+
+
+User = get_user_model()
+
+
+def add_unread(counts):
+    # counts maps recipient id -> number of new messages
+    for user_id, count in counts.items():
+        User.objects.filter(id=user_id).update(unread_private_messages=F('unread_private_messages') + count)
+    transaction.on_commit(lambda: unread_changed(list(counts)))
+
+
+def remove_unread(counts):
+    # counts maps user id -> number of messages no longer unread
+    for user_id, count in counts.items():
+        User.objects.filter(id=user_id).update(
+            unread_private_messages=Greatest(F('unread_private_messages') - count, Value(0)),
+        )
+    transaction.on_commit(lambda: unread_changed(list(counts)))
+
+
+def unread_changed(user_ids):
+    # the counter is part of the cached request.user
+    forget_users(*user_ids)
+    push_unread(user_ids)
+
+
+# Sends the new totals to every open NotificationConsumer of these users
+def push_unread(user_ids):
+    layer = get_channel_layer()
+    if layer is None:
+        return
+    totals = User.objects.filter(id__in=user_ids).values_list('id', 'unread_private_messages')
+    for user_id, total in totals:
+        async_to_sync(layer.group_send)(f'user_{user_id}', {'type': 'unread_count', 'total': total})
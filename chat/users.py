@@ -0,0 +1,74 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+
+
+class UserIdCache:
+    # username -> id lookups shared by every consumer in the process, LRU bounded with a TTL
+
+    def __init__(self, maxsize=10000, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._usernames = {}
+        self._lock = threading.Lock()
+
+    def get(self, username):
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None:
+                return None
+            user_id, expires = entry
+            if expires < time.monotonic():
+                self._drop(username)
+                return None
+            self._entries.move_to_end(username)
+            return user_id
+
+    def set(self, username, user_id):
+        with self._lock:
+            old_username = self._usernames.get(user_id)
+            if old_username is not None and old_username != username:
+                self._drop(old_username)
+            self._entries[username] = (user_id, time.monotonic() + self.ttl)
+            self._entries.move_to_end(username)
+            self._usernames[user_id] = username
+            while len(self._entries) > self.maxsize:
+                evicted, (evicted_id, _) = self._entries.popitem(last=False)
+                self._usernames.pop(evicted_id, None)
+
+    def invalidate(self, user_id, username=None):
+        with self._lock:
+            old_username = self._usernames.pop(user_id, None)
+            for name in (old_username, username):
+                if name is not None:
+                    self._entries.pop(name, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._usernames.clear()
+
+    def _drop(self, username):
+        entry = self._entries.pop(username, None)
+        if entry is not None:
+            self._usernames.pop(entry[0], None)
+
+
+user_id_cache = UserIdCache(
+    maxsize=getattr(settings, 'CHAT_USER_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'CHAT_USER_CACHE_TTL', 300),
+)
+
+
+def resolve_user_id(username):
+    user_id = user_id_cache.get(username)
+    if user_id is not None:
+        return user_id
+    user_id = get_user_model().objects.filter(username=username).values_list('id', flat=True).first()
+    if user_id is not None:
+        user_id_cache.set(username, user_id)
+    return user_id
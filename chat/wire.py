@@ -0,0 +1,134 @@
+import asyncio
+import json
+import logging
+
+import cbor2
+import msgpack
+from django.conf import settings
+
+
+# Frames are JSON objects, one event per frame, unless the client asks for one of the subprotocols
+# below. With a subprotocol, every frame from the server is an array of events. Events are collected
+# for BATCH_WINDOW seconds per connection, so a burst of messages goes out in one frame.
+
+logger = logging.getLogger(__name__)
+
+BATCH_WINDOW = getattr(settings, 'CHAT_BATCH_WINDOW', 0.005)
+
+
+class JSONCodec:
+    subprotocol = None
+    batched = False
+
+    def frame(self, data):
+        return {'text_data': json.dumps(data)}
+
+    def load(self, text_data=None, bytes_data=None):
+        return json.loads(text_data if text_data is not None else bytes_data)
+
+
+class BatchedJSONCodec(JSONCodec):
+    subprotocol = 'devden.json'
+    batched = True
+
+
+class MsgpackCodec:
+    subprotocol = 'devden.msgpack'
+    batched = True
+
+    def frame(self, data):
+        return {'bytes_data': msgpack.packb(data, use_bin_type=True)}
+
+    def load(self, text_data=None, bytes_data=None):
+        if bytes_data is None:
+            return json.loads(text_data)
+        return msgpack.unpackb(bytes_data, raw=False, strict_map_key=False)
+
+
+class CBORCodec:
+    subprotocol = 'devden.cbor'
+    batched = True
+
+    def frame(self, data):
+        return {'bytes_data': cbor2.dumps(data)}
+
+    def load(self, text_data=None, bytes_data=None):
+        if bytes_data is None:
+            return json.loads(text_data)
+        return cbor2.loads(bytes_data)
+
+
+CODECS = {codec.subprotocol: codec for codec in (JSONCodec(), BatchedJSONCodec(), MsgpackCodec(), CBORCodec())}
+
+
+def negotiate(subprotocols):
+    # the first protocol the client offers that the server knows, plain JSON otherwise
+    for subprotocol in subprotocols:
+        if subprotocol in CODECS:
+            return CODECS[subprotocol]
+    return CODECS[None]
+
+
+class WireMixin:
+    # For AsyncWebsocketConsumer subclasses: accept_wire() instead of accept(), send_event() instead of
+    # send(text_data=json.dumps(...)) and receive_event() instead of receive().
+
+    codec = CODECS[None]
+    batch_window = BATCH_WINDOW
+
+    async def accept_wire(self):
+        self.codec = negotiate(self.scope.get('subprotocols') or [])
+        self._outbox = []
+        self._flush_task = None
+        await self.accept(subprotocol=self.codec.subprotocol)
+
+    async def send_event(self, event):
+        if not self.codec.batched:
+            await self.send(**self.codec.frame(event))
+            return
+        self._outbox.append(event)
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.batch_window)
+        self._flush_task = None
+        await self._flush()
+
+    async def _flush(self):
+        events, self._outbox = self._outbox, []
+        if not events:
+            return
+        try:
+            await self.send(**self.codec.frame(events))
+        except Exception:
+            # nobody awaits the flush task, so a failure would only surface as an unretrieved exception
+            logger.exception('Could not send %s events', len(events))
+
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            data = self.codec.load(text_data, bytes_data)
+        except ValueError:
+            return
+        for event in data if isinstance(data, list) else [data]:
+            if isinstance(event, dict):
+                await self.receive_event(event)
+
+    async def receive_event(self, data):
+        pass
+
+    async def close(self, code=None, reason=None):
+        # events still waiting for the batch window go out before the close frame
+        if getattr(self, '_flush_task', None) is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+            await self._flush()
+        await super().close(code=code, reason=reason)
+
+    async def websocket_disconnect(self, message):
+        # the client is gone, what is still batched can not be delivered any more
+        if getattr(self, '_flush_task', None) is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+            self._outbox = []
+        await super().websocket_disconnect(message)
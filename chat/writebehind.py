@@ -0,0 +1,141 @@
+import asyncio
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import DataError, IntegrityError, OperationalError, transaction
+
+from .models import PrivateMessage
+from .conversations import record_messages
+from blogApp.writes import is_busy, write_queue
+
+
+logger = logging.getLogger(__name__)
+
+# a batch that keeps finding the database locked is given up after this many flushes
+MAX_RETRIES = 5
+
+
+def write_batch(messages):
+    # client ids make a batch safe to replay, anything already stored is skipped
+    seen = set(
+        PrivateMessage.objects.filter(client_id__in=[m.client_id for m in messages])
+        .values_list('client_id', flat=True)
+    )
+    fresh = []
+    for message in messages:
+        if message.client_id not in seen:
+            seen.add(message.client_id)
+            fresh.append(message)
+    if not fresh:
+        return []
+    try:
+        with transaction.atomic():
+            PrivateMessage.objects.bulk_create(fresh)
+            record_messages(fresh)
+    except (IntegrityError, DataError):
+        # one bad row, e.g. a sender deleted meanwhile, must not take the rest of the batch with it
+        return [message for message in fresh if _write_one(message)]
+    return fresh
+
+
+def _write_one(message):
+    message.pk = None
+    message._state.adding = True
+    try:
+        # save() records the message on its conversation through the post_save signal
+        with transaction.atomic():
+            message.save()
+    except (IntegrityError, DataError):
+        logger.exception(
+            'Dropping chat message %s from %s to %s', message.client_id, message.sender_id, message.recipient_id,
+        )
+        return False
+    return True
+
+
+class MessageBuffer:
+    # Collects chat messages in arrival order and writes them with one bulk insert per batch
+
+    def __init__(self, batch_size=100, interval=0.005):
+        self.batch_size = batch_size
+        self.interval = interval
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = None
+        self._timer = None
+        # the batch being written right now and how often writing it found the database locked
+        self._inflight = []
+        self._retries = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    async def add(self, message):
+        with self._lock:
+            self._pending.append(message)
+            size = len(self._pending)
+        if size >= self.batch_size:
+            await self.flush()
+        elif self._timer is None:
+            loop = asyncio.get_running_loop()
+            self._timer = loop.call_later(self.interval, lambda: loop.create_task(self.flush()))
+
+    def _take(self):
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return batch
+
+    def _requeue(self, batch):
+        with self._lock:
+            self._pending[:0] = batch
+
+    async def flush(self):
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        # batches are written one at a time so rows keep the order they were broadcast in
+        async with self._flush_lock:
+            batch = self._take()
+            if not batch:
+                return
+            self._inflight = batch
+            try:
+                await write_queue.acall(write_batch, batch)
+            except OperationalError as error:
+                if not is_busy(error) or self._retries >= MAX_RETRIES:
+                    logger.exception('Dropping %d buffered chat messages', len(batch))
+                    self._retries = 0
+                    return
+                self._retries += 1
+                logger.warning('Database busy, retrying %d buffered chat messages later', len(batch))
+                self._requeue(batch)
+                loop = asyncio.get_running_loop()
+                self._timer = loop.call_later(
+                    self.interval * 100 * 2 ** self._retries, lambda: loop.create_task(self.flush()),
+                )
+            except Exception:
+                logger.exception('Dropping %d buffered chat messages', len(batch))
+                self._retries = 0
+            else:
+                self._retries = 0
+            finally:
+                self._inflight = []
+
+    def flush_sync(self):
+        # a batch still in flight on the writer thread is written again, stored rows are skipped
+        batch = self._inflight + self._take()
+        if batch:
+            write_batch(batch)
+
+
+message_buffer = MessageBuffer(
+    batch_size=getattr(settings, 'CHAT_WRITE_BEHIND_BATCH_SIZE', 100),
+    interval=getattr(settings, 'CHAT_WRITE_BEHIND_INTERVAL', 0.005),
+)
+
+# whatever is still buffered when the worker stops gets written before exit
+atexit.register(message_buffer.flush_sync)
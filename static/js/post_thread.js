@@ -0,0 +1,125 @@
+(function(){
+  const thread = document.getElementById('post-thread');
+  if(!thread) return;
+
+  const postId = thread.dataset.postId;
+  const userId = parseInt(thread.dataset.userId, 10);
+  const template = document.getElementById('thread-template');
+  const commentForm = document.querySelector('.comment-form form');
+  const commentInput = commentForm ? commentForm.querySelector('input[name="body"]') : null;
+  const participantCount = document.getElementById('participant-count');
+  const participantList = document.querySelector('.participants__list');
+  const PARTICIPANT_PREVIEW_SIZE = 20;
+
+  function isOpen(){
+    return socket.isOpen() && !Number.isNaN(userId);
+  }
+
+  function findThread(id){
+    return thread.querySelector(`.thread[data-message-id="${id}"]`);
+  }
+
+  function renderComment(comment){
+    const node = template.content.firstElementChild.cloneNode(true);
+    node.dataset.messageId = comment.id;
+    node.querySelector('.thread__authorInfo').href = `/profile/${comment.user.id}/`;
+    node.querySelector('.thread__authorInfo img').src = comment.user.avatar;
+    node.querySelector('.thread__username').textContent = `@${comment.user.username}`;
+    node.querySelector('.thread__details').textContent = comment.body;
+    node.querySelectorAll('.thread__owner').forEach(function(link){
+      if(comment.user.id === userId) link.href = link.dataset.href.replace('/0/', `/${comment.id}/`);
+      else link.remove();
+    });
+    return node;
+  }
+
+  function addParticipant(user){
+    if(participantList.querySelector(`a.participant[href="/profile/${user.id}/"]`)) return;
+    const count = parseInt(participantCount.dataset.count, 10) + 1;
+    participantCount.dataset.count = count;
+    participantCount.textContent = `(${count} Joined)`;
+    if(participantList.querySelectorAll('a.participant').length >= PARTICIPANT_PREVIEW_SIZE) return;
+
+    const link = document.createElement('a');
+    link.className = 'participant';
+    link.href = `/profile/${user.id}/`;
+    const avatar = document.createElement('div');
+    avatar.className = 'avatar avatar--medium';
+    const img = document.createElement('img');
+    img.src = user.avatar;
+    avatar.appendChild(img);
+    const name = document.createElement('p');
+    name.textContent = user.fullname || '';
+    const username = document.createElement('span');
+    username.textContent = `@${user.username}`;
+    name.appendChild(username);
+    link.appendChild(avatar);
+    link.appendChild(name);
+    participantList.appendChild(link);
+  }
+
+  function setVotes(up, down){
+    document.querySelectorAll('.vote-count-up').forEach(function(el){ el.textContent = up; });
+    document.querySelectorAll('.vote-count-down').forEach(function(el){ el.textContent = down; });
+    document.querySelectorAll('.vote-count-net').forEach(function(el){ el.textContent = up + down; });
+  }
+
+  const socket = openEventSocket(`/ws/post/${postId}/`, {
+    onEvent: function(data){
+      if(data.type === 'comment'){
+        if(!findThread(data.comment.id)) thread.insertBefore(renderComment(data.comment), thread.firstChild);
+      }else if(data.type === 'comment_edited'){
+        const node = findThread(data.id);
+        if(node) node.querySelector('.thread__details').textContent = data.body;
+      }else if(data.type === 'comment_deleted'){
+        const node = findThread(data.id);
+        if(node) node.remove();
+      }else if(data.type === 'votes'){
+        setVotes(data.up, data.down);
+      }else if(data.type === 'vote'){
+        document.querySelectorAll('.vote-btn.upvote').forEach(function(el){ el.classList.toggle('active', data.value === 1); });
+        document.querySelectorAll('.vote-btn.downvote').forEach(function(el){ el.classList.toggle('active', data.value === -1); });
+      }else if(data.type === 'participant'){
+        if(participantList) addParticipant(data.user);
+      }else if(data.type === 'error'){
+        alert(data.error);
+      }
+    },
+  });
+
+  // without an open socket every form and link below falls back to a normal request
+  if(commentForm){
+    commentForm.addEventListener('submit', function(ev){
+      if(!isOpen()) return;
+      ev.preventDefault();
+      const body = commentInput.value.trim();
+      if(!body) return;
+      socket.send({action: 'comment', body: body});
+      commentInput.value = '';
+    });
+  }
+
+  document.querySelectorAll('.vote-btn').forEach(function(button){
+    button.addEventListener('click', function(ev){
+      if(!isOpen()) return;
+      ev.preventDefault();
+      socket.send({action: 'vote', value: button.classList.contains('upvote') ? 1 : -1});
+    });
+  });
+
+  thread.addEventListener('click', function(ev){
+    const link = ev.target.closest('a');
+    const node = link && link.closest('.thread');
+    if(!node || !isOpen()) return;
+    const id = parseInt(node.dataset.messageId, 10);
+    if(link.querySelector('.thread__delete')){
+      ev.preventDefault();
+      if(confirm('Delete this comment?')) socket.send({action: 'delete', id: id});
+    }else if(link.querySelector('.thread__edit')){
+      ev.preventDefault();
+      const current = node.querySelector('.thread__details').textContent.trim();
+      const body = prompt('Edit your comment', current);
+      if(body && body.trim() && body.trim() !== current) socket.send({action: 'edit', id: id, body: body.trim()});
+    }
+  });
+})();
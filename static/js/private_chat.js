@@ -5,32 +5,72 @@
   const chatInput = document.getElementById('chat-input');
   if(!username) return;
 
-  const protocol = window.location.protocol === 'https:' ? 'wss' : 'ws';
-  const wsPath = `${protocol}://${window.location.host}/ws/pm/${username}/`;
-  const socket = new WebSocket(wsPath);
-  const notificationSocket = new WebSocket(
-    `${protocol}://${window.location.host}/ws/notifications/`
-  );
+  const loadOlderButton = document.getElementById('chat-load-older');
 
-  socket.onopen = function(){
-    console.log('Private chat websocket opened', wsPath);
-  };
+  function renderMessage(data){
+    const div = document.createElement('div');
+    const sender = data.sender;
+    div.className = 'chat-message';
+    if(sender === window.__USERNAME) div.classList.add('from-me'); else div.classList.add('from-them');
+    if(data.id) div.dataset.id = data.id;
+    const name = document.createElement('strong');
+    name.textContent = sender;
+    div.appendChild(name);
+    div.appendChild(document.createTextNode(`: ${data.message}`));
+    return div;
+  }
 
-  socket.onmessage = function(e){
-    try{
-      const data = JSON.parse(e.data);
-      alert(`🔔 ${data.sender}: ${data.message}`);
-      const div = document.createElement('div');
-      const sender = data.sender;
-      div.className = 'chat-message';
-      if(sender === window.__USERNAME) div.classList.add('from-me'); else div.classList.add('from-them');
-      div.innerHTML = `<strong>${sender}</strong>: ${data.message}`;
-      chatBox.appendChild(div);
+  function prependHistory(data){
+    const anchor = loadOlderButton.nextSibling;
+    const previousHeight = chatBox.scrollHeight;
+    data.messages.forEach(function(m){ chatBox.insertBefore(renderMessage(m), anchor); });
+    chatBox.scrollTop += chatBox.scrollHeight - previousHeight;
+    if(data.messages.length) loadOlderButton.dataset.before = data.messages[0].id;
+    if(!data.has_more) loadOlderButton.remove();
+    loadOlderButton.disabled = false;
+  }
+
+  if(loadOlderButton){
+    loadOlderButton.addEventListener('click', function(){
+      const before = parseInt(loadOlderButton.dataset.before, 10);
+      loadOlderButton.disabled = true;
+      if(socket.isOpen()){
+        socket.send({action: 'load_history', before: before});
+        return;
+      }
+      fetch(`${loadOlderButton.dataset.url}?before=${before}`)
+        .then(function(response){ return response.json(); })
+        .then(prependHistory);
+    });
+  }
+
+  // a burst of messages arrives as one frame, scroll once for all of it
+  let scrollPending = false;
+  function scrollToBottom(){
+    if(scrollPending) return;
+    scrollPending = true;
+    requestAnimationFrame(function(){
+      scrollPending = false;
       chatBox.scrollTop = chatBox.scrollHeight;
-    }catch(err){ console.error(err); }
-  };
+    });
+  }
 
-  socket.onclose = function(){ console.log('chat socket closed'); };
+  const socket = openEventSocket(`/ws/pm/${username}/`, {
+    onEvent: function(data){
+      if(data.type === 'history'){
+        prependHistory(data);
+        return;
+      }
+      if(data.type === 'presence'){
+        const dot = document.getElementById('chat-presence');
+        if(dot) dot.classList.toggle('online', Object.values(data.online).some(Boolean));
+        return;
+      }
+      chatBox.appendChild(renderMessage(data));
+      scrollToBottom();
+    },
+    onClose: function(){ console.log('chat socket closed'); },
+  });
 
   // fallback to regular POST submit
   chatForm.addEventListener('submit', function(ev){
@@ -38,8 +78,9 @@
     const val = chatInput.value.trim();
     if(!val) return;
     // try send via websocket first
-    if(socket.readyState === WebSocket.OPEN){
-      socket.send(JSON.stringify({message: val}));
+    if(socket.isOpen()){
+      const clientId = window.crypto && crypto.randomUUID ? crypto.randomUUID() : undefined;
+      socket.send({message: val, client_id: clientId});
       chatInput.value = '';
       return;
     }
@@ -67,3 +67,81 @@ if (photoInput)
 // Scroll to Bottom
 const conversationThread = document.querySelector(".room__box");
 if (conversationThread) conversationThread.scrollTop = conversationThread.scrollHeight;
+
+// Infinite scroll for the post feed
+const loadFeedPage = (sentinel, observer) => {
+  observer.unobserve(sentinel);
+  fetch(sentinel.dataset.url, { headers: { "HX-Request": "true" } })
+    .then((response) => response.text())
+    .then((html) => {
+      sentinel.insertAdjacentHTML("afterend", html);
+      const next = sentinel.parentElement.querySelector(".feed-more:not([data-loaded])");
+      sentinel.remove();
+      if (next && next !== sentinel) observer.observe(next);
+    });
+  sentinel.dataset.loaded = "true";
+};
+
+const feedSentinel = document.querySelector(".feed-more");
+if (feedSentinel && "IntersectionObserver" in window) {
+  const feedObserver = new IntersectionObserver((entries, observer) => {
+    entries.forEach((entry) => {
+      if (entry.isIntersecting) loadFeedPage(entry.target, observer);
+    });
+  });
+  feedObserver.observe(feedSentinel);
+}
+
+// Message notifications arrive as one summary per burst and show as a toast
+const showNotification = (data) => {
+  let toast = document.querySelector(".notification-toast");
+  if (!toast) {
+    toast = document.createElement("div");
+    toast.className = "notification-toast";
+    document.body.appendChild(toast);
+  }
+  const count = data.count > 1 ? ` (${data.count} new messages)` : "";
+  toast.textContent = `${data.sender}: ${data.message}${count}`;
+  toast.hidden = false;
+  clearTimeout(toast.hideTimer);
+  toast.hideTimer = setTimeout(() => { toast.hidden = true; }, 5000);
+};
+
+// Online dots, e.g. the inbox contact list, the server pushes every change for the watched users
+const showPresence = (online) => {
+  Object.entries(online).forEach(([userId, isOnline]) => {
+    document.querySelectorAll(`[data-presence-user="${userId}"]`).forEach((dot) => {
+      dot.classList.toggle("online", isOnline);
+    });
+  });
+};
+
+// Live unread badge, the server pushes the new total whenever it changes
+const unreadBadges = document.querySelectorAll("[data-unread-badge]");
+if (unreadBadges.length) {
+  const watchedUsers = [...new Set(
+    [...document.querySelectorAll("[data-presence-user]")].map((dot) => Number(dot.dataset.presenceUser))
+  )];
+  const notificationSocket = openEventSocket("/ws/notifications/", {
+    onOpen: () => {
+      if (watchedUsers.length) {
+        notificationSocket.send({ action: "watch_presence", users: watchedUsers });
+      }
+    },
+    onEvent: (data) => {
+      if (data.type === "notification") {
+        showNotification(data);
+        return;
+      }
+      if (data.type === "presence") {
+        showPresence(data.online);
+        return;
+      }
+      if (data.type !== "unread") return;
+      unreadBadges.forEach((badge) => {
+        badge.textContent = data.total;
+        badge.hidden = !data.total;
+      });
+    },
+  });
+}
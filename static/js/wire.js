@@ -0,0 +1,149 @@
+// WebSocket wire protocol, see chat/wire.py. The socket asks for msgpack (or batched JSON) and
+// falls back to plain JSON frames when the server picks no subprotocol. Every server frame of a
+// negotiated protocol is an array of events.
+(function(){
+  const PROTOCOLS = ['devden.msgpack', 'devden.json'];
+  const textEncoder = new TextEncoder();
+  const textDecoder = new TextDecoder();
+
+  function encode(value){
+    const bytes = [];
+    function pushUint(n, size){
+      for(let shift = (size - 1) * 8; shift >= 0; shift -= 8) bytes.push(Math.floor(n / 2 ** shift) & 0xff);
+    }
+    function write(v){
+      if(v === null || v === undefined){ bytes.push(0xc0); return; }
+      if(v === false){ bytes.push(0xc2); return; }
+      if(v === true){ bytes.push(0xc3); return; }
+      if(typeof v === 'number'){
+        if(Number.isInteger(v) && v >= 0 && v < 2 ** 32){
+          if(v < 0x80) bytes.push(v);
+          else if(v < 0x100){ bytes.push(0xcc); pushUint(v, 1); }
+          else if(v < 0x10000){ bytes.push(0xcd); pushUint(v, 2); }
+          else { bytes.push(0xce); pushUint(v, 4); }
+        }else if(Number.isInteger(v) && v < 0 && v >= -(2 ** 31)){
+          if(v >= -32) bytes.push(v & 0xff);
+          else { bytes.push(0xd2); pushUint(v >>> 0, 4); }
+        }else{
+          const view = new DataView(new ArrayBuffer(8));
+          view.setFloat64(0, v);
+          bytes.push(0xcb, ...new Uint8Array(view.buffer));
+        }
+        return;
+      }
+      if(typeof v === 'string'){
+        const utf8 = textEncoder.encode(v);
+        if(utf8.length < 32) bytes.push(0xa0 | utf8.length);
+        else if(utf8.length < 0x100){ bytes.push(0xd9); pushUint(utf8.length, 1); }
+        else if(utf8.length < 0x10000){ bytes.push(0xda); pushUint(utf8.length, 2); }
+        else { bytes.push(0xdb); pushUint(utf8.length, 4); }
+        utf8.forEach(function(b){ bytes.push(b); });
+        return;
+      }
+      if(Array.isArray(v)){
+        if(v.length < 16) bytes.push(0x90 | v.length);
+        else { bytes.push(0xdd); pushUint(v.length, 4); }
+        v.forEach(write);
+        return;
+      }
+      const keys = Object.keys(v).filter(function(key){ return v[key] !== undefined; });
+      if(keys.length < 16) bytes.push(0x80 | keys.length);
+      else { bytes.push(0xdf); pushUint(keys.length, 4); }
+      keys.forEach(function(key){ write(key); write(v[key]); });
+    }
+    write(value);
+    return new Uint8Array(bytes);
+  }
+
+  function decode(buffer){
+    const view = new DataView(buffer);
+    let offset = 0;
+    function uint(size){
+      let n = 0;
+      for(let i = 0; i < size; i++) n = n * 256 + view.getUint8(offset++);
+      return n;
+    }
+    function str(length){
+      const value = textDecoder.decode(new Uint8Array(buffer, offset, length));
+      offset += length;
+      return value;
+    }
+    function bin(length){
+      const value = new Uint8Array(buffer.slice(offset, offset + length));
+      offset += length;
+      return value;
+    }
+    function array(length){
+      const items = [];
+      for(let i = 0; i < length; i++) items.push(read());
+      return items;
+    }
+    function map(length){
+      const obj = {};
+      for(let i = 0; i < length; i++){ const key = read(); obj[key] = read(); }
+      return obj;
+    }
+    function read(){
+      const type = view.getUint8(offset++);
+      if(type < 0x80) return type;
+      if(type < 0x90) return map(type & 0x0f);
+      if(type < 0xa0) return array(type & 0x0f);
+      if(type < 0xc0) return str(type & 0x1f);
+      if(type >= 0xe0) return type - 0x100;
+      let value;
+      switch(type){
+        case 0xc0: return null;
+        case 0xc2: return false;
+        case 0xc3: return true;
+        case 0xc4: return bin(uint(1));
+        case 0xc5: return bin(uint(2));
+        case 0xc6: return bin(uint(4));
+        case 0xca: value = view.getFloat32(offset); offset += 4; return value;
+        case 0xcb: value = view.getFloat64(offset); offset += 8; return value;
+        case 0xcc: return uint(1);
+        case 0xcd: return uint(2);
+        case 0xce: return uint(4);
+        case 0xcf: return uint(8);
+        case 0xd0: value = view.getInt8(offset); offset += 1; return value;
+        case 0xd1: value = view.getInt16(offset); offset += 2; return value;
+        case 0xd2: value = view.getInt32(offset); offset += 4; return value;
+        case 0xd3: value = Number(view.getBigInt64(offset)); offset += 8; return value;
+        case 0xd9: return str(uint(1));
+        case 0xda: return str(uint(2));
+        case 0xdb: return str(uint(4));
+        case 0xdc: return array(uint(2));
+        case 0xdd: return array(uint(4));
+        case 0xde: return map(uint(2));
+        case 0xdf: return map(uint(4));
+      }
+      throw new Error(`Unsupported msgpack type 0x${type.toString(16)}`);
+    }
+    return read();
+  }
+
+  // handlers: onEvent(data) for every event, optional onOpen() and onClose()
+  window.openEventSocket = function(path, handlers){
+    const protocol = window.location.protocol === 'https:' ? 'wss' : 'ws';
+    const socket = new WebSocket(`${protocol}://${window.location.host}${path}`, PROTOCOLS);
+    socket.binaryType = 'arraybuffer';
+
+    socket.onopen = function(){ if(handlers.onOpen) handlers.onOpen(); };
+    socket.onclose = function(){ if(handlers.onClose) handlers.onClose(); };
+    socket.onmessage = function(e){
+      let data;
+      try{
+        data = typeof e.data === 'string' ? JSON.parse(e.data) : decode(e.data);
+      }catch(err){ console.error(err); return; }
+      (socket.protocol ? data : [data]).forEach(function(event){
+        try{ handlers.onEvent(event); }catch(err){ console.error(err); }
+      });
+    };
+
+    return {
+      isOpen: function(){ return socket.readyState === WebSocket.OPEN; },
+      send: function(data){
+        socket.send(socket.protocol === 'devden.msgpack' ? encode(data) : JSON.stringify(data));
+      },
+    };
+  };
+})();